@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+
+
+class ChangeTracker:
+    # 记录自上次加载/保存以来被修改过的单元格、行高、列宽和合并单元格
+    def __init__(self, table):
+        self.table = table
+        self._suspended = False
+        self.reset()
+        self.table.itemChanged.connect(self.on_item_changed)
+
+    def reset(self):
+        self.cells = set()
+        self.rows = set()
+        self.columns = set()
+        self.merged_cells_changed = False
+        self.structure_changed = False  # 增删行列或排序后行号会错位, 只能整表保存
+
+    @contextmanager
+    def suspended(self):
+        # 加载数据期间的修改不算作用户修改
+        self._suspended = True
+        try:
+            yield
+        finally:
+            self._suspended = False
+
+    def on_item_changed(self, item):
+        if not self._suspended:
+            self.cells.add((item.row(), item.column()))
+
+    def mark_cell(self, row, col):
+        if not self._suspended:
+            self.cells.add((row, col))
+
+    def mark_row(self, row):
+        if not self._suspended:
+            self.rows.add(row)
+
+    def mark_column(self, col):
+        if not self._suspended:
+            self.columns.add(col)
+
+    def mark_merged_cells(self):
+        if not self._suspended:
+            self.merged_cells_changed = True
+
+    def mark_structure(self):
+        if not self._suspended:
+            self.structure_changed = True
+
+    def has_changes(self):
+        return bool(self.cells or self.rows or self.columns or self.merged_cells_changed or self.structure_changed)
@@ -4,9 +4,10 @@ from PySide6.QtCore import Qt
 from PySide6.QtGui import QColor
 from function.option import TableOperations
 class MenuOperations:
-    def __init__(self, table):
+    def __init__(self, table, change_tracker=None):
         self.table = table  # 表格对象
-        self.table_operations = TableOperations(table)
+        self.table_operations = TableOperations(table, change_tracker)
+        self.change_tracker = self.table_operations.change_tracker
 
         # 连接信号和槽
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -109,6 +110,7 @@ class MenuOperations:
                 if alignment:
                     new_item.setData(Qt.TextAlignmentRole, alignment)
                 self.table.setItem(row, column, new_item)
+                self.change_tracker.mark_cell(row, column)  # setItem 不会触发 itemChanged
                 QTextEdit.focusOutEvent(text_edit, event)
 
             text_edit.focusOutEvent = focus_out_event
@@ -2,9 +2,11 @@ from PySide6.QtWidgets import QTableWidgetItem,QInputDialog
 from PySide6.QtCore import Qt
 from PySide6.QtWidgets import QColorDialog
 from PySide6.QtGui import QColor
+from function.change_tracker import ChangeTracker
 class TableOperations:
-    def __init__(self, table):
+    def __init__(self, table, change_tracker=None):
         self.table = table  # 保存对表格控件的引用
+        self.change_tracker = change_tracker or ChangeTracker(table)  # 记录修改, 用于增量保存
 
     def clear_cells(self):
         for item in self.table.selectedItems():  # 遍历表格中每个选中的单元格
@@ -14,6 +16,7 @@ class TableOperations:
         rows = sorted(set(index.row() for index in self.table.selectedIndexes()))  # 获取所有选中单元格的行号，并去重、排序
         count = len(rows)  # 计算选中行的数量
         insert_at = rows[0] if above else rows[-1] + 1  # 判断是在上方还是下方添加行，并确定插入位置
+        self.change_tracker.mark_structure()  # 插入行后行号整体错位
         for _ in range(count):  # 根据选中行的数量重复添加行
             self.table.insertRow(insert_at)  # 在指定位置插入行
             for column in range(self.table.columnCount()):  # 遍历所有列
@@ -27,6 +30,7 @@ class TableOperations:
         columns = sorted(set(index.column() for index in self.table.selectedIndexes()))  # 获取所有选中单元格的列号，并去重、排序
         count = len(columns)  # 计算选中列的数量
         insert_at = columns[0] if left else columns[-1] + 1  # 判断是在左侧还是右侧添加列，并确定插入位置
+        self.change_tracker.mark_structure()  # 插入列后列号整体错位
         for _ in range(count):  # 根据选中列的数量重复添加列
             self.table.insertColumn(insert_at)  # 在指定位置插入列
             for row in range(self.table.rowCount()):  # 遍历所有行
@@ -38,11 +42,15 @@ class TableOperations:
 
     def delete_rows(self):
         rows = sorted(set(index.row() for index in self.table.selectedIndexes()), reverse=True)  # 获取所有选中行的行号，并去重、倒序排序
+        if rows:
+            self.change_tracker.mark_structure()
         for row in rows:  # 遍历所有选中的行
             self.table.removeRow(row)  # 删除行
 
     def delete_columns(self):
         columns = sorted(set(index.column() for index in self.table.selectedIndexes()), reverse=True)  # 获取所有选中列的列号，并去重、倒序排序
+        if columns:
+            self.change_tracker.mark_structure()
         for col in columns:  # 遍历所有选中的列
             self.table.removeColumn(col)  # 删除列
 
@@ -56,6 +64,7 @@ class TableOperations:
     
     def sort_table_by_column(self, column, order=Qt.AscendingOrder):
         self.table.sortItems(column, order)  # 根据指定列和顺序对表格进行排序
+        self.change_tracker.mark_structure()  # 排序会改变所有行的位置
 
     def set_cell_color(self):
         color = QColorDialog.getColor()  # 打开颜色选择对话框
@@ -73,6 +82,7 @@ class TableOperations:
         if ok:  # 如果用户点击确认
             for row in rows:
                 self.table.setRowHeight(row, height)  # 设置行高
+                self.change_tracker.mark_row(row)
 
     def set_col_width(self):
         cols = set(index.column() for index in self.table.selectedIndexes())  # 获取所有选中的列
@@ -80,6 +90,7 @@ class TableOperations:
         if ok:  # 如果用户点击确认
             for col in cols:
                 self.table.setColumnWidth(col, width)  # 设置列宽
+                self.change_tracker.mark_column(col)
 
     def set_font_size(self):
         size, ok = QInputDialog.getInt(self.table, "Set Font Size", "Enter new font size:", 10, 1, 100, 1)  # 打开输入对话框获取新的字体大小
@@ -182,6 +193,7 @@ class TableOperations:
 
         # 设置跨度和在左上角单元格中设置文本
         self.table.setSpan(top_row, left_col, bottom_row - top_row + 1, right_col - left_col + 1)
+        self.change_tracker.mark_merged_cells()
         if not self.table.item(top_row, left_col):
             self.table.setItem(top_row, left_col, QTableWidgetItem())
         top_left_item = self.table.item(top_row, left_col)
@@ -214,6 +226,7 @@ class TableOperations:
                     # 只有当单元格是合并的一部分时才取消合并
                     if table.rowSpan(row, col) > 1 or table.columnSpan(row, col) > 1:
                         table.setSpan(row, col, 1, 1)
+                        self.change_tracker.mark_merged_cells()
                     item = table.item(row, col)
                     if not item:
                         item = QTableWidgetItem()
@@ -2,6 +2,7 @@ from PySide6.QtWidgets import QMainWindow,QInputDialog, QVBoxLayout, QWidget, QT
 from PySide6.QtGui import QColor
 from PySide6.QtCore import Qt
 from function.menu_base import MenuOperations
+from function.change_tracker import ChangeTracker
 class TableWidget(QWidget):
     def __init__(self, table=None):
         super().__init__()
@@ -19,7 +20,8 @@ class TableWidget(QWidget):
         else:
             self.table = table
 
-        self.menu_operations = MenuOperations(self.table)
+        self.change_tracker = ChangeTracker(self.table)  # 记录修改过的单元格, 用于增量保存
+        self.menu_operations = MenuOperations(self.table, self.change_tracker)
         self.table.cellDoubleClicked.connect(self.menu_operations.on_cell_double_clicked)
 
         layout = QVBoxLayout(self)
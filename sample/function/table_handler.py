@@ -9,42 +9,36 @@ class TableHandler:
         self.table_widget = table_widget
         self.db_handler = db_handler
 
-    def save_data(self):
-        table = self.table_widget.get_table()
-        data = []
-        for row in range(table.rowCount()):
-            row_data = {}
-            for col in range(table.columnCount()):
-                item = table.item(row, col)
-                if item:
-                    font = item.font()
-                    row_data[str(col)] = {
-                        'text': item.text(),
-                        'foreground': item.foreground().color().name(),
-                        'background': item.background().color().name(),
-                        'alignment': item.textAlignment(),
-                        'font': {
-                            'bold': font.bold(),
-                            'size': font.pointSize()
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
-                else:
-                    row_data[str(col)] = {
-                        'text': '',
-                        'foreground': QColor(Qt.black).name(),
-                        'background': QColor(Qt.white).name(),
-                        'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
-                        'font': {
-                            'bold': False,
-                            'size': 10
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
-            data.append(row_data)
-
+    def serialize_cell(self, table, row, col):
+        item = table.item(row, col)
+        if item:
+            font = item.font()
+            return {
+                'text': item.text(),
+                'foreground': item.foreground().color().name(),
+                'background': item.background().color().name(),
+                'alignment': item.textAlignment(),
+                'font': {
+                    'bold': font.bold(),
+                    'size': font.pointSize()
+                },
+                'row_height': table.rowHeight(row),
+                'column_width': table.columnWidth(col)
+            }
+        return {
+            'text': '',
+            'foreground': QColor(Qt.black).name(),
+            'background': QColor(Qt.white).name(),
+            'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
+            'font': {
+                'bold': False,
+                'size': 10
+            },
+            'row_height': table.rowHeight(row),
+            'column_width': table.columnWidth(col)
+        }
+
+    def collect_merged_cells(self, table):
         merged_cells = []
         for row in range(table.rowCount()):
             for col in range(table.columnCount()):
@@ -55,6 +49,51 @@ class TableHandler:
                         'row_span': table.rowSpan(row, col),
                         'col_span': table.columnSpan(row, col)
                     })
+        return merged_cells
+
+    def build_patch(self, table):
+        # 只包含自上次加载/保存以来修改过的单元格、行高、列宽
+        tracker = self.table_widget.change_tracker
+        patch = {
+            'cells': [{'row': row, 'col': col, 'data': self.serialize_cell(table, row, col)}
+                      for row, col in sorted(tracker.cells)
+                      if row < table.rowCount() and col < table.columnCount()],
+            'rows': [{'row': row, 'row_height': table.rowHeight(row)}
+                     for row in sorted(tracker.rows) if row < table.rowCount()],
+            'columns': [{'col': col, 'column_width': table.columnWidth(col)}
+                        for col in sorted(tracker.columns) if col < table.columnCount()],
+            'column_count': table.columnCount()
+        }
+        if tracker.merged_cells_changed:
+            patch['merged_cells'] = self.collect_merged_cells(table)
+        return patch
+
+    def save_data(self):
+        table = self.table_widget.get_table()
+        tracker = self.table_widget.change_tracker
+        if not tracker.structure_changed:
+            try:
+                result = self.db_handler.patch_cells(self.build_patch(table)) if tracker.has_changes() else None
+            except ValueError:
+                result = {}  # 数据库中的行数与表格不一致, 退回整表保存
+            # 服务器返回错误 (如 500) 时 patch 未生效, 同样退回整表保存, 不清空修改记录
+            if result is None or (isinstance(result, dict) and result.get("status") == "success"):
+                tracker.reset()
+                QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
+                return
+        self.save_full_data()
+        tracker.reset()
+
+    def save_full_data(self):
+        table = self.table_widget.get_table()
+        data = []
+        for row in range(table.rowCount()):
+            row_data = {}
+            for col in range(table.columnCount()):
+                row_data[str(col)] = self.serialize_cell(table, row, col)
+            data.append(row_data)
+
+        merged_cells = self.collect_merged_cells(table)
 
         self.db_handler.save_table(data)
         self.db_handler.save_merged_cells(merged_cells)
@@ -69,6 +108,7 @@ class TableHandler:
         table = self.table_widget.get_table()
         if table.rowCount() > 0:
             table.removeRow(table.rowCount() - 2)
+            self.table_widget.change_tracker.mark_structure()  # 表格行数已与数据库不一致
         print("数据已刷新")
 
     from openpyxl import Workbook
@@ -135,10 +175,14 @@ class TableHandler:
 
     def load_table_data(self):
         data = self.db_handler.get_table()
+        tracker = self.table_widget.change_tracker
         if data:
-            self.populate_table(data)
+            with tracker.suspended():
+                self.populate_table(data)
+            tracker.reset()
         else:
             self.populate_table_with_default_data()
+            tracker.mark_structure()  # 数据库中没有数据, 首次保存需要整表写入
 
     def populate_table(self, data):
         table = self.table_widget.get_table()
@@ -4,6 +4,7 @@ from PySide6.QtWidgets import QMainWindow, QInputDialog,QVBoxLayout,QColorDialog
 from PySide6.QtGui import QColor, QFont
 from PySide6.QtCore import Qt
 from server.client import MongoClient
+from server.tracing import span
 from function.table import TableWidget
 import json
 from openpyxl import Workbook
@@ -16,50 +17,36 @@ class TableHandler:
         self.table_widget = table_widget
         self.db_handler = db_handler
 
-    def save_data(self):
-        start_time = time.time()
-        table = self.table_widget.get_table()
-
-        # Step 1: Collect data from table
-        step_start_time = time.time()
-        data = []
-        for row in range(table.rowCount()):
-            row_data = {}
-            for col in range(table.columnCount()):
-                item = table.item(row, col)
-                if item:
-                    font = item.font()
-                    row_data[str(col)] = {
-                        'text': item.text(),
-                        'foreground': item.foreground().color().name(),
-                        'background': item.background().color().name(),
-                        'alignment': item.textAlignment(),
-                        'font': {
-                            'bold': font.bold(),
-                            'size': font.pointSize()
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
-                else:
-                    row_data[str(col)] = {
-                        'text': '',
-                        'foreground': QColor(Qt.black).name(),
-                        'background': QColor(Qt.white).name(),
-                        'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
-                        'font': {
-                            'bold': False,
-                            'size': 10
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
-            data.append(row_data)
-        step_end_time = time.time()
-        print(f"Step 1 (Collect data from table) took {step_end_time - step_start_time:.4f} seconds")
-
-        # Step 2: Collect merged cells information
-        step_start_time = time.time()
+    def serialize_cell(self, table, row, col):
+        item = table.item(row, col)
+        if item:
+            font = item.font()
+            return {
+                'text': item.text(),
+                'foreground': item.foreground().color().name(),
+                'background': item.background().color().name(),
+                'alignment': item.textAlignment(),
+                'font': {
+                    'bold': font.bold(),
+                    'size': font.pointSize()
+                },
+                'row_height': table.rowHeight(row),
+                'column_width': table.columnWidth(col)
+            }
+        return {
+            'text': '',
+            'foreground': QColor(Qt.black).name(),
+            'background': QColor(Qt.white).name(),
+            'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
+            'font': {
+                'bold': False,
+                'size': 10
+            },
+            'row_height': table.rowHeight(row),
+            'column_width': table.columnWidth(col)
+        }
+
+    def collect_merged_cells(self, table):
         merged_cells = []
         for row in range(table.rowCount()):
             for col in range(table.columnCount()):
@@ -70,26 +57,86 @@ class TableHandler:
                         'row_span': table.rowSpan(row, col),
                         'col_span': table.columnSpan(row, col)
                     })
+        return merged_cells
+
+    def build_patch(self, table):
+        # 只包含自上次加载/保存以来修改过的单元格、行高、列宽
+        tracker = self.table_widget.change_tracker
+        patch = {
+            'cells': [{'row': row, 'col': col, 'data': self.serialize_cell(table, row, col)}
+                      for row, col in sorted(tracker.cells)
+                      if row < table.rowCount() and col < table.columnCount()],
+            'rows': [{'row': row, 'row_height': table.rowHeight(row)}
+                     for row in sorted(tracker.rows) if row < table.rowCount()],
+            'columns': [{'col': col, 'column_width': table.columnWidth(col)}
+                        for col in sorted(tracker.columns) if col < table.columnCount()],
+            'column_count': table.columnCount()
+        }
+        if tracker.merged_cells_changed:
+            patch['merged_cells'] = self.collect_merged_cells(table)
+        return patch
+
+    def save_data(self):
+        # 一次"保存"操作对应一条 trace, 客户端和服务器的耗时都记在它下面 (需设置 TRACE_FILE)
+        with span("save_data"):
+            tracker = self.table_widget.change_tracker
+            if not tracker.structure_changed and self.save_changes():
+                tracker.reset()
+                QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
+                return
+            self.save_full_data()
+            tracker.reset()
+
+    def save_changes(self):
+        # 只把修改过的单元格发送到服务器, 失败时返回 False 以便退回整表保存
+        tracker = self.table_widget.change_tracker
+        if not tracker.has_changes():
+            return True
+        start_time = time.time()
+        patch = self.build_patch(self.table_widget.get_table())
+        try:
+            result = self.db_handler.patch_cells(patch)
+        except ValueError:
+            return False
+        end_time = time.time()
+        print(f"save_changes ({len(patch['cells'])} cells) took {end_time - start_time:.4f} seconds")
+        return isinstance(result, dict) and result.get("status") == "success"
+
+    def save_full_data(self):
+        start_time = time.time()
+        table = self.table_widget.get_table()
+
+        # Step 1: Collect data from table
+        step_start_time = time.time()
+        with span("collect_table_data"):
+            data = []
+            for row in range(table.rowCount()):
+                row_data = {}
+                for col in range(table.columnCount()):
+                    row_data[str(col)] = self.serialize_cell(table, row, col)
+                data.append(row_data)
         step_end_time = time.time()
-        print(f"Step 2 (Collect merged cells information) took {step_end_time - step_start_time:.4f} seconds")
+        print(f"Step 1 (Collect data from table) took {step_end_time - step_start_time:.4f} seconds")
 
-        # Step 3: Save data to database
+        # Step 2: Collect merged cells information
         step_start_time = time.time()
-        self.db_handler.save_table(data)
+        with span("collect_merged_cells"):
+            merged_cells = self.collect_merged_cells(table)
         step_end_time = time.time()
-        print(f"Step 3 (Save data to database) took {step_end_time - step_start_time:.4f} seconds")
+        print(f"Step 2 (Collect merged cells information) took {step_end_time - step_start_time:.4f} seconds")
 
-        # Step 4: Save merged cells to database
+        # Step 3: Save data and merged cells to database in one batch request
         step_start_time = time.time()
-        self.db_handler.save_merged_cells(merged_cells)
+        self.db_handler.batch().save_table(data).save_merged_cells(merged_cells).execute()
         step_end_time = time.time()
-        print(f"Step 4 (Save merged cells to database) took {step_end_time - step_start_time:.4f} seconds")
+        print(f"Step 3 (Save data to database) took {step_end_time - step_start_time:.4f} seconds")
 
-        # Step 5: Show confirmation message
+        # Step 4: Show confirmation message
         step_start_time = time.time()
-        QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
+        with span("show_message"):
+            QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
         step_end_time = time.time()
-        print(f"Step 5 (Show confirmation message) took {step_end_time - step_start_time:.4f} seconds")
+        print(f"Step 4 (Show confirmation message) took {step_end_time - step_start_time:.4f} seconds")
 
         end_time = time.time()
         print(f"Total save_data execution time: {end_time - start_time:.4f} seconds")
@@ -165,14 +212,21 @@ class TableHandler:
 
 
     def load_table_data(self):
-        response = self.db_handler.get_table()
-        if response["status"] == "success":
-            data = response["data"] # Convert JSON string to dictionary
-            self.populate_table(data)
-        else:
-            self.populate_table_with_default_data()
-
-    def populate_table(self, data):
+        # 表格数据和合并单元格通过一次 /batch 请求读取
+        with span("load_table_data"):
+            response = self.db_handler.batch().get_table().get_merged_cells().execute()
+            tracker = self.table_widget.change_tracker
+            if response["status"] == "success":
+                data = response["results"][0]["data"]
+                merged_cells = response["results"][1]["data"]
+                with tracker.suspended(), span("populate_table"):
+                    self.populate_table(data, merged_cells)
+                tracker.reset()
+            else:
+                self.populate_table_with_default_data()
+                tracker.mark_structure()  # 数据库中没有数据, 首次保存需要整表写入
+
+    def populate_table(self, data, merged_cells=None):
         start_time = time.time()
         table = self.table_widget.get_table()
 
@@ -235,11 +289,11 @@ class TableHandler:
 
         # Step 5: Set merged cells
         step_start_time = time.time()
-        merged_cells = self.db_handler.get_merged_cells()
-        if merged_cells["status"] == "success":
-            merged_cells_data = merged_cells["data"]
-            for cell in merged_cells_data:
-                table.setSpan(int(cell['row']), int(cell['col']), int(cell['row_span']), int(cell['col_span']))
+        if merged_cells is None:
+            response = self.db_handler.get_merged_cells()
+            merged_cells = response["data"] if response["status"] == "success" else []
+        for cell in merged_cells:
+            table.setSpan(int(cell['row']), int(cell['col']), int(cell['row_span']), int(cell['col_span']))
         step_end_time = time.time()
         print(f"Step 5 (Set merged cells) took {step_end_time - step_start_time:.4f} seconds")
 
@@ -12,54 +12,89 @@ from openpyxl.utils import get_column_letter
 import time
 
 class TableHandler:
-    def __init__(self, table_widget, db_handler):
+    def __init__(self, table_widget, db_handler, compact=True):
         self.table_widget = table_widget
         self.db_handler = db_handler
-
-    def save_data(self):
-        start_time = time.time()
-        table = self.table_widget.get_table()
-
-        # Step 1: Collect data from table
-        step_start_time = time.time()
-        data = []
+        self.compact = compact  # 使用样式去重的紧凑格式 (server/compact.py) 收发整表数据
+        self.version = None  # 本地表格对应的服务器版本号, 刷新时只拉取之后的变更
+
+    def use_compact(self):
+        # 服务器不支持紧凑格式 (如 server_async) 时退回普通格式
+        return self.compact and self.db_handler.supports("compact")
+
+    def serialize_cell(self, table, row, col):
+        item = table.item(row, col)
+        if item:
+            font = item.font()
+            return {
+                'text': item.text(),
+                'foreground': item.foreground().color().name(),
+                'background': item.background().color().name(),
+                'alignment': item.textAlignment(),
+                'font': {
+                    'bold': font.bold(),
+                    'size': font.pointSize()
+                },
+                'row_height': table.rowHeight(row),
+                'column_width': table.columnWidth(col)
+            }
+        return {
+            'text': '',
+            'foreground': QColor(Qt.black).name(),
+            'background': QColor(Qt.white).name(),
+            'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
+            'font': {
+                'bold': False,
+                'size': 10
+            },
+            'row_height': table.rowHeight(row),
+            'column_width': table.columnWidth(col)
+        }
+
+    def collect_compact_data(self, table):
+        # 直接从表格生成紧凑格式, 相同样式只保存一次, 行高列宽各保存一份
+        default_style = (QColor(Qt.black).name(), QColor(Qt.white).name(),
+                         int(Qt.AlignLeft | Qt.AlignVCenter), False, 10)
+        styles = []
+        style_ids = {}
+        texts = []
+        style_rows = []
         for row in range(table.rowCount()):
-            row_data = {}
+            row_texts = []
+            row_styles = []
             for col in range(table.columnCount()):
                 item = table.item(row, col)
                 if item:
                     font = item.font()
-                    row_data[str(col)] = {
-                        'text': item.text(),
-                        'foreground': item.foreground().color().name(),
-                        'background': item.background().color().name(),
-                        'alignment': item.textAlignment(),
-                        'font': {
-                            'bold': font.bold(),
-                            'size': font.pointSize()
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
+                    key = (item.foreground().color().name(), item.background().color().name(),
+                           item.textAlignment(), font.bold(), font.pointSize())
+                    text = item.text()
                 else:
-                    row_data[str(col)] = {
-                        'text': '',
-                        'foreground': QColor(Qt.black).name(),
-                        'background': QColor(Qt.white).name(),
-                        'alignment': int(Qt.AlignLeft | Qt.AlignVCenter),
-                        'font': {
-                            'bold': False,
-                            'size': 10
-                        },
-                        'row_height': table.rowHeight(row),
-                        'column_width': table.columnWidth(col)
-                    }
-            data.append(row_data)
-        step_end_time = time.time()
-        print(f"Step 1 (Collect data from table) took {step_end_time - step_start_time:.4f} seconds")
-
-        # Step 2: Collect merged cells information
-        step_start_time = time.time()
+                    key = default_style
+                    text = ''
+                style_id = style_ids.get(key)
+                if style_id is None:
+                    style_id = style_ids[key] = len(styles)
+                    styles.append({
+                        'foreground': key[0],
+                        'background': key[1],
+                        'alignment': key[2],
+                        'font': {'bold': key[3], 'size': key[4]}
+                    })
+                row_texts.append(text)
+                row_styles.append(style_id)
+            texts.append(row_texts)
+            style_rows.append(row_styles)
+        return {
+            'columns': table.columnCount(),
+            'styles': styles,
+            'row_heights': [table.rowHeight(row) for row in range(table.rowCount())],
+            'column_widths': [table.columnWidth(col) for col in range(table.columnCount())],
+            'text': texts,
+            'style': style_rows
+        }
+
+    def collect_merged_cells(self, table):
         merged_cells = []
         for row in range(table.rowCount()):
             for col in range(table.columnCount()):
@@ -70,12 +105,90 @@ class TableHandler:
                         'row_span': table.rowSpan(row, col),
                         'col_span': table.columnSpan(row, col)
                     })
+        return merged_cells
+
+    def build_patch(self, table):
+        # 只包含自上次加载/保存以来修改过的单元格、行高、列宽
+        tracker = self.table_widget.change_tracker
+        patch = {
+            'cells': [{'row': row, 'col': col, 'data': self.serialize_cell(table, row, col)}
+                      for row, col in sorted(tracker.cells)
+                      if row < table.rowCount() and col < table.columnCount()],
+            'rows': [{'row': row, 'row_height': table.rowHeight(row)}
+                     for row in sorted(tracker.rows) if row < table.rowCount()],
+            'columns': [{'col': col, 'column_width': table.columnWidth(col)}
+                        for col in sorted(tracker.columns) if col < table.columnCount()],
+            'column_count': table.columnCount()
+        }
+        if tracker.merged_cells_changed:
+            patch['merged_cells'] = self.collect_merged_cells(table)
+        return patch
+
+    def save_data(self):
+        tracker = self.table_widget.change_tracker
+        if not tracker.structure_changed and self.save_changes():
+            tracker.reset()
+            QMessageBox.information(self.table_widget, "保存成功", "表格数据已保存到数据库")
+            return
+        self.save_full_data()
+        tracker.reset()
+
+    def save_changes(self):
+        # 只把修改过的单元格发送到服务器, 失败时返回 False 以便退回整表保存
+        tracker = self.table_widget.change_tracker
+        if not tracker.has_changes():
+            return True
+        start_time = time.time()
+        patch = self.build_patch(self.table_widget.get_table())
+        try:
+            result = self.db_handler.patch_cells(patch)
+        except ValueError:
+            return False
+        end_time = time.time()
+        print(f"save_changes ({len(patch['cells'])} cells) took {end_time - start_time:.4f} seconds")
+        if not (isinstance(result, dict) and result.get("status") == "success"):
+            return False
+        self.saved_version(result.get("version"))
+        return True
+
+    def saved_version(self, version):
+        # 自己的写入紧接在本地版本之后时才前移版本号; 中间有其他客户端的写入时保持不变, 刷新时一并拉取
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+
+    def save_full_data(self):
+        start_time = time.time()
+        table = self.table_widget.get_table()
+
+        # Step 1: Collect data from table
+        step_start_time = time.time()
+        compact = self.use_compact()
+        if compact:
+            data = self.collect_compact_data(table)
+        else:
+            data = []
+            for row in range(table.rowCount()):
+                row_data = {}
+                for col in range(table.columnCount()):
+                    row_data[str(col)] = self.serialize_cell(table, row, col)
+                data.append(row_data)
+        step_end_time = time.time()
+        print(f"Step 1 (Collect data from table) took {step_end_time - step_start_time:.4f} seconds")
+
+        # Step 2: Collect merged cells information
+        step_start_time = time.time()
+        merged_cells = self.collect_merged_cells(table)
         step_end_time = time.time()
         print(f"Step 2 (Collect merged cells information) took {step_end_time - step_start_time:.4f} seconds")
 
         # Step 3: Save data and merged cells to database
         step_start_time = time.time()
-        self.db_handler.save_all(data, merged_cells)
+        if compact:
+            result = self.db_handler.save_all_compact(data, merged_cells)
+        else:
+            result = self.db_handler.save_all(data, merged_cells)
+        if isinstance(result, dict) and result.get("status") == "success":
+            self.saved_version(result.get("version"))
         step_end_time = time.time()
         print(f"Step 3 (Save data to database) took {step_end_time - step_start_time:.4f} seconds")
 
@@ -91,14 +204,26 @@ class TableHandler:
 
 
     def load_table_data(self):
-        response = self.db_handler.get_all()
-        if response.get("status") == "success":
-            data = response.get("data", {})
-            table_data = data.get("table_data", [])
-            merged_cells = data.get("merged_cells", [])
-            self.populate_table(table_data, merged_cells)
+        compact = self.use_compact()
+        response = self.db_handler.get_all_compact() if compact else self.db_handler.get_all()
+        tracker = self.table_widget.change_tracker
+        success = response.get("status") == "success"
+        data = response.get("data", {}) if success else {}
+        table_data = data.get("table_data", [])
+        merged_cells = data.get("merged_cells", [])
+        has_rows = bool(table_data.get("text")) if isinstance(table_data, dict) else bool(table_data)
+        if has_rows:
+            with tracker.suspended():
+                if compact:
+                    self.populate_table_compact(table_data, merged_cells)
+                else:
+                    self.populate_table(table_data, merged_cells)
+            tracker.reset()
         else:
+            # 数据库中没有数据 (包括新建的空工作表), 显示默认表格, 首次保存需要整表写入
             self.populate_table_with_default_data()
+            tracker.mark_structure()
+        self.version = response.get("version") if success else None
     def populate_table(self, table_data, merged_cells):
         start_time = time.time()
         table = self.table_widget.get_table()
@@ -136,24 +261,7 @@ class TableHandler:
                     col_idx = int(col_idx_str)
                 except ValueError:
                     continue
-
-                if isinstance(cell_data, dict):
-                    item = QTableWidgetItem(cell_data.get('text', ''))
-                    item.setForeground(QColor(cell_data.get('foreground', QColor(Qt.black).name())))
-                    item.setBackground(QColor(cell_data.get('background', QColor(Qt.white).name())))
-                    item.setTextAlignment(cell_data.get('alignment', int(Qt.AlignLeft | Qt.AlignVCenter)))
-                    font = item.font()
-                    font.setBold(cell_data.get('font', {}).get('bold', False))
-                    font.setPointSize(cell_data.get('font', {}).get('size', 10))
-                    item.setFont(font)
-                    table.setItem(row_idx, col_idx, item)
-                    table.setRowHeight(row_idx, cell_data.get('row_height', table.rowHeight(row_idx)))
-                    table.setColumnWidth(col_idx, cell_data.get('column_width', table.columnWidth(col_idx)))
-                else:
-                    item = QTableWidgetItem(cell_data)
-                    item.setForeground(QColor(Qt.black))
-                    item.setBackground(QColor(Qt.white))
-                    table.setItem(row_idx, col_idx, item)
+                self.apply_cell(table, row_idx, col_idx, cell_data)
         step_end_time = time.time()
         print(f"Step 4 (Populate table with data) took {step_end_time - step_start_time:.4f} seconds")
 
@@ -167,13 +275,122 @@ class TableHandler:
         end_time = time.time()
         print(f"Total populate_table execution time: {end_time - start_time:.4f} seconds")
 
-    def refresh_data(self):
+    def apply_cell(self, table, row_idx, col_idx, cell_data):
+        if isinstance(cell_data, dict):
+            item = QTableWidgetItem(cell_data.get('text', ''))
+            item.setForeground(QColor(cell_data.get('foreground', QColor(Qt.black).name())))
+            item.setBackground(QColor(cell_data.get('background', QColor(Qt.white).name())))
+            item.setTextAlignment(cell_data.get('alignment', int(Qt.AlignLeft | Qt.AlignVCenter)))
+            font = item.font()
+            font.setBold(cell_data.get('font', {}).get('bold', False))
+            font.setPointSize(cell_data.get('font', {}).get('size', 10))
+            item.setFont(font)
+            table.setItem(row_idx, col_idx, item)
+            table.setRowHeight(row_idx, cell_data.get('row_height', table.rowHeight(row_idx)))
+            table.setColumnWidth(col_idx, cell_data.get('column_width', table.columnWidth(col_idx)))
+        else:
+            item = QTableWidgetItem(cell_data)
+            item.setForeground(QColor(Qt.black))
+            item.setBackground(QColor(Qt.white))
+            table.setItem(row_idx, col_idx, item)
+
+    def populate_table_compact(self, compact, merged_cells):
+        start_time = time.time()
         table = self.table_widget.get_table()
-        if table.rowCount() > 0:
-            table.removeRow(table.rowCount() - 1)
-        self.load_table_data()
+        table.clearContents()
+        table.setRowCount(len(compact['text']))
+        table.setColumnCount(compact['columns'])
+
+        # 每种样式只创建一次 QColor / QFont, 所有单元格共用
+        foregrounds = []
+        backgrounds = []
+        alignments = []
+        fonts = []
+        for style in compact['styles']:
+            foregrounds.append(QColor(style.get('foreground') or QColor(Qt.black).name()))
+            backgrounds.append(QColor(style.get('background') or QColor(Qt.white).name()))
+            alignment = style.get('alignment')
+            alignments.append(int(Qt.AlignLeft | Qt.AlignVCenter) if alignment is None else alignment)
+            font = QFont()
+            font.setBold(style.get('font', {}).get('bold', False))
+            font.setPointSize(style.get('font', {}).get('size', 10))
+            fonts.append(font)
+
+        for row_idx, (row_texts, row_styles) in enumerate(zip(compact['text'], compact['style'])):
+            for col_idx, (text, style_id) in enumerate(zip(row_texts, row_styles)):
+                if style_id < 0:
+                    continue
+                item = QTableWidgetItem(text or '')
+                item.setForeground(foregrounds[style_id])
+                item.setBackground(backgrounds[style_id])
+                item.setTextAlignment(alignments[style_id])
+                item.setFont(fonts[style_id])
+                table.setItem(row_idx, col_idx, item)
+
+        for row_idx, height in enumerate(compact['row_heights']):
+            if height is not None:
+                table.setRowHeight(row_idx, height)
+        for col_idx, width in enumerate(compact['column_widths']):
+            if width is not None:
+                table.setColumnWidth(col_idx, width)
+
+        for cell in merged_cells:
+            table.setSpan(int(cell['row']), int(cell['col']), int(cell['row_span']), int(cell['col_span']))
+
+        end_time = time.time()
+        print(f"Total populate_table_compact execution time: {end_time - start_time:.4f} seconds")
+
+    def refresh_data(self):
+        # 只拉取上次加载/保存之后的变更并就地应用; 服务器要求整表重新加载时退回 load_table_data
+        start_time = time.time()
+        response = self.db_handler.changes(self.version) if self.version is not None else {}
+        if response.get("status") == "success" and not response.get("reset"):
+            with self.table_widget.change_tracker.suspended():
+                self.apply_changes(response.get("changes", []))
+            self.version = response.get("version")
+            print(f"refresh_data ({len(response.get('changes', []))} changes) took {time.time() - start_time:.4f} seconds")
+        else:
+            self.load_table_data()
         QMessageBox.information(self.table_widget, "刷新成功", "表格数据已刷新")
 
+    def apply_changes(self, changes):
+        # 变更格式见 server/changes.py; 本地未保存的修改会被服务器上的同一单元格覆盖
+        table = self.table_widget.get_table()
+        for change in changes:
+            if change['kind'] == 'patch':
+                patch = change['patch']
+                if patch.get('column_count', 0) > table.columnCount():
+                    table.setColumnCount(patch['column_count'])
+                for cell in patch.get('cells') or []:
+                    if int(cell['row']) < table.rowCount():
+                        self.apply_cell(table, int(cell['row']), int(cell['col']), cell['data'])
+                for row in patch.get('rows') or []:
+                    if int(row['row']) < table.rowCount():
+                        table.setRowHeight(int(row['row']), row['row_height'])
+                for column in patch.get('columns') or []:
+                    table.setColumnWidth(int(column['col']), column['column_width'])
+                if 'merged_cells' in patch:
+                    self.apply_merged_cells(table, patch['merged_cells'])
+            elif change['kind'] == 'append':
+                for row_data in change['rows']:
+                    row_idx = table.rowCount()
+                    table.insertRow(row_idx)
+                    for col_idx_str, cell_data in row_data.items():
+                        try:
+                            col_idx = int(col_idx_str)
+                        except ValueError:
+                            continue
+                        if col_idx >= table.columnCount():
+                            table.setColumnCount(col_idx + 1)
+                        self.apply_cell(table, row_idx, col_idx, cell_data)
+            elif change['kind'] == 'merged_cells':
+                self.apply_merged_cells(table, change['merged_cells'])
+
+    def apply_merged_cells(self, table, merged_cells):
+        table.clearSpans()
+        for cell in merged_cells:
+            table.setSpan(int(cell['row']), int(cell['col']), int(cell['row_span']), int(cell['col_span']))
+
 
     def export_to_excel(self):
         table = self.table_widget.get_table()
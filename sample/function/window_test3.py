@@ -1,8 +1,8 @@
 # main_window.py
 import sys
-from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QApplication,QColorDialog,QInputDialog
+from PySide6.QtWidgets import QMainWindow, QVBoxLayout, QWidget, QPushButton, QHBoxLayout, QApplication,QColorDialog,QInputDialog,QMessageBox
 from server.client3 import MongoClient
-from function.table import TableWidget
+from function.workbook import WorkbookWidget
 from table_handler3 import TableHandler  # Assuming TableHandler is defined in table_handler.py
 
 
@@ -12,8 +12,6 @@ class MainWindow(QMainWindow):
 
         self.setWindowTitle("Table Handler Example")
 
-        self.table_widget = TableWidget()  # Assuming TableWidget is implemented in function.table
-
         # Provide the necessary arguments for MongoDBHandler
         server_url = "http://localhost:5002"
         uri = "mongodb://localhost:27017/"
@@ -21,32 +19,44 @@ class MainWindow(QMainWindow):
         collection_name = "test_collection"
         self.db_handler = MongoClient(server_url, uri, db_name, collection_name)
 
-        self.table_handler = TableHandler(self.table_widget, self.db_handler)
+        # 每个标签页一张表, 切换到某个工作表时才加载它的数据
+        self.workbook_widget = WorkbookWidget(self.db_handler, "test_workbook", TableHandler)
 
         layout = QVBoxLayout()
-        layout.addWidget(self.table_widget)
+        layout.addWidget(self.workbook_widget)
 
         button_layout = QHBoxLayout()
 
         save_button = QPushButton("Save Data")
-        save_button.clicked.connect(self.table_handler.save_data)
+        save_button.clicked.connect(lambda: self.workbook_widget.current_handler().save_data())
         button_layout.addWidget(save_button)
 
         refresh_button = QPushButton("Refresh Data")
-        refresh_button.clicked.connect(self.table_handler.refresh_data)
+        refresh_button.clicked.connect(lambda: self.workbook_widget.current_handler().refresh_data())
         button_layout.addWidget(refresh_button)
 
         export_button = QPushButton("Export to Excel")
-        export_button.clicked.connect(self.table_handler.export_to_excel)
+        export_button.clicked.connect(lambda: self.workbook_widget.current_handler().export_to_excel())
         button_layout.addWidget(export_button)
 
+        add_sheet_button = QPushButton("Add Sheet")
+        add_sheet_button.clicked.connect(self.add_sheet)
+        button_layout.addWidget(add_sheet_button)
+
         layout.addLayout(button_layout)
 
         container = QWidget()
         container.setLayout(layout)
         self.setCentralWidget(container)
 
-        self.table_handler.load_table_data()
+        self.workbook_widget.load_workbook()
+
+    def add_sheet(self):
+        name, ok = QInputDialog.getText(self, "新建工作表", "工作表名称:")
+        if ok and name:
+            response = self.workbook_widget.add_sheet(name)
+            if response.get("status") != "success":
+                QMessageBox.warning(self, "新建失败", response.get("message") or response.get("error", ""))
 
 
 if __name__ == "__main__":
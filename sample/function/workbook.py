@@ -0,0 +1,63 @@
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QTabWidget
+from function.table import TableWidget
+
+
+class WorkbookWidget(QWidget):
+    # 多工作表的工作簿: 每个标签页对应一张表 (一个集合), 工作表索引见 server/workbooks.py.
+    # 启动时只读取索引并加载当前工作表; 其他工作表第一次切换到时才创建表格并调用 get_all,
+    # 之后再切换回来直接显示内存中的表格
+    def __init__(self, db_handler, workbook, handler_class):
+        super().__init__()
+        self.db_handler = db_handler  # client3.MongoClient, 其集合作为新工作簿的第一个工作表
+        self.workbook = workbook
+        self.handler_class = handler_class
+        self.sheets = []
+        self.handlers = {}  # 集合名 -> TableHandler, 只包含已打开过的工作表
+
+        self.tabs = QTabWidget()
+        self.tabs.currentChanged.connect(self.open_sheet)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.tabs)
+
+    def load_workbook(self):
+        response = self.db_handler.get_workbook(self.workbook)
+        sheets = response.get("data", {}).get("sheets") if response.get("status") == "success" else None
+        if not sheets:
+            sheets = [{"name": "Sheet1", "collection": self.db_handler.collection_name}]
+            response = self.db_handler.save_workbook(self.workbook, sheets)
+            if response.get("status") == "success":
+                sheets = response["data"]["sheets"]
+
+        self.tabs.blockSignals(True)
+        self.tabs.clear()
+        self.handlers = {}
+        self.sheets = sheets
+        for sheet in sheets:
+            self.tabs.addTab(QWidget(), sheet["name"])  # 占位, 第一次打开时放入表格
+        self.tabs.blockSignals(False)
+        self.open_sheet(self.tabs.currentIndex())
+
+    def open_sheet(self, index):
+        if index < 0 or self.sheets[index]["collection"] in self.handlers:
+            return
+        collection = self.sheets[index]["collection"]
+        table_widget = TableWidget()
+        handler = self.handler_class(table_widget, self.db_handler.sheet(collection))
+        layout = QVBoxLayout(self.tabs.widget(index))
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(table_widget)
+        self.handlers[collection] = handler
+        handler.load_table_data()
+
+    def current_handler(self):
+        index = self.tabs.currentIndex()
+        return self.handlers.get(self.sheets[index]["collection"]) if index >= 0 else None
+
+    def add_sheet(self, name):
+        # 工作表索引整体保存, 返回服务器的响应; 成功时切换到新工作表
+        response = self.db_handler.save_workbook(self.workbook, self.sheets + [name])
+        if response.get("status") == "success":
+            self.sheets = response["data"]["sheets"]
+            self.tabs.addTab(QWidget(), self.sheets[-1]["name"])
+            self.tabs.setCurrentIndex(len(self.sheets) - 1)
+        return response
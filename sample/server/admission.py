@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+import requests
+from server import config
+
+# 准入控制: 每个路由限制同时在处理和排队的请求数, 线程池队列过长或任务排队超时时快速拒绝,
+# 返回 429 / 503 和 Retry-After, 而不是让请求在内存里一直堆积到客户端超时.
+RETRY_STATUSES = (429, 503)
+
+
+class Overloaded(Exception):
+    # 429: 该路由的请求数已达上限; 503: 服务器整体过载或任务在队列中等待超时
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = config.ADMISSION_RETRY_AFTER if retry_after is None else retry_after
+
+
+def parse_route_limits(spec):
+    # "save_table=8,save_all=8" -> {"/save_table": 8, "/save_all": 8}
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, limit = item.split("=")
+        limits["/" + route.strip().lstrip("/")] = int(limit)
+    return limits
+
+
+class AdmissionController:
+    def __init__(self, executor=None, route_limits=None, default_limit=None,
+                 max_executor_queue=None, queue_timeout_ms=None):
+        self.executor = executor
+        self.route_limits = parse_route_limits(config.ADMISSION_ROUTE_LIMITS) if route_limits is None else route_limits
+        self.default_limit = config.ADMISSION_DEFAULT_LIMIT if default_limit is None else default_limit
+        self.max_executor_queue = config.ADMISSION_MAX_EXECUTOR_QUEUE if max_executor_queue is None else max_executor_queue
+        queue_timeout_ms = config.ADMISSION_QUEUE_TIMEOUT_MS if queue_timeout_ms is None else queue_timeout_ms
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, route):
+        return self.route_limits.get(route, self.default_limit)
+
+    def executor_queue_depth(self):
+        return self.executor._work_queue.qsize() if self.executor is not None else 0
+
+    def admit(self, route):
+        # 在读取请求体之前调用 (见 AdmissionMiddleware); 被拒绝时抛出 Overloaded
+        if self.max_executor_queue and self.executor_queue_depth() >= self.max_executor_queue:
+            raise Overloaded("Server overloaded, executor queue is full", 503)
+        limit = self.limit_for(route)
+        with self._lock:
+            pending = self._pending.get(route, 0)
+            if limit and pending >= limit:
+                raise Overloaded(f"Too many concurrent {route} requests (limit {limit})", 429)
+            self._pending[route] = pending + 1
+
+    def release(self, route):
+        with self._lock:
+            self._pending[route] -= 1
+
+    def guard_queue_time(self, func):
+        # 任务在线程池队列中等待超过 queue_timeout 时不再执行, 客户端很可能已经超时
+        submitted = time.monotonic()
+
+        def run(*args):
+            waited = time.monotonic() - submitted
+            if self.queue_timeout and waited > self.queue_timeout:
+                raise Overloaded(f"Request waited {waited:.2f}s in queue, dropped", 503)
+            return func(*args)
+        return run
+
+
+def overloaded_response(error):
+    from flask import jsonify
+    response = jsonify({"status": "error", "message": str(error)})
+    response.status_code = error.status
+    response.headers["Retry-After"] = str(int(error.retry_after))
+    return response
+
+
+class AdmissionMiddleware:
+    # WSGI 中间件: 在读取 (和解压) 请求体之前按路由准入, 被拒绝的请求体不会进入内存;
+    # 响应发送完毕 (流式响应也包括在内) 后释放名额. 需要包在 compression.DecompressionMiddleware 外面
+    def __init__(self, wsgi_app, controller, routes):
+        self.wsgi_app = wsgi_app
+        self.controller = controller
+        self.routes = routes  # 返回已注册路由集合的函数, 未注册的路径不计数
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+        route = environ.get("PATH_INFO", "")
+        if not config.ADMISSION_ENABLED or route not in self.routes():
+            return self.wsgi_app(environ, start_response)
+        try:
+            self.controller.admit(route)
+        except Overloaded as e:
+            return self.reject(e, start_response)
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), lambda: self.controller.release(route))
+        except BaseException:
+            self.controller.release(route)
+            raise
+
+    @staticmethod
+    def reject(error, start_response):
+        from werkzeug.http import HTTP_STATUS_CODES
+        body = json.dumps({"status": "error", "message": str(error)}).encode("utf-8")
+        start_response(f"{error.status} {HTTP_STATUS_CODES[error.status]}",
+                       [("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+                        ("Retry-After", str(int(error.retry_after)))])
+        return [body]
+
+
+def install_admission_control(app, controller):
+    # 在 install_compression 之后调用, 准入在解压请求体之前进行; 视图中抛出的 Overloaded 转换为 429/503
+    app.wsgi_app = AdmissionMiddleware(app.wsgi_app, controller,
+                                       lambda: {rule.rule for rule in app.url_map.iter_rules()})
+    app.register_error_handler(Overloaded, overloaded_response)
+
+
+def retry_delay(response, attempt):
+    # 优先使用服务器给出的 Retry-After (秒), 否则按指数退避; 都不超过 CLIENT_MAX_RETRY_DELAY
+    retry_after = response.headers.get("Retry-After", "")
+    delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else 0.5 * 2 ** attempt
+    return min(delay, config.CLIENT_MAX_RETRY_DELAY)
+
+
+def request_with_retry(method, url, **kwargs):
+    # requests.request 的替代: 服务器返回 429/503 时按 Retry-After 等待后重试, 重试次数用完后返回最后一次的响应.
+    # data 为文件对象时每次重试前回到起始位置重新发送
+    data = kwargs.get("data")
+    position = data.tell() if hasattr(data, "seek") else None
+    for attempt in range(config.CLIENT_MAX_RETRIES + 1):
+        if position is not None:
+            data.seek(position)
+        response = requests.request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == config.CLIENT_MAX_RETRIES:
+            return response
+        delay = retry_delay(response, attempt)
+        response.close()
+        print(f"{url} returned {response.status_code}, retrying in {delay:.1f} seconds")
+        time.sleep(delay)
+    return response
@@ -0,0 +1,130 @@
+from contextlib import ExitStack
+from server import config
+from server.patch import apply_patch
+from server.rows import RESPONSE_PROJECTION, ROW_PROJECTION, PartialAppendError, ensure_indexes, staging_collection, swap_in
+from server.tiled import append_table_rows, build_table_documents, find_table_rows
+from server.changes import versioned_write
+from server.versions import VersionConflict, read_versioned
+
+# /batch 支持的操作, args 与对应单独接口的请求字段相同
+READ_OPERATIONS = {"get_table", "get_merged_cells", "get_all"}
+WRITE_OPERATIONS = {"save_table", "save_merged_cells", "save_all", "append_table", "patch_cells"}
+
+
+def _save_merged_cells(collection, merged_cells):
+    collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
+
+
+def _get_merged_cells(collection):
+    result = collection.find_one({"type": "merged_cells"})
+    return result.get("merged_cells", []) if result else []
+
+
+def _replace_table(collection, data, merged_cells=None):
+    # 与 server3 的 save_table / save_all 相同按 config.SAVE_MODE 整表替换; swap 时先写临时集合再原子重命名,
+    # 其他 worker 进程不会读到删了一半的表 (多个 worker 时 serve.py 要求 swap)
+    documents = build_table_documents(collection.name, data)
+    if merged_cells is not None:
+        documents.append({"type": "merged_cells", "merged_cells": merged_cells})
+    if config.SAVE_MODE != "swap" or not documents:
+        collection.delete_many({})
+        if documents:
+            collection.insert_many(documents)
+        return
+    staging = staging_collection(collection)
+    try:
+        ensure_indexes(staging)  # 重命名后替换正式集合, 索引需要提前建好
+        staging.insert_many(documents)
+    except Exception:
+        staging.drop()
+        raise
+    swap_in(staging, collection)
+
+
+def run_operation(collection, op, args):
+    # 调用方已持有该表的锁
+    if op == "get_table":
+        return (list(find_table_rows(collection, {"_id": 0, **ROW_PROJECTION}))
+                + list(collection.find({"type": "merged_cells"}, {"_id": 0})))
+    if op == "get_merged_cells":
+        return _get_merged_cells(collection)
+    if op == "get_all":
+        # 需要 _id 时由响应编码器 (server.serializer) 转成字符串
+        table_data = list(find_table_rows(collection, RESPONSE_PROJECTION))
+        return {"table_data": table_data, "merged_cells": _get_merged_cells(collection)}
+    if op == "save_table":
+        _replace_table(collection, args.get("data"))
+        return None
+    if op == "save_merged_cells":
+        _save_merged_cells(collection, args.get("merged_cells"))
+        return None
+    if op == "save_all":
+        _replace_table(collection, args.get("data"), args.get("merged_cells"))
+        return None
+    if op == "append_table":
+        append_table_rows(collection, args.get("data"))
+        return None
+    if op == "patch_cells":
+        return apply_patch(collection, args.get("patch") or {})
+    raise ValueError(f"Unknown batch operation: {op}")
+
+
+def run_batch(request_body, get_db_handler, on_write=None):
+    # request_body: {"uri", "db_name", "collection_name", "operations": [{"op", "args", 可选 uri/db_name/collection_name}]}
+    # 操作按顺序执行; 每张表只加一次锁 (有写操作时加写锁), 按表名排序加锁避免死锁.
+    # 遇到错误即停止, 已执行的操作不会回滚.
+    # 请求本身不合法 (未知操作、缺少 uri/db_name/collection_name) 时在加锁前抛出 ValueError, 路由返回 400.
+    # 每个结果带 version: 读操作为读取前的版本号, 写操作为写入后的版本号; 写操作的 args 可带 expected_version.
+    operations = request_body.get("operations") or []
+    targets = []
+    for operation in operations:
+        if operation.get("op") not in READ_OPERATIONS | WRITE_OPERATIONS:
+            raise ValueError(f"Unknown batch operation: {operation.get('op')}")
+        key = (operation.get("uri") or request_body.get("uri"),
+               operation.get("db_name") or request_body.get("db_name"),
+               operation.get("collection_name") or request_body.get("collection_name"))
+        if not all(isinstance(part, str) and part for part in key):
+            # 加锁顺序按 key 排序, 缺少字段时 None 无法与字符串比较
+            raise ValueError(f"Batch operation {operation.get('op')} needs uri, db_name and collection_name")
+        targets.append(get_db_handler(*key))
+
+    # 锁策略为 global 时多张表共用同一把锁, 按锁对象去重
+    locks = {}
+    for db_handler, operation in zip(targets, operations):
+        entry = locks.setdefault(id(db_handler.lock), [db_handler.key, db_handler.lock, False])
+        entry[0] = min(entry[0], db_handler.key)
+        if operation["op"] in WRITE_OPERATIONS:
+            entry[2] = True
+
+    results = []
+    written = {}
+    with ExitStack() as stack:
+        for _, lock, write in sorted(locks.values(), key=lambda entry: entry[0]):
+            stack.enter_context(lock.gen_wlock() if write else lock.gen_rlock())
+        for db_handler, operation in zip(targets, operations):
+            args = operation.get("args") or {}
+            try:
+                if operation["op"] in WRITE_OPERATIONS:
+                    with versioned_write(db_handler.collection, args.get("expected_version")) as write:
+                        write.describe(operation["op"], **args)
+                        data = run_operation(db_handler.collection, operation["op"], args)
+                    version = write.version
+                else:
+                    version, data = read_versioned(db_handler.collection, run_operation,
+                                                   db_handler.collection, operation["op"], args)
+            except VersionConflict as e:
+                results.append({"status": "error", "message": str(e), "current_version": e.current})
+                break
+            except PartialAppendError as e:
+                results.append({"status": "error", "message": str(e), "inserted": e.inserted})
+                break
+            except Exception as e:
+                results.append({"status": "error", "message": str(e)})
+                break
+            results.append({"status": "success", "data": data, "version": version})
+            if operation["op"] in WRITE_OPERATIONS:
+                written[db_handler.key] = db_handler
+        if on_write:
+            for db_handler in written.values():
+                on_write(db_handler)
+    return results
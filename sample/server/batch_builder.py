@@ -0,0 +1,53 @@
+class BatchBuilder:
+    # 收集多个表格操作, execute() 时通过 /batch 一次发送, 服务器按顺序执行并一起返回结果.
+    # 用法: client.batch().save_table(data).save_merged_cells(merged_cells).execute()
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+        self._target = {}
+
+    def collection(self, collection_name, db_name=None, uri=None):
+        # 之后添加的操作作用于指定的表, 未指定的字段沿用 client 的设置
+        self._target = {"collection_name": collection_name}
+        if db_name:
+            self._target["db_name"] = db_name
+        if uri:
+            self._target["uri"] = uri
+        return self
+
+    def _add(self, op, **args):
+        self.operations.append(dict(self._target, op=op, args=args))
+        return self
+
+    def _add_write(self, op, expected_version, **args):
+        # expected_version 不为 None 时, 表的当前版本不一致则该操作失败 (带 current_version)
+        if expected_version is not None:
+            args["expected_version"] = expected_version
+        return self._add(op, **args)
+
+    def get_table(self):
+        return self._add("get_table")
+
+    def get_merged_cells(self):
+        return self._add("get_merged_cells")
+
+    def get_all(self):
+        return self._add("get_all")
+
+    def save_table(self, data, expected_version=None):
+        return self._add_write("save_table", expected_version, data=data)
+
+    def save_merged_cells(self, merged_cells, expected_version=None):
+        return self._add_write("save_merged_cells", expected_version, merged_cells=merged_cells)
+
+    def save_all(self, data, merged_cells, expected_version=None):
+        return self._add_write("save_all", expected_version, data=data, merged_cells=merged_cells)
+
+    def append_table(self, data, expected_version=None):
+        return self._add_write("append_table", expected_version, data=data)
+
+    def patch_cells(self, patch, expected_version=None):
+        return self._add_write("patch_cells", expected_version, patch=patch)
+
+    def execute(self):
+        return self.client.execute_batch(self.operations)
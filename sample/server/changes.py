@@ -0,0 +1,119 @@
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import ASCENDING
+from server import config
+from server.versions import claim_version, commit_version, get_version
+
+# 变更日志: 每次写入在同库的 __table_changes 集合中记录一条 {"table", "version", "at", "change"},
+# version 即写入后的表版本号 (server.versions), 客户端用 /changes?since=版本号 只拉取之后的变更.
+# change 的格式:
+#   {"kind": "patch", "patch": patch_cells 的 patch}
+#   {"kind": "append", "rows": 追加的行}
+#   {"kind": "merged_cells", "merged_cells": 合并单元格列表}
+#   {"kind": "reset"}  整表被替换或无法增量描述, 客户端需要重新加载整表
+CHANGE_COLLECTION = "__table_changes"
+
+_notify = threading.Condition()
+
+
+def _changes(collection):
+    return collection.database[CHANGE_COLLECTION]
+
+
+def ensure_change_indexes(collection):
+    _changes(collection).create_index([("table", ASCENDING), ("version", ASCENDING)], name="table_version", unique=True)
+
+
+def describe_change(op, args):
+    if op == "patch_cells":
+        return {"kind": "patch", "patch": args.get("patch") or {}}
+    if op == "append_table":
+        rows = args.get("data") or []
+        if len(rows) > config.CHANGE_LOG_MAX_ROWS:
+            return {"kind": "reset"}
+        # insert_many 会在行字典中写入 _id, 行号由客户端按追加顺序确定
+        return {"kind": "append", "rows": [{key: value for key, value in row.items() if key not in ("_id", "row")}
+                                           for row in rows]}
+    if op == "save_merged_cells":
+        return {"kind": "merged_cells", "merged_cells": args.get("merged_cells") or []}
+    return {"kind": "reset"}
+
+
+class VersionedWrite:
+    def __init__(self, version):
+        self.version = version
+        self.change = {"kind": "reset"}
+
+    def describe(self, op, **args):
+        # 写入完成前调用, 说明本次写入的内容; 不调用时记为 reset
+        self.change = describe_change(op, args)
+
+
+def record_change(collection, version, change):
+    # 接管中途退出的写入时, 同一版本号可能已有一条日志, 直接覆盖
+    _changes(collection).replace_one({"table": collection.name, "version": version},
+                                     {"table": collection.name, "version": version, "at": time.time(), "change": change},
+                                     upsert=True)
+    if version % 100 == 0:
+        # 只保留最近 CHANGE_LOG_SIZE 条, 更早的客户端会收到 reset
+        _changes(collection).delete_many({"table": collection.name,
+                                          "version": {"$lte": version - config.CHANGE_LOG_SIZE}})
+
+
+@contextmanager
+def versioned_write(collection, expected_version=None):
+    # 写入前领取版本号 (expected_version 不一致时抛出 VersionConflict, 其他写入进行中时等待),
+    # 写入后先记录变更日志再提交版本号, 读到新版本号时数据和日志都已可见.
+    # 写入失败时 (数据可能已部分修改) 同样提交, 记为 reset.
+    claim = claim_version(collection, expected_version)
+    write = VersionedWrite(claim.version)
+    change = {"kind": "reset"}
+    try:
+        yield write
+        if not claim.stolen:
+            change = write.change
+    finally:
+        try:
+            record_change(collection, claim.version, change)
+        finally:
+            commit_version(collection, claim)
+            with _notify:
+                _notify.notify_all()
+
+
+def changes_since(collection, since):
+    # 返回 (当前版本号, 变更列表, 是否需要整表重新加载).
+    # 只返回已提交的版本 (versioned_write 先写日志再提交版本号), 进行中的写入的日志不会被读到
+    current = get_version(collection)
+    if since == current:
+        return current, [], False
+    if since > current:
+        return current, [], True
+    entries = list(_changes(collection).find({"table": collection.name, "version": {"$gt": since, "$lte": current}},
+                                             {"_id": 0})
+                   .sort("version", ASCENDING).limit(config.CHANGE_LOG_SIZE))
+    changes = []
+    expected = since + 1
+    for entry in entries:
+        if entry["version"] != expected or entry["change"]["kind"] == "reset":
+            # 已提交的版本缺号: 较早的日志已被清理, 或写入日志失败
+            return current, [], True
+        changes.append(dict(entry["change"], version=entry["version"]))
+        expected += 1
+    if not changes:
+        return current, [], True
+    # 超过 CHANGE_LOG_SIZE 条时只返回前一部分, 客户端从返回的版本号继续拉取
+    return changes[-1]["version"], changes, False
+
+
+def wait_for_changes(collection, since, timeout):
+    # 长轮询: 没有新变更时最多等待 timeout 秒; 本进程内的写入会立即唤醒, 其他进程的写入每 0.5 秒检查一次
+    deadline = time.monotonic() + timeout
+    while True:
+        version, changes, reset = changes_since(collection, since)
+        remaining = deadline - time.monotonic()
+        if changes or reset or remaining <= 0:
+            return version, changes, reset
+        with _notify:
+            _notify.wait(min(remaining, 0.5))
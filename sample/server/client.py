@@ -1,6 +1,9 @@
-import requests
 import time
 from concurrent.futures import ThreadPoolExecutor
+from server.batch_builder import BatchBuilder
+from server.compression import encode_request
+from server.admission import request_with_retry  # 服务器过载 (429/503) 时按 Retry-After 重试
+from server.tracing import copy_context, span, trace_headers
 
 class MongoClient:
     def __init__(self, server_url, uri, db_name, collection_name):
@@ -12,8 +15,19 @@ class MongoClient:
 
     def _async_request(self, method, endpoint, payload):
         url = f"{self.server_url}/{endpoint}"
-        response = requests.request(method, url, json=payload)
-        return response.json()
+        with span("encode_request", endpoint=endpoint):
+            body, headers = encode_request(payload)  # 较大的请求体会被压缩
+        with span(f"{method} /{endpoint}"):
+            headers.update(trace_headers())  # 服务器端的 span 挂在这次请求下面
+            response = request_with_retry(method, url, data=body, headers=headers)
+        with span("decode_response", endpoint=endpoint):
+            return response.json()
+
+    def _request(self, method, endpoint, payload):
+        # 在线程池中发送请求并等待结果, 请求作为当前 trace 的子 span
+        with span(f"client.{endpoint}"):
+            future = self.executor.submit(copy_context().run, self._async_request, method, endpoint, payload)
+            return future.result()
 
     def save_table(self, data):
         start_time = time.time()
@@ -23,8 +37,7 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
-        future = self.executor.submit(self._async_request, "POST", "save_table", payload)
-        result = future.result()
+        result = self._request("POST", "save_table", payload)
         end_time = time.time()
         print(f"save_table execution time: {end_time - start_time:.4f} seconds")
         return result
@@ -36,8 +49,7 @@ class MongoClient:
             "db_name": self.db_name,
             "collection_name": self.collection_name,
         }
-        future = self.executor.submit(self._async_request, "POST", "get_table", payload)
-        result = future.result()
+        result = self._request("POST", "get_table", payload)
         end_time = time.time()
         print(f"get_table execution time: {end_time - start_time:.4f} seconds")
         return result
@@ -50,8 +62,7 @@ class MongoClient:
             "collection_name": self.collection_name,
             "merged_cells": merged_cells
         }
-        future = self.executor.submit(self._async_request, "POST", "save_merged_cells", payload)
-        result = future.result()
+        result = self._request("POST", "save_merged_cells", payload)
         end_time = time.time()
         print(f"save_merged_cells execution time: {end_time - start_time:.4f} seconds")
         return result
@@ -63,8 +74,7 @@ class MongoClient:
             "db_name": self.db_name,
             "collection_name": self.collection_name,
         }
-        future = self.executor.submit(self._async_request, "POST", "get_merged_cells", payload)
-        result = future.result()
+        result = self._request("POST", "get_merged_cells", payload)
         end_time = time.time()
         print(f"get_merged_cells execution time: {end_time - start_time:.4f} seconds")
         return result
@@ -77,8 +87,36 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
-        future = self.executor.submit(self._async_request, "POST", "append_table", payload)
-        result = future.result()
+        result = self._request("POST", "append_table", payload)
         end_time = time.time()
         print(f"append_table execution time: {end_time - start_time:.4f} seconds")
         return result
+
+    def patch_cells(self, patch):
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "patch": patch
+        }
+        result = self._request("POST", "patch_cells", payload)
+        end_time = time.time()
+        print(f"patch_cells execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def batch(self):
+        return BatchBuilder(self)
+
+    def execute_batch(self, operations):
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "operations": operations
+        }
+        result = self._request("POST", "batch", payload)
+        end_time = time.time()
+        print(f"batch ({len(operations)} operations) execution time: {end_time - start_time:.4f} seconds")
+        return result
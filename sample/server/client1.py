@@ -1,6 +1,8 @@
-import requests
 import time
 from concurrent.futures import ThreadPoolExecutor
+from server.batch_builder import BatchBuilder
+from server.compression import encode_request
+from server.admission import request_with_retry  # 服务器过载 (429/503) 时按 Retry-After 重试
 
 class MongoClient:
     def __init__(self, server_url, uri, db_name, collection_name):
@@ -12,7 +14,8 @@ class MongoClient:
 
     def _async_request(self, method, endpoint, payload):
         url = f"{self.server_url}/{endpoint}"
-        response = requests.request(method, url, json=payload)
+        body, headers = encode_request(payload)  # 较大的请求体会被压缩
+        response = request_with_retry(method, url, data=body, headers=headers)
         return response.json()
 
     def save_table(self, data):
@@ -82,3 +85,34 @@ class MongoClient:
         end_time = time.time()
         print(f"append_table execution time: {end_time - start_time:.4f} seconds")
         return result
+
+    def patch_cells(self, patch):
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "patch": patch
+        }
+        future = self.executor.submit(self._async_request, "POST", "patch_cells", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"patch_cells execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def batch(self):
+        return BatchBuilder(self)
+
+    def execute_batch(self, operations):
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "operations": operations
+        }
+        future = self.executor.submit(self._async_request, "POST", "batch", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"batch ({len(operations)} operations) execution time: {end_time - start_time:.4f} seconds")
+        return result
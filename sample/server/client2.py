@@ -1,5 +1,6 @@
 # client.py
-import requests
+from server.compression import encode_request
+from server.admission import request_with_retry  # 服务器过载 (429/503) 时按 Retry-After 重试
 
 class MongoClient:
     def __init__(self, server_url, uri, db_name, collection_name):
@@ -8,6 +9,10 @@ class MongoClient:
         self.db_name = db_name
         self.collection_name = collection_name
 
+    def _post(self, endpoint, payload):
+        body, headers = encode_request(payload)  # 较大的请求体会被压缩
+        return request_with_retry("POST", f"{self.server_url}/{endpoint}", data=body, headers=headers)
+
     def save_table(self, data):
         payload = {
             "uri": self.uri,
@@ -15,7 +20,7 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
-        response = requests.post(f"{self.server_url}/save_table", json=payload)
+        response = self._post("save_table", payload)
         return response.json()
 
     def get_table(self):
@@ -24,7 +29,7 @@ class MongoClient:
             "db_name": self.db_name,
             "collection_name": self.collection_name,
         }
-        response = requests.post(f"{self.server_url}/get_table", json=payload)
+        response = self._post("get_table", payload)
         return response.json()
 
     def append_table(self, data):
@@ -34,5 +39,5 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
-        response = requests.post(f"{self.server_url}/append_table", json=payload)
+        response = self._post("append_table", payload)
         return response.json()
@@ -1,19 +1,61 @@
 import requests
+import json
+from server.compact import COMPACT_MIMETYPE
+from server.compression import encode_request
+from server.admission import request_with_retry  # 服务器过载 (429/503) 时按 Retry-After 重试
 import time
 from concurrent.futures import ThreadPoolExecutor
+from server.batch_builder import BatchBuilder
+from server.spreadsheet import detect_format
 
 class MongoClient:
-    def __init__(self, server_url, uri, db_name, collection_name):
+    def __init__(self, server_url, uri, db_name, collection_name, executor=None):
         self.server_url = server_url
         self.uri = uri
         self.db_name = db_name
         self.collection_name = collection_name
-        self.executor = ThreadPoolExecutor(max_workers=4)  # 根据需要调整线程池大小
+        self.executor = executor or ThreadPoolExecutor(max_workers=4)  # 根据需要调整线程池大小
+        self.etag_cache = {}  # endpoint -> (ETag, 上次的响应结果)
+        self.features = None  # 服务器支持的扩展功能, 第一次用到时通过 /capabilities 读取
 
-    def _async_request(self, method, endpoint, payload):
+    def capabilities(self):
+        # 扩展功能列表见 server3.FEATURES; 没有 /capabilities 的旧服务器只支持基础路由.
+        # 请求失败时不缓存, 下次再试
+        if self.features is None:
+            try:
+                response = request_with_retry("GET", f"{self.server_url}/capabilities")
+                if response.status_code == 404:
+                    self.features = frozenset()
+                else:
+                    response.raise_for_status()
+                    self.features = frozenset(response.json().get("features", []))
+            except (requests.RequestException, ValueError) as e:
+                print(f"HTTP request failed: {e}")
+                return frozenset()
+        return self.features
+
+    def supports(self, feature):
+        return feature in self.capabilities()
+
+    def _unsupported(self, *features):
+        # 服务器不支持时返回与请求失败相同格式的结果, 不发送请求
+        missing = [feature for feature in features if feature and not self.supports(feature)]
+        if missing:
+            return {"error": f"Server {self.server_url} does not support {', '.join(missing)}"}
+        return None
+
+    @staticmethod
+    def _version_feature(expected_version):
+        return "versions" if expected_version is not None else None
+
+    def _async_request(self, method, endpoint, payload, headers=None):
         url = f"{self.server_url}/{endpoint}"
+        body, request_headers = encode_request(payload)  # 较大的请求体会被压缩
+        request_headers.update(headers or {})
         try:
-            response = requests.request(method, url, json=payload)
+            response = request_with_retry(method, url, data=body, headers=request_headers)
+            if response.status_code == 409:
+                return response.json()  # 版本冲突, 结果中的 current_version 为服务器上的当前版本
             response.raise_for_status()  # 检查HTTP响应状态码
             try:
                 return response.json()
@@ -25,7 +67,95 @@ class MongoClient:
             print(f"HTTP request failed: {e}")
             return {"error": str(e)}
 
-    def save_all(self, data, merged_cells):
+    def _cached_request(self, endpoint, payload, headers=None, cache_name=None):
+        # 带上次的 ETag 请求, 服务器返回 304 时直接使用本地缓存的结果
+        url = f"{self.server_url}/{endpoint}"
+        cache_name = cache_name or endpoint
+        cached = self.etag_cache.get(cache_name)
+        body, request_headers = encode_request(payload)
+        request_headers.update(headers or {})
+        if cached:
+            request_headers["If-None-Match"] = cached[0]
+        try:
+            response = request_with_retry("POST", url, data=body, headers=request_headers)
+            if response.status_code == 304 and cached:
+                return cached[1]
+            response.raise_for_status()  # 检查HTTP响应状态码
+            try:
+                result = response.json()
+            except ValueError as e:
+                print(f"Error decoding JSON response: {e}")
+                print(f"Response content: {response.text}")
+                return {"error": "Invalid JSON response"}
+            etag = response.headers.get("ETag")
+            if etag and result.get("status") == "success":
+                self.etag_cache[cache_name] = (etag, result)
+            return result
+        except requests.RequestException as e:
+            print(f"HTTP request failed: {e}")
+            return {"error": str(e)}
+
+    def _iter_ndjson(self, endpoint, payload):
+        # 以 NDJSON 流式读取, 第一行为 header, 之后每行一条表格数据, 读到 end 行才算完整
+        if not self.supports("ndjson"):
+            raise IOError(f"Server {self.server_url} does not support ndjson streaming")
+        url = f"{self.server_url}/{endpoint}"
+        body, headers = encode_request(payload)
+        headers["Accept"] = "application/x-ndjson"
+        with request_with_retry("POST", url, data=body, headers=headers, stream=True) as response:
+            response.raise_for_status()  # 检查HTTP响应状态码
+            lines = response.iter_lines()
+            first_line = next(lines, None)
+            if first_line is None:
+                raise IOError(f"{endpoint} stream is empty")
+            yield json.loads(first_line)
+            for line in lines:
+                if not line:
+                    continue
+                row = json.loads(line)
+                if row.get("type") == "end":
+                    return
+                if row.get("type") == "error":
+                    raise IOError(f"{endpoint} stream failed: {row.get('message')}")  # 读取过程中表被修改, 需要重新读取
+                yield row
+        raise IOError(f"{endpoint} stream ended before end marker")
+
+    def iter_all(self):
+        # 依次产出 header (含 merged_cells) 和每一行表格数据, 不需要一次性读完整张表
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+        }
+        return self._iter_ndjson("get_all", payload)
+
+    def iter_table(self):
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+        }
+        return self._iter_ndjson("get_table", payload)
+
+    def get_all_streamed(self):
+        # 与 get_all 返回格式相同, 但边接收边解析
+        start_time = time.time()
+        try:
+            rows = self.iter_all()
+            header = next(rows)
+            table_data = list(rows)
+        except (IOError, ValueError) as e:
+            print(f"Streaming get_all failed: {e}")
+            return {"error": str(e)}
+        end_time = time.time()
+        print(f"get_all_streamed execution time: {end_time - start_time:.4f} seconds")
+        return {"status": "success", "data": {"table_data": table_data, "merged_cells": header.get("merged_cells", [])}}
+
+    def save_all(self, data, merged_cells, expected_version=None):
+        # 写操作可带 expected_version (上次读取结果中的 version), 表已被他人修改时返回 status=error 和 current_version
+        unsupported = self._unsupported(self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
         start_time = time.time()
         payload = {
             "uri": self.uri,
@@ -34,6 +164,8 @@ class MongoClient:
             "data": data,
             "merged_cells": merged_cells
         }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
         future = self.executor.submit(self._async_request, "POST", "save_all", payload)
         result = future.result()
         end_time = time.time()
@@ -47,13 +179,211 @@ class MongoClient:
             "db_name": self.db_name,
             "collection_name": self.collection_name,
         }
-        future = self.executor.submit(self._async_request, "POST", "get_all", payload)
+        future = self.executor.submit(self._cached_request, "get_all", payload)
         result = future.result()
         end_time = time.time()
         print(f"get_all execution time: {end_time - start_time:.4f} seconds")
         return result
 
-    def save_table(self, data):
+    def save_all_compact(self, compact_data, merged_cells, expected_version=None):
+        # compact_data 为 server.compact 中描述的紧凑格式
+        unsupported = self._unsupported("compact", self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "data": compact_data,
+            "merged_cells": merged_cells
+        }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
+        headers = {"Content-Type": COMPACT_MIMETYPE}
+        future = self.executor.submit(self._async_request, "POST", "save_all", payload, headers)
+        result = future.result()
+        end_time = time.time()
+        print(f"save_all_compact execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def get_all_compact(self):
+        # 返回格式同 get_all, 但 data["table_data"] 为紧凑格式
+        unsupported = self._unsupported("compact")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+        }
+        headers = {"Accept": COMPACT_MIMETYPE}
+        future = self.executor.submit(self._cached_request, "get_all", payload, headers, "get_all_compact")
+        result = future.result()
+        end_time = time.time()
+        print(f"get_all_compact execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def get_rows(self, start, end):
+        # 读取 [start, end) 范围内的行, 每行带有 row 字段
+        unsupported = self._unsupported("rows")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "start": start,
+            "end": end
+        }
+        future = self.executor.submit(self._async_request, "POST", "get_rows", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"get_rows execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def import_file(self, path, fmt=None, sheet=None, styles=False, expected_version=None):
+        # 把本地 CSV / XLSX 文件导入为整张表 (替换原有数据); 文件直接作为请求体流式上传, 参数放在查询参数中
+        unsupported = self._unsupported("import", self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        params = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "format": detect_format(path, fmt)
+        }
+        if sheet:
+            params["sheet"] = sheet
+        if styles:
+            params["styles"] = "1"
+        if expected_version is not None:
+            params["expected_version"] = expected_version
+        try:
+            with open(path, "rb") as f:
+                response = request_with_retry("POST", f"{self.server_url}/import", params=params, data=f,
+                                              headers={"Content-Type": "application/octet-stream"})
+            if response.status_code != 409:
+                response.raise_for_status()
+            result = response.json()
+        except requests.RequestException as e:
+            print(f"HTTP request failed: {e}")
+            result = {"error": str(e)}
+        end_time = time.time()
+        print(f"import_file execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def sheet(self, collection_name):
+        # 同一服务器和库中另一张表 (如工作簿中的工作表) 的客户端, 共用线程池和服务器功能列表
+        client = MongoClient(self.server_url, self.uri, self.db_name, collection_name, self.executor)
+        client.features = self.features
+        return client
+
+    def get_workbook(self, workbook):
+        # 工作簿的工作表索引: {"name", "sheets": [{"name", "collection"}]}, 不包含工作表数据
+        unsupported = self._unsupported("workbooks")
+        if unsupported:
+            return unsupported
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "workbook": workbook
+        }
+        future = self.executor.submit(self._async_request, "POST", "get_workbook", payload)
+        return future.result()
+
+    def save_workbook(self, workbook, sheets):
+        unsupported = self._unsupported("workbooks")
+        if unsupported:
+            return unsupported
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "workbook": workbook,
+            "sheets": sheets
+        }
+        future = self.executor.submit(self._async_request, "POST", "save_workbook", payload)
+        return future.result()
+
+    def export_file(self, path, fmt=None, sheet=None):
+        # 由服务器导出整张表并边下载边写入本地文件; fmt 为 xlsx 或 csv, 默认按文件扩展名判断
+        unsupported = self._unsupported("export")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "format": detect_format(path, fmt)
+        }
+        if sheet:
+            payload["sheet"] = sheet
+        body, headers = encode_request(payload)
+        try:
+            with request_with_retry("POST", f"{self.server_url}/export", data=body, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                with open(path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+            result = {"status": "success", "path": path}
+        except requests.RequestException as e:
+            print(f"HTTP request failed: {e}")
+            result = {"error": str(e)}
+        end_time = time.time()
+        print(f"export_file execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def get_columns(self, columns, fields="text", start=0, end=None):
+        # 只读取指定列号的列, fields 为 text 时每个单元格只有 text, 为 style 时为完整的单元格字典;
+        # 每行带有 row 字段, end 为 None 表示读到最后一行
+        unsupported = self._unsupported("columns")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "columns": list(columns),
+            "fields": fields,
+            "start": start
+        }
+        if end is not None:
+            payload["end"] = end
+        future = self.executor.submit(self._async_request, "POST", "get_columns", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"get_columns execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def changes(self, since, wait=0):
+        # 读取 since 版本之后的变更; wait 大于 0 时为长轮询, 没有变更时服务器最多等待 wait 秒.
+        # 结果中 reset 为 true 时需要调用 get_all 重新加载整表
+        unsupported = self._unsupported("changes")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "since": since,
+            "wait": wait
+        }
+        future = self.executor.submit(self._async_request, "POST", "changes", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"changes execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def save_table(self, data, expected_version=None):
+        unsupported = self._unsupported(self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
         start_time = time.time()
         payload = {
             "uri": self.uri,
@@ -61,6 +391,8 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
         future = self.executor.submit(self._async_request, "POST", "save_table", payload)
         result = future.result()
         end_time = time.time()
@@ -74,13 +406,16 @@ class MongoClient:
             "db_name": self.db_name,
             "collection_name": self.collection_name,
         }
-        future = self.executor.submit(self._async_request, "POST", "get_table", payload)
+        future = self.executor.submit(self._cached_request, "get_table", payload)
         result = future.result()
         end_time = time.time()
         print(f"get_table execution time: {end_time - start_time:.4f} seconds")
         return result
 
-    def save_merged_cells(self, merged_cells):
+    def save_merged_cells(self, merged_cells, expected_version=None):
+        unsupported = self._unsupported(self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
         start_time = time.time()
         payload = {
             "uri": self.uri,
@@ -88,6 +423,8 @@ class MongoClient:
             "collection_name": self.collection_name,
             "merged_cells": merged_cells
         }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
         future = self.executor.submit(self._async_request, "POST", "save_merged_cells", payload)
         result = future.result()
         end_time = time.time()
@@ -107,7 +444,10 @@ class MongoClient:
         print(f"get_merged_cells execution time: {end_time - start_time:.4f} seconds")
         return result
 
-    def append_table(self, data):
+    def append_table(self, data, expected_version=None):
+        unsupported = self._unsupported(self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
         start_time = time.time()
         payload = {
             "uri": self.uri,
@@ -115,8 +455,49 @@ class MongoClient:
             "collection_name": self.collection_name,
             "data": data
         }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
         future = self.executor.submit(self._async_request, "POST", "append_table", payload)
         result = future.result()
         end_time = time.time()
         print(f"append_table execution time: {end_time - start_time:.4f} seconds")
         return result
+
+    def patch_cells(self, patch, expected_version=None):
+        unsupported = self._unsupported(self._version_feature(expected_version))
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "patch": patch
+        }
+        if expected_version is not None:
+            payload["expected_version"] = expected_version
+        future = self.executor.submit(self._async_request, "POST", "patch_cells", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"patch_cells execution time: {end_time - start_time:.4f} seconds")
+        return result
+
+    def batch(self):
+        return BatchBuilder(self)
+
+    def execute_batch(self, operations):
+        unsupported = self._unsupported("batch")
+        if unsupported:
+            return unsupported
+        start_time = time.time()
+        payload = {
+            "uri": self.uri,
+            "db_name": self.db_name,
+            "collection_name": self.collection_name,
+            "operations": operations
+        }
+        future = self.executor.submit(self._async_request, "POST", "batch", payload)
+        result = future.result()
+        end_time = time.time()
+        print(f"batch ({len(operations)} operations) execution time: {end_time - start_time:.4f} seconds")
+        return result
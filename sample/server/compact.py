@@ -0,0 +1,94 @@
+# 紧凑的表格传输格式: 样式去重后存入 styles, 单元格只记录文本和样式编号,
+# 行高和列宽各存一份. 数据库中仍然保存原来的单元格字典格式.
+#
+# {
+#     "columns": 列数,
+#     "styles": [{"foreground", "background", "alignment", "font": {"bold", "size"}}, ...],
+#     "row_heights": [每行行高],
+#     "column_widths": [每列列宽],
+#     "text": [[每行各列文本, 没有单元格时为 null]],
+#     "style": [[每行各列样式编号, 没有单元格时为 -1]]
+# }
+COMPACT_MIMETYPE = "application/vnd.table-compact+json"
+
+
+def style_key(cell):
+    font = cell.get('font', {})
+    return (cell.get('foreground'), cell.get('background'), cell.get('alignment'),
+            font.get('bold', False), font.get('size', 10))
+
+
+def encode_table(rows):
+    # 单元格字典格式 -> 紧凑格式, 非数字的键 (如 _id、type) 会被忽略
+    column_count = 0
+    for row in rows:
+        for key in row:
+            if key.isdigit():
+                column_count = max(column_count, int(key) + 1)
+
+    styles = []
+    style_ids = {}
+    row_heights = []
+    column_widths = [None] * column_count
+    texts = []
+    style_rows = []
+    for row in rows:
+        row_texts = [None] * column_count
+        row_styles = [-1] * column_count
+        row_height = None
+        for key, cell in row.items():
+            if not key.isdigit() or not isinstance(cell, dict):
+                continue
+            col = int(key)
+            key_tuple = style_key(cell)
+            style_id = style_ids.get(key_tuple)
+            if style_id is None:
+                style_id = style_ids[key_tuple] = len(styles)
+                styles.append({
+                    'foreground': key_tuple[0],
+                    'background': key_tuple[1],
+                    'alignment': key_tuple[2],
+                    'font': {'bold': key_tuple[3], 'size': key_tuple[4]}
+                })
+            row_texts[col] = cell.get('text', '')
+            row_styles[col] = style_id
+            if row_height is None:
+                row_height = cell.get('row_height')
+            if column_widths[col] is None:
+                column_widths[col] = cell.get('column_width')
+        texts.append(row_texts)
+        style_rows.append(row_styles)
+        row_heights.append(row_height)
+
+    return {
+        'columns': column_count,
+        'styles': styles,
+        'row_heights': row_heights,
+        'column_widths': column_widths,
+        'text': texts,
+        'style': style_rows
+    }
+
+
+def decode_table(compact):
+    # 紧凑格式 -> 单元格字典格式, 用于写入数据库
+    styles = compact['styles']
+    column_widths = compact['column_widths']
+    rows = []
+    for row_texts, row_styles, row_height in zip(compact['text'], compact['style'], compact['row_heights']):
+        row = {}
+        for col, (text, style_id) in enumerate(zip(row_texts, row_styles)):
+            if style_id < 0:
+                continue
+            style = styles[style_id]
+            row[str(col)] = {
+                'text': text,
+                'foreground': style['foreground'],
+                'background': style['background'],
+                'alignment': style['alignment'],
+                'font': dict(style['font']),
+                'row_height': row_height,
+                'column_width': column_widths[col]
+            }
+        rows.append(row)
+    return rows
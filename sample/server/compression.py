@@ -0,0 +1,146 @@
+import gzip
+import io
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from server import config
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖, 未安装时只支持 gzip
+    zstandard = None
+
+
+def supported_encodings():
+    return ("zstd", "gzip") if zstandard else ("gzip",)
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=config.COMPRESSION_LEVEL)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdCompressor(level=config.COMPRESSION_LEVEL).compress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(data, encoding):
+    limit = config.MAX_DECOMPRESSED_BYTES
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result = decompressor.decompress(data, limit + 1)
+    elif encoding == "zstd" and zstandard:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+            result = reader.read(limit + 1)
+    else:
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    if len(result) > limit:
+        raise ValueError("Decompressed request body too large")
+    return result
+
+
+def choose_encoding(accept_encoding):
+    # 按服务器偏好 (zstd 优先) 选择客户端接受的编码
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    for encoding in supported_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def encode_request(payload):
+    # 客户端使用: 将 payload 编码为 JSON, 超过阈值时压缩, 返回 (body, headers).
+    # 响应的 Accept-Encoding 沿用 requests 的默认值, 只声明本机能解压的编码.
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if len(body) >= config.COMPRESSION_MIN_BYTES:
+        body = compress(body, config.COMPRESSION_REQUEST_ENCODING)
+        headers["Content-Encoding"] = config.COMPRESSION_REQUEST_ENCODING
+    return body, headers
+
+
+class DecompressionMiddleware:
+    # WSGI 中间件: 解压带 Content-Encoding 的请求体, 之后 request.json 照常使用
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding and encoding != "identity":
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            try:
+                body = decompress(environ["wsgi.input"].read(length), encoding)
+            except Exception as e:
+                message = json.dumps({"status": "error", "message": str(e)}).encode("utf-8")
+                start_response("400 Bad Request", [("Content-Type", "application/json"),
+                                                   ("Content-Length", str(len(message)))])
+                return [message]
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            del environ["HTTP_CONTENT_ENCODING"]
+        return self.wsgi_app(environ, start_response)
+
+
+class CompressedCache:
+    # 按 (ETag, 编码) 缓存压缩后的响应体, 按字节数做 LRU 淘汰.
+    # server3 的 ETag 是响应体的 SHA-1, 相同 ETag 即相同内容, ResponseCache 命中时不必每次重新压缩
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def install_compression(app):
+    # 解压请求体, 并按 Accept-Encoding 压缩超过阈值的响应 (流式响应不压缩)
+    app.wsgi_app = DecompressionMiddleware(app.wsgi_app)
+    compressed_cache = CompressedCache(config.COMPRESSION_CACHE_BYTES)
+
+    @app.after_request
+    def compress_response(response):
+        from flask import request
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code >= 300
+                or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config.COMPRESSION_MIN_BYTES:
+            return response
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            cache_key = (etag, encoding)
+            compressed = compressed_cache.get(cache_key)
+            if compressed is None:
+                compressed = compress(data, encoding)
+                compressed_cache.put(cache_key, compressed)
+        else:
+            compressed = compress(data, encoding)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        # 压缩后的内容与原文不再逐字节相同, ETag 改为弱校验
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,101 @@
+import os
+
+# 锁策略:
+#   "rw"     每张表 (uri, db_name, collection_name) 一把读写锁, 不同表之间互不阻塞
+#   "mutex"  每张表一把互斥锁, 读写共用
+#   "global" 所有表共用一把读写锁 (旧行为)
+#   "none"   不加进程内锁, 多进程共用集合时靠表版本号 (expected_version / 409) 检测冲突, 需配合 TABLE_SAVE_MODE=swap
+LOCK_STRATEGY = os.environ.get("TABLE_LOCK_STRATEGY", "rw")
+
+# 同一个 uri 共用一个 pymongo.MongoClient 连接池
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))  # 空闲连接超过该时间后关闭
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))  # 等待空闲连接的最长时间
+
+# save_table / save_all 的写入方式:
+#   "swap"     先写入临时集合, 再用 renameCollection 原子替换, 读请求几乎不被阻塞
+#   "in_place" 持有写锁执行 delete_many + insert_many (旧行为)
+SAVE_MODE = os.environ.get("TABLE_SAVE_MODE", "swap")
+# swap 的临时集合创建超过该秒数仍未重命名时视为进程中途退出的遗留, 打开表时删除 (见 rows.drop_stale_staging)
+STAGING_STALE_SECONDS = int(os.environ.get("STAGING_STALE_SECONDS", str(24 * 3600)))
+
+# 缓存已编码的 get_all / get_table 响应并支持 ETag / If-None-Match
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "1") == "1"
+# 响应缓存中响应体的最大总字节数, 超过时按 LRU 淘汰; 表很多时避免缓存无限增长
+RESPONSE_CACHE_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+# 流式 (NDJSON / CSV) 读取时每页读取并发送的行数, 每页单独加读锁
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "500"))
+
+# 请求/响应压缩: 小于该字节数的请求体和响应体不压缩
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "2048"))
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", "6"))
+# 客户端压缩请求体使用的编码, 服务器未安装 zstandard 时只能用 "gzip"
+COMPRESSION_REQUEST_ENCODING = os.environ.get("COMPRESSION_REQUEST_ENCODING", "gzip")
+# 解压后的请求体上限, 防止压缩炸弹; 解压在准入控制之后进行, 同时在处理的请求最多占用 (路由并发上限 x 该值)
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BYTES", str(256 * 1024 * 1024)))
+
+# 表格存储方式:
+#   "rows"   每行一个文档 (旧格式)
+#   "tiled"  每 TILE_BLOCK_SIZE 行打包成一个文档, 行数据按 TILE_CODEC ("none" / "zlib" / "zstd") 压缩
+# 新格式在下一次整表保存时生效, 读取时按集合中的 layout 文档自动识别, 可以逐张表迁移
+STORAGE_LAYOUT = os.environ.get("TABLE_STORAGE_LAYOUT", "rows")
+# 逗号分隔的集合名, 分别强制使用分块存储 / 每行一个文档, 优先于 STORAGE_LAYOUT
+TILED_COLLECTIONS = set(filter(None, os.environ.get("TILED_COLLECTIONS", "").split(",")))
+ROW_COLLECTIONS = set(filter(None, os.environ.get("ROW_COLLECTIONS", "").split(",")))
+TILE_BLOCK_SIZE = int(os.environ.get("TILE_BLOCK_SIZE", "256"))
+TILE_CODEC = os.environ.get("TILE_CODEC", "zlib")
+
+# append_table 合并写入 (group commit): 同一张表在该时间窗口内的追加请求合并成一次无序 insert_many,
+# 累计行数达到上限时提前写入; 窗口为 0 时关闭合并
+APPEND_GROUP_COMMIT_MS = float(os.environ.get("APPEND_GROUP_COMMIT_MS", "5"))
+APPEND_GROUP_COMMIT_MAX_ROWS = int(os.environ.get("APPEND_GROUP_COMMIT_MAX_ROWS", "5000"))
+
+# 端到端追踪: span 以 JSON Lines 追加写入该文件, 为空时关闭; 客户端和服务器分别设置, 用 server.tracing 合并查看
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+
+# 统计每把表锁的等待/持有时间和持有者, 结果见 /debug/locks
+LOCK_PROFILING = os.environ.get("LOCK_PROFILING", "1") == "1"
+
+# 准入控制: 每个路由同时处理和排队的请求数上限 (超过返回 429), 线程池排队任务数上限和排队超时 (超过返回 503)
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1") == "1"
+ADMISSION_ROUTE_LIMITS = os.environ.get("ADMISSION_ROUTE_LIMITS", "save_table=8,save_all=8,append_table=64,batch=16,changes=256,import=2,export=4")
+ADMISSION_DEFAULT_LIMIT = int(os.environ.get("ADMISSION_DEFAULT_LIMIT", "64"))  # 0 表示不限制
+ADMISSION_MAX_EXECUTOR_QUEUE = int(os.environ.get("ADMISSION_MAX_EXECUTOR_QUEUE", "200"))
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", "10000"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))  # 拒绝时返回的 Retry-After 秒数
+# 客户端收到 429/503 时的最大重试次数和单次等待上限 (秒)
+CLIENT_MAX_RETRIES = int(os.environ.get("CLIENT_MAX_RETRIES", "3"))
+CLIENT_MAX_RETRY_DELAY = float(os.environ.get("CLIENT_MAX_RETRY_DELAY", "10"))
+
+# 运行的 worker 进程数, 由 server.serve 设置; 大于 1 时响应缓存按数据库中的表版本号校验
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+
+# 变更日志 (server.changes): 每张表保留的最近变更条数, 更早的版本刷新时需要重新加载整表
+CHANGE_LOG_SIZE = int(os.environ.get("CHANGE_LOG_SIZE", "1000"))
+# 单次追加超过该行数时变更日志只记为 reset, 避免日志文档过大
+CHANGE_LOG_MAX_ROWS = int(os.environ.get("CHANGE_LOG_MAX_ROWS", "5000"))
+# /changes 长轮询的最长等待秒数
+CHANGES_MAX_WAIT = float(os.environ.get("CHANGES_MAX_WAIT", "30"))
+
+# 响应的 JSON 编码器 (server.serializer): auto 表示安装了 orjson 时使用 orjson, 否则使用标准库 json; 也可指定 orjson / json
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto")
+# 整表响应是否包含行文档的 _id; 客户端不使用 _id, 默认在查询时去掉
+RESPONSE_ROW_IDS = os.environ.get("RESPONSE_ROW_IDS", "0") == "1"
+
+# /import 每批写入数据库的行数, 导入时内存中最多保留一批
+IMPORT_BATCH_ROWS = int(os.environ.get("IMPORT_BATCH_ROWS", "1000"))
+
+# /export 生成 xlsx 时临时文件留在内存中的最大字节数, 超过后写入磁盘
+EXPORT_SPOOL_BYTES = int(os.environ.get("EXPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+
+# 多个进程同时追加行或改写同一分块时, 冲突后重试的最多次数; 读取与其他进程的写入重叠时也最多重读这么多次
+WRITE_CONFLICT_RETRIES = int(os.environ.get("WRITE_CONFLICT_RETRIES", "10"))
+# 写入开始时在版本文档上设置的 pending 标记 (server.versions) 超过该秒数未提交时视为写入进程已退出, 可被接管
+WRITE_CLAIM_TIMEOUT = float(os.environ.get("WRITE_CLAIM_TIMEOUT", "60"))
+# 同一张表有其他进程正在写入时, 检查其是否已提交的间隔秒数
+WRITE_CLAIM_POLL_INTERVAL = float(os.environ.get("WRITE_CLAIM_POLL_INTERVAL", "0.01"))
+
+# 按 ETag 缓存压缩后的响应体 (server.compression.CompressedCache) 的最大字节数
+COMPRESSION_CACHE_BYTES = int(os.environ.get("COMPRESSION_CACHE_BYTES", str(64 * 1024 * 1024)))
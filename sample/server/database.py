@@ -1,4 +1,5 @@
 from pymongo import MongoClient
+from server.patch import apply_patch
 
 class MongoDBHandler:
     def __init__(self, uri, db_name, collection_name):
@@ -21,4 +22,7 @@ class MongoDBHandler:
         return result["merged_cells"] if result else []
         
     def append_table(self, data):
-        self.collection.insert_many(data)
\ No newline at end of file
+        self.collection.insert_many(data)
+
+    def patch_cells(self, patch):
+        return apply_patch(self.collection, patch)
@@ -0,0 +1,63 @@
+import threading
+from server.rows import PartialAppendError
+
+
+class _PendingAppend:
+    def __init__(self):
+        self.rows = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+        self.result = None
+
+
+class GroupCommit:
+    # 合并同一张表在短时间内的多次追加写入:
+    # 第一个到达的请求成为 leader, 等待 window_ms 毫秒或累计到 max_rows 行后一次性写入,
+    # 期间到达的请求把行追加到同一批次并等待写入完成.
+    # 写入按提交顺序进行 (ordered insert); 失败时 flush 抛出 PartialAppendError 说明前多少行已写入,
+    # 行全部已写入的请求仍然成功 (返回 None, 该批次没有版本号), 其余请求收到只计入自己行数的 PartialAppendError,
+    # 客户端重试时不会重复写入已保存的行. 其他异常无法判断写入了多少, 同一批次的请求都收到该异常.
+    def __init__(self, window_ms, max_rows):
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, rows, flush):
+        # flush(rows) 由 leader 线程调用, 负责加锁和写入; 返回时本次提交的行已写入, 返回值为该批次 flush 的返回值
+        if self.window <= 0:
+            return flush(rows)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = _PendingAppend()
+                self._pending[key] = batch
+            start = len(batch.rows)  # 本次提交的行在批次中的位置
+            batch.rows.extend(rows)
+            if len(batch.rows) >= self.max_rows:
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                # 从 _pending 移除后不会再有新的行加入该批次
+                del self._pending[key]
+            try:
+                batch.result = flush(batch.rows)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            inserted = getattr(batch.error, "inserted", None)
+            if inserted is None:
+                raise batch.error
+            mine = min(max(inserted - start, 0), len(rows))
+            if mine == len(rows):
+                return None
+            raise PartialAppendError(str(batch.error), mine) from batch.error
+        return batch.result
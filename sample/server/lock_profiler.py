@@ -0,0 +1,156 @@
+import contextvars
+import heapq
+import re
+import threading
+import time
+from server import config
+
+# 带统计的锁包装: 记录每把锁的等待时间、持有时间、当前持有者和排队数量, 供 /debug/locks 查看.
+# 持有者标识为 "线程名 请求", 请求由 install_lock_report 在 before_request 中写入 lock_holder.
+lock_holder = contextvars.ContextVar("lock_holder", default=None)
+LONGEST_HOLDS = 10  # 每把锁保留的最长持有记录数
+
+_profiled_locks = []
+_profiled_locks_lock = threading.Lock()
+
+
+def describe_key(key):
+    # 报告中不显示 uri 里的用户名和密码
+    if isinstance(key, tuple):
+        uri, db_name, collection_name = key
+        return f"{re.sub(r'//[^/@]*@', '//', uri or '')} {db_name}.{collection_name}"
+    return str(key)
+
+
+def holder_identity():
+    label = lock_holder.get()
+    name = threading.current_thread().name
+    return f"{name} {label}" if label else name
+
+
+class _ProfiledHold:
+    def __init__(self, profiled, inner, mode):
+        self._profiled = profiled
+        self._inner = inner
+        self._mode = mode
+        self._acquired_at = None
+
+    def __enter__(self):
+        self._profiled._waiting(self._mode, 1)
+        start = time.perf_counter()
+        try:
+            self._inner.__enter__()
+        finally:
+            self._profiled._waiting(self._mode, -1)
+        self._acquired_at = time.perf_counter()
+        self._profiled._acquired(self, self._mode, self._acquired_at - start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        hold = time.perf_counter() - self._acquired_at
+        try:
+            return self._inner.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._profiled._released(self, self._mode, hold)
+
+
+class ProfiledLock:
+    # 与 rwlock.RWLockFairD 相同的 gen_rlock() / gen_wlock() 接口
+    def __init__(self, lock, key):
+        self._lock = lock
+        self.key = key
+        self._stats_lock = threading.Lock()
+        self._queue = {"read": 0, "write": 0}
+        self._holders = {}
+        self._acquisitions = {"read": 0, "write": 0}
+        self._wait_total = {"read": 0.0, "write": 0.0}
+        self._wait_max = {"read": 0.0, "write": 0.0}
+        self._hold_total = {"read": 0.0, "write": 0.0}
+        self._hold_max = {"read": 0.0, "write": 0.0}
+        self._longest = []  # 最小堆, 保留 LONGEST_HOLDS 条 (持有时间, 序号, 记录)
+        self._sequence = 0
+
+    def gen_rlock(self):
+        return _ProfiledHold(self, self._lock.gen_rlock(), "read")
+
+    def gen_wlock(self):
+        return _ProfiledHold(self, self._lock.gen_wlock(), "write")
+
+    def _waiting(self, mode, delta):
+        with self._stats_lock:
+            self._queue[mode] += delta
+
+    def _acquired(self, hold, mode, waited):
+        with self._stats_lock:
+            self._acquisitions[mode] += 1
+            self._wait_total[mode] += waited
+            self._wait_max[mode] = max(self._wait_max[mode], waited)
+            self._holders[id(hold)] = {"holder": holder_identity(), "mode": mode, "since": time.time()}
+
+    def _released(self, hold, mode, held):
+        with self._stats_lock:
+            record = self._holders.pop(id(hold), None) or {"holder": holder_identity(), "mode": mode}
+            self._hold_total[mode] += held
+            self._hold_max[mode] = max(self._hold_max[mode], held)
+            self._sequence += 1
+            entry = (held, self._sequence, {"holder": record["holder"], "mode": mode,
+                                            "seconds": round(held, 6), "released_at": time.time()})
+            if len(self._longest) < LONGEST_HOLDS:
+                heapq.heappush(self._longest, entry)
+            elif held > self._longest[0][0]:
+                heapq.heapreplace(self._longest, entry)
+
+    def snapshot(self):
+        with self._stats_lock:
+            now = time.time()
+            acquisitions = sum(self._acquisitions.values())
+            wait_total = sum(self._wait_total.values())
+            return {
+                "key": describe_key(self.key),
+                "acquisitions": dict(self._acquisitions),
+                "queue": dict(self._queue),
+                "wait_total_seconds": {mode: round(value, 6) for mode, value in self._wait_total.items()},
+                "wait_max_seconds": {mode: round(value, 6) for mode, value in self._wait_max.items()},
+                "wait_avg_seconds": round(wait_total / acquisitions, 6) if acquisitions else 0.0,
+                "hold_total_seconds": {mode: round(value, 6) for mode, value in self._hold_total.items()},
+                "hold_max_seconds": {mode: round(value, 6) for mode, value in self._hold_max.items()},
+                "holders": [dict(record, held_seconds=round(now - record["since"], 6))
+                            for record in self._holders.values()],
+                "longest_holds": [entry[2] for entry in sorted(self._longest, reverse=True)],
+            }
+
+
+def profile_lock(lock, key):
+    # LockRegistry 在 config.LOCK_PROFILING 打开时用它包装新建的锁
+    profiled = ProfiledLock(lock, key)
+    with _profiled_locks_lock:
+        _profiled_locks.append(profiled)
+    return profiled
+
+
+def lock_report(top=10):
+    # 按累计等待时间排序, 返回竞争最严重的 top 把锁
+    with _profiled_locks_lock:
+        locks = list(_profiled_locks)
+    snapshots = [lock.snapshot() for lock in locks]
+    snapshots.sort(key=lambda item: sum(item["wait_total_seconds"].values()), reverse=True)
+    return {"profiling": config.LOCK_PROFILING, "lock_count": len(snapshots), "locks": snapshots[:top]}
+
+
+def install_lock_report(app):
+    # 注册 /debug/locks, 并把当前请求记为锁的持有者标识
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def set_lock_holder():
+        g.lock_holder_token = lock_holder.set(f"{request.method} {request.path}")
+
+    @app.teardown_request
+    def reset_lock_holder(error=None):
+        token = g.pop("lock_holder_token", None)
+        if token is not None:
+            lock_holder.reset(token)
+
+    @app.route('/debug/locks', methods=['GET'])
+    def debug_locks_route():
+        return jsonify(lock_report(int(request.args.get('top', 10))))
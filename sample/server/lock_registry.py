@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager, nullcontext
+from readerwriterlock import rwlock
+from server import config
+from server.lock_profiler import profile_lock
+
+
+class MutexLock:
+    # 读写共用一把互斥锁, 接口与 rwlock.RWLockFairD 保持一致
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def gen_rlock(self):
+        return self._lock
+
+    def gen_wlock(self):
+        return self._lock
+
+
+class NullLock:
+    # 不加锁, 供多个服务器进程共用同一集合、由版本号 (server.versions) 发现并发写入时使用
+    def gen_rlock(self):
+        return nullcontext()
+
+    def gen_wlock(self):
+        return nullcontext()
+
+
+class AsyncMutexLock:
+    # asyncio 版本的 MutexLock, 用法为 async with lock.gen_wlock()
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    def gen_rlock(self):
+        return self._lock
+
+    def gen_wlock(self):
+        return self._lock
+
+
+class AsyncRWLock:
+    # asyncio 版本的读写锁, 有写请求排队时不再放入新的读请求, 避免写饥饿
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @asynccontextmanager
+    async def gen_rlock(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def gen_wlock(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class LockRegistry:
+    def __init__(self, strategy=None, use_asyncio=False):
+        self.strategy = strategy or config.LOCK_STRATEGY
+        if self.strategy not in ("rw", "mutex", "global", "none"):
+            raise ValueError(f"Unknown lock strategy: {self.strategy}")
+        self.use_asyncio = use_asyncio  # True 时返回 asyncio 锁, 供 server_async 使用
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+        self._global_lock = AsyncRWLock() if use_asyncio else self._profile(rwlock.RWLockFairD(), "global")
+
+    def _profile(self, lock, key):
+        # asyncio 锁不做统计
+        if config.LOCK_PROFILING and not self.use_asyncio:
+            return profile_lock(lock, key)
+        return lock
+
+    def _create_lock(self, key):
+        if self.strategy == "none":
+            return NullLock()
+        if self.use_asyncio:
+            return AsyncMutexLock() if self.strategy == "mutex" else AsyncRWLock()
+        if self.strategy == "mutex":
+            return self._profile(MutexLock(), key)
+        return self._profile(rwlock.RWLockFairD(), key)
+
+    def get_lock(self, uri, db_name, collection_name):
+        if self.strategy == "global":
+            return self._global_lock
+        key = (uri, db_name, collection_name)
+        lock = self._locks.get(key)
+        if lock is None:
+            with self._registry_lock:
+                lock = self._locks.get(key)
+                if lock is None:
+                    lock = self._create_lock(key)
+                    self._locks[key] = lock
+        return lock
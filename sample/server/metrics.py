@@ -0,0 +1,246 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, request
+from server.tracing import record_span, span
+
+# 进程内指标, 以 Prometheus 文本格式 (0.0.4) 在 /metrics 输出
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(11))  # 256B ~ 256MB
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        # 无标签的 gauge 可以在输出时才读取当前值, 例如线程池队列长度
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数 (非累计), sum, count]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "table_request_duration_seconds", "HTTP request latency by route", ("route", "method", "status")))
+STEP_LATENCY = REGISTRY.register(Histogram(
+    "table_step_duration_seconds", "Latency of individual steps inside a handler operation", ("operation", "step")))
+PAYLOAD_SIZE = REGISTRY.register(Histogram(
+    "table_payload_bytes", "Request and response body sizes before compression", ("route", "direction"), SIZE_BUCKETS))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "table_requests_in_flight", "Requests currently being handled", ("route",)))
+EXECUTOR_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "table_executor_queue_depth", "Tasks waiting for a worker in the handler thread pool"))
+
+
+@contextmanager
+def timed(operation, step):
+    # 同时记录直方图和追踪 span (请求带有追踪头时)
+    with span(step, operation=operation), STEP_LATENCY.time(operation=operation, step=step):
+        yield
+
+
+def _observe_lock_wait(operation, step, wall_start, start):
+    waited = time.perf_counter() - start
+    STEP_LATENCY.observe(waited, operation=operation, step=step)
+    record_span(step, wall_start, waited, operation=operation)
+
+
+@contextmanager
+def read_lock(lock, operation):
+    # 记录等待读锁的时间, 锁在 with 块结束时释放
+    wall_start, start = time.time(), time.perf_counter()
+    with lock.gen_rlock():
+        _observe_lock_wait(operation, "lock_wait_read", wall_start, start)
+        yield
+
+
+@contextmanager
+def write_lock(lock, operation):
+    wall_start, start = time.time(), time.perf_counter()
+    with lock.gen_wlock():
+        _observe_lock_wait(operation, "lock_wait_write", wall_start, start)
+        yield
+
+
+def install_metrics(app, executor=None):
+    # 为每个请求记录延迟、进行中请求数和请求/响应大小, 并注册 /metrics
+    if executor is not None:
+        EXECUTOR_QUEUE_DEPTH.set_function(lambda: executor._work_queue.qsize())
+
+    def route_name():
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    @app.before_request
+    def start_request_metrics():
+        request.environ["metrics.start"] = time.perf_counter()
+        request.environ["metrics.route"] = route_name()
+        IN_FLIGHT.inc(route=request.environ["metrics.route"])
+        if request.content_length:
+            PAYLOAD_SIZE.observe(request.content_length, route=request.environ["metrics.route"], direction="request")
+
+    @app.after_request
+    def record_response_metrics(response):
+        route = request.environ.get("metrics.route")
+        request.environ["metrics.status"] = response.status_code
+        if route is not None and not response.is_streamed:
+            PAYLOAD_SIZE.observe(response.calculate_content_length() or 0, route=route, direction="response")
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error=None):
+        start = request.environ.pop("metrics.start", None)
+        route = request.environ.pop("metrics.route", None)
+        if start is None:
+            return
+        IN_FLIGHT.dec(route=route)
+        status = "500" if error is not None else str(request.environ.get("metrics.status", ""))
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method, status=status)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_route():
+        return Response(REGISTRY.render(), mimetype=PROMETHEUS_MIMETYPE)
@@ -0,0 +1,58 @@
+import threading
+from pymongo import MongoClient
+from server import config
+
+# 按 uri 缓存 MongoClient, 所有表共用同一个连接池和监控线程
+_clients = {}
+_clients_lock = threading.Lock()
+_async_clients = {}
+
+
+def get_client(uri):
+    client = _clients.get(uri)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(uri)
+            if client is None:
+                client = MongoClient(
+                    uri,
+                    maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=config.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                )
+                _clients[uri] = client
+    return client
+
+
+def get_async_client(uri):
+    # server_async 使用的 motor 客户端, 只在事件循环线程中调用, 不需要加锁
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = _async_clients.get(uri)
+    if client is None:
+        client = AsyncIOMotorClient(
+            uri,
+            maxPoolSize=config.MONGO_MAX_POOL_SIZE,
+            minPoolSize=config.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=config.MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        )
+        _async_clients[uri] = client
+    return client
+
+
+def discard_all():
+    # fork 之后在子进程中调用: 继承自父进程的客户端不可再用, 直接丢弃而不关闭父进程的连接
+    with _clients_lock:
+        _clients.clear()
+        _async_clients.clear()
+
+
+def close_all():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        for client in _async_clients.values():
+            client.close()
+        _async_clients.clear()
@@ -0,0 +1,65 @@
+from pymongo import UpdateOne, UpdateMany
+from server.rows import ROW_FILTER, ROW_FIELD, ensure_row_numbers, has_row
+from server.tiled import apply_tiled_patch, get_layout
+
+
+def needs_row_ids(patch):
+    return bool(patch.get("cells") or patch.get("rows"))
+
+
+def patch_row_numbers(patch):
+    return [int(cell["row"]) for cell in patch.get("cells") or []] + \
+           [int(row["row"]) for row in patch.get("rows") or []]
+
+
+def build_patch_operations(patch):
+    # patch 格式:
+    #   cells:        [{"row": 行号, "col": 列号, "data": 单元格字典}]
+    #   rows:         [{"row": 行号, "row_height": 行高}]
+    #   columns:      [{"col": 列号, "column_width": 列宽}]
+    #   column_count: 列数, 修改行高时需要更新该行每个单元格
+    #   merged_cells: 可选, 完整的合并单元格列表
+    cells = patch.get("cells") or []
+    rows = patch.get("rows") or []
+    columns = patch.get("columns") or []
+    operations = []
+
+    if cells or rows:
+        # 按 row 字段定位行文档, 调用方需先用 ensure_row_numbers 给旧数据编号
+        def row_filter(row):
+            return {ROW_FIELD: row}
+
+        for cell in cells:
+            operations.append(UpdateOne(row_filter(int(cell["row"])),
+                                        {"$set": {str(cell["col"]): cell["data"]}}))
+
+        column_count = int(patch.get("column_count", 0))
+        for row in rows:
+            fields = {f"{col}.row_height": row["row_height"] for col in range(column_count)}
+            if fields:
+                operations.append(UpdateOne(row_filter(int(row["row"])), {"$set": fields}))
+
+    for column in columns:
+        operations.append(UpdateMany(ROW_FILTER, {"$set": {f"{column['col']}.column_width": column["column_width"]}}))
+
+    if patch.get("merged_cells") is not None:
+        operations.append(UpdateOne({"type": "merged_cells"},
+                                    {"$set": {"merged_cells": patch["merged_cells"]}}, upsert=True))
+    return operations
+
+
+def apply_patch(collection, patch):
+    layout = get_layout(collection)
+    if layout is not None:
+        return apply_tiled_patch(collection, layout, patch)
+    if needs_row_ids(patch):
+        # 按 row 索引定位; 行号连续, 最大行号存在即全部存在
+        ensure_row_numbers(collection)
+        row_numbers = patch_row_numbers(patch)
+        if min(row_numbers) < 0 or not has_row(collection, max(row_numbers)):
+            raise ValueError(f"Row {max(row_numbers)} out of range")
+    operations = build_patch_operations(patch)
+    if not operations:
+        return 0
+    result = collection.bulk_write(operations, ordered=True)
+    return result.modified_count + result.upserted_count
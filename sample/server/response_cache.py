@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class _Flight:
+    # 同一张表同一路由的并发冷读只查询一次 Mongo, 其余请求等待结果
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    # 按 (表, 路由) 缓存已经编码好的响应体和 ETag, 写操作调用 invalidate 使其失效.
+    # 响应体总字节数超过 max_bytes 时淘汰最久未使用的条目, 单个超过 max_bytes 的响应不缓存
+    def __init__(self, enabled=True, max_bytes=None):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (table_key, name) -> ((version, generation), body, etag), 按使用顺序排列
+        self._size = 0  # _entries 中响应体的总字节数
+        self._versions = {}  # table_key -> 写入次数
+        self._flights = {}   # (table_key, name, version) -> _Flight
+        self._lock = threading.Lock()
+
+    def invalidate(self, table_key):
+        with self._lock:
+            self._versions[table_key] = self._versions.get(table_key, 0) + 1
+            for entry_key in [k for k in self._entries if k[0] == table_key]:
+                self._remove(entry_key)
+
+    def _remove(self, entry_key):
+        # 调用方持有 self._lock
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def _store(self, entry_key, entry):
+        # 调用方持有 self._lock
+        self._remove(entry_key)
+        if self.max_bytes is not None and len(entry[1]) > self.max_bytes:
+            return
+        self._entries[entry_key] = entry
+        self._size += len(entry[1])
+        while self.max_bytes is not None and self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def get_or_load(self, table_key, name, loader, generation=None):
+        # loader 返回编码好的 bytes, 本方法返回 (body, etag).
+        # generation 为调用方提供的外部版本 (例如数据库中的表版本号), 与缓存时不同则视为未命中
+        if not self.enabled:
+            body = loader()
+            return body, make_etag(body)
+
+        with self._lock:
+            version = (self._versions.get(table_key, 0), generation)
+            entry = self._entries.get((table_key, name))
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end((table_key, name))
+                return entry[1], entry[2]
+            flight_key = (table_key, name, version)
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            body = loader()
+            flight.result = (body, make_etag(body))
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+                # 加载期间如果有写入, 版本号已变化, 结果不再缓存
+                if flight.error is None and self._versions.get(table_key, 0) == version[0]:
+                    self._store((table_key, name), (version, *flight.result))
+            flight.event.set()
+        return flight.result
+
+
+def make_etag(body):
+    return hashlib.sha1(body).hexdigest()
@@ -0,0 +1,195 @@
+import time
+import uuid
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from server import config
+
+# 表格行文档的过滤条件, 合并单元格信息单独存放在 type=merged_cells 的文档里
+ROW_FILTER = {"type": {"$ne": "merged_cells"}}
+# 每个行文档的 row 字段保存行号 (从 0 开始), 读取时按 row 排序
+ROW_FIELD = "row"
+# 没有行号的旧数据行文档
+UNNUMBERED_FILTER = {**ROW_FILTER, ROW_FIELD: {"$exists": False}}
+# 返回给客户端的整表数据不包含 row 字段, 保持原有的单元格字典格式
+ROW_PROJECTION = {ROW_FIELD: 0}
+# 整表响应的投影: 默认在查询时去掉 _id, 不再逐行把 ObjectId 转成字符串; 保留时由 server.serializer 编码
+RESPONSE_PROJECTION = ROW_PROJECTION if config.RESPONSE_ROW_IDS else {"_id": 0, **ROW_PROJECTION}
+# /get_columns 可选的字段范围
+COLUMN_FIELDS = ("text", "style")
+
+
+class PartialAppendError(RuntimeError):
+    # 追加写入中途失败: 按提交顺序前 inserted 行已经写入, 之后的行没有写入, 重试时只需提交剩余的行
+    def __init__(self, message, inserted):
+        super().__init__(message)
+        self.inserted = inserted
+
+
+INDEXES = [
+    # row 上的唯一索引只覆盖带行号的文档, 兼容没有行号的旧数据; type 索引用于查找合并单元格文档
+    ([(ROW_FIELD, ASCENDING)], {"name": "row_1", "unique": True, "partialFilterExpression": {ROW_FIELD: {"$exists": True}}}),
+    ([("type", ASCENDING)], {"name": "type_1", "sparse": True}),
+    # 分块存储 (server.tiled) 的块号索引
+    ([("block", ASCENDING)], {"name": "block_1", "unique": True, "partialFilterExpression": {"block": {"$exists": True}}}),
+]
+
+
+def ensure_indexes(collection):
+    for keys, options in INDEXES:
+        collection.create_index(keys, **options)
+
+
+async def ensure_indexes_async(collection):
+    # motor 集合版本, 供 server_async 使用
+    for keys, options in INDEXES:
+        await collection.create_index(keys, **options)
+
+
+STAGING_MARKER = "__staging_"
+
+
+def staging_collection(collection):
+    # 整表替换时先写入的临时集合, 写完后重命名为正式集合; 名字中带创建时间, 见 drop_stale_staging
+    return collection.database[f"{collection.name}{STAGING_MARKER}{int(time.time())}_{uuid.uuid4().hex}"]
+
+
+def stale_staging_names(names, collection_name, now=None):
+    # 进程在写临时集合和重命名之间退出时留下的临时集合: 创建超过 STAGING_STALE_SECONDS 的,
+    # 以及名字中没有创建时间的旧格式临时集合. 较新的可能是其他进程正在进行的整表替换, 保留
+    prefix = collection_name + STAGING_MARKER
+    now = time.time() if now is None else now
+    stale = []
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        created, _, token = name[len(prefix):].partition("_")
+        if not token or not created.isdigit() or now - int(created) > config.STAGING_STALE_SECONDS:
+            stale.append(name)
+    return stale
+
+
+def drop_stale_staging(collection):
+    for name in stale_staging_names(collection.database.list_collection_names(), collection.name):
+        collection.database.drop_collection(name)
+
+
+async def drop_stale_staging_async(collection):
+    # motor 集合版本, 供 server_async 使用
+    for name in stale_staging_names(await collection.database.list_collection_names(), collection.name):
+        await collection.database.drop_collection(name)
+
+
+def swap_in(staging, collection):
+    # 用写好的临时集合原子替换正式集合; 失败时删除临时集合, 正式集合保持原样
+    try:
+        staging.rename(collection.name, dropTarget=True)
+    except Exception:
+        staging.drop()
+        raise
+
+
+def number_rows(data, start=0):
+    # 按列表顺序写入行号, 直接修改并返回 data
+    for offset, row in enumerate(data):
+        row[ROW_FIELD] = start + offset
+    return data
+
+
+def renumber_operations(row_ids):
+    # 按 row_ids 的顺序重新编号为 0..n-1; row 上有唯一索引, 先全部改成负数再改成最终行号, 避免中途冲突
+    return ([UpdateOne({"_id": row_id}, {"$set": {ROW_FIELD: -1 - index}}) for index, row_id in enumerate(row_ids)],
+            [UpdateOne({"_id": row_id}, {"$set": {ROW_FIELD: index}}) for index, row_id in enumerate(row_ids)])
+
+
+# 已确认所有行文档都有行号的集合 (库名, 集合名); 所有写入路径都会写 row, 编号后不会再出现没有行号的行
+_numbered = set()
+
+
+def ensure_row_numbers(collection):
+    # 旧数据的行文档没有 row 字段; 第一次追加或修改时按当前的显示顺序 (find_rows 的顺序) 给所有行编号,
+    # 避免按行号追加的新行与按自然顺序定位的旧行混在一起. 调用方需持有写锁
+    key = (collection.database.name, collection.name)
+    if key in _numbered:
+        return
+    if collection.find_one(UNNUMBERED_FILTER, {"_id": 1}) is not None:
+        row_ids = [doc["_id"] for doc in find_rows(collection, {"_id": 1})]
+        for operations in renumber_operations(row_ids):
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+    _numbered.add(key)
+
+
+def next_row_number(collection):
+    last = collection.find_one(ROW_FILTER, {ROW_FIELD: 1}, sort=[(ROW_FIELD, DESCENDING)])
+    if last is None or ROW_FIELD not in last:
+        return 0
+    return last[ROW_FIELD] + 1
+
+
+def is_duplicate(error):
+    # BulkWriteError 的第一个错误是否为 row / block 唯一索引的冲突 (_id 由驱动生成, 不会重复)
+    errors = error.details.get("writeErrors") or []
+    return bool(errors) and errors[0].get("code") == 11000 and (
+        "_id" not in (errors[0].get("keyPattern") or {}) and "_id_" not in errors[0].get("errmsg", ""))
+
+
+def insert_rows(collection, data):
+    # 把 data 追加到表尾, 行号接在已有的最大行号之后. 多个进程同时追加时会取到相同的起始行号,
+    # 后写入的一方在 row 唯一索引上冲突: 已写入的行保留, 剩余的行重新取行号后继续, 行号保持连续
+    # 失败时抛出 PartialAppendError, 说明已写入多少行
+    data = list(data or [])
+    inserted = 0
+    for _ in range(config.WRITE_CONFLICT_RETRIES):
+        if not data:
+            return
+        try:
+            collection.insert_many(number_rows(data, next_row_number(collection)), ordered=True)
+            return
+        except BulkWriteError as e:
+            inserted += e.details["nInserted"]
+            if not is_duplicate(e):
+                raise PartialAppendError(f"Append to {collection.name} failed: {e}", inserted) from e
+            data = data[e.details["nInserted"]:]
+    raise PartialAppendError(f"Append to {collection.name} still conflicting after {config.WRITE_CONFLICT_RETRIES} attempts",
+                             inserted)
+
+
+def has_row(collection, row):
+    return collection.find_one({ROW_FIELD: row}, {"_id": 1}) is not None
+
+
+def find_rows(collection, projection=None, **kwargs):
+    # 按行号顺序读取所有行文档
+    return collection.find(ROW_FILTER, projection, **kwargs).sort(ROW_FIELD, ASCENDING)
+
+
+def column_projection(columns, fields="text"):
+    # /get_columns 的投影: 只取指定列, fields 为 text 时只取单元格的 text, 为 style 时取完整的单元格字典
+    if fields not in COLUMN_FIELDS:
+        raise ValueError(f"Unknown column fields {fields!r}, expected one of {COLUMN_FIELDS}")
+    suffix = ".text" if fields == "text" else ""
+    projection = {"_id": 0, ROW_FIELD: 1}
+    for col in columns:
+        projection[f"{int(col)}{suffix}"] = 1
+    return projection
+
+
+def project_row(row, columns, fields="text"):
+    # 与 column_projection 结果相同的内存投影, 用于无法在数据库中投影的分块存储
+    projected = {ROW_FIELD: row[ROW_FIELD]} if ROW_FIELD in row else {}
+    for col in columns:
+        cell = row.get(str(int(col)))
+        if fields == "style":
+            if cell is not None:
+                projected[str(int(col))] = cell
+        elif isinstance(cell, dict) and "text" in cell:
+            projected[str(int(col))] = {"text": cell["text"]}
+    return projected
+
+
+def find_row_range(collection, start, end, projection=None):
+    # 读取 [start, end) 范围内的行, 走 row 索引的范围扫描; end 为 None 表示读到末尾
+    query = {ROW_FIELD: {"$gte": start}}
+    if end is not None:
+        query[ROW_FIELD]["$lt"] = end
+    return collection.find(query, projection).sort(ROW_FIELD, ASCENDING)
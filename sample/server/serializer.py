@@ -0,0 +1,63 @@
+import json
+from datetime import datetime
+from bson import ObjectId
+from server import config
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖, 未安装时使用标准库 json
+    orjson = None
+
+# 响应的 JSON 编码: 安装了 orjson 时用 orjson (比标准库快数倍), 否则用标准库 json.
+# ObjectId / datetime 在编码时直接转换, 不需要先逐行把 _id 改成字符串.
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def backend():
+    # config.JSON_BACKEND: auto (有 orjson 时使用) / orjson / json
+    if config.JSON_BACKEND == "json" or orjson is None:
+        if config.JSON_BACKEND == "orjson":
+            raise RuntimeError("JSON_BACKEND=orjson but orjson is not installed")
+        return "json"
+    return "orjson"
+
+
+BACKEND = backend()
+
+
+def dumps(obj):
+    # 返回 UTF-8 编码的 bytes
+    if BACKEND == "orjson":
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def install_serializer(app):
+    # 让 jsonify 和 request.json 也使用同一个编码器, 所有路由的请求/响应都经过这里
+    from flask.json.provider import DefaultJSONProvider
+
+    class FastJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return dumps(obj).decode("utf-8")
+
+        def loads(self, s, **kwargs):
+            return loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = args[0] if len(args) == 1 else (args or kwargs)
+            return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+    app.json = FastJSONProvider(app)
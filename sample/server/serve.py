@@ -0,0 +1,84 @@
+import importlib
+import multiprocessing
+import os
+import sys
+
+# 生产环境启动入口: 用 gunicorn 以 pre-fork 方式在同一端口运行多个 worker 进程,
+# 每个 worker 有自己的 Mongo 连接池、线程池和表锁. 用法:
+#   python -m server.serve [模块:app]      默认 server.server3:app
+# kill -HUP <master pid> 平滑重启所有 worker (重新加载代码), kill -TERM 等待进行中的请求完成后退出.
+# 多个 worker 之间没有共享的进程内锁:
+#   - 追加行: row / block 唯一索引上冲突时重新取行号或块号重试 (rows.insert_rows, tiled.append_rows)
+#   - 改写分块: 按块的 rev 比较并交换 (tiled.apply_tiled_patch)
+#   - 整表保存: 只能用 TABLE_SAVE_MODE=swap (原子重命名), delete+insert 方式下其他 worker 的追加会与之交错
+#   - 读-改-写的丢失更新 (两个客户端基于同一版本各自保存) 只有带 expected_version 的请求才能发现 (409)
+
+DEFAULT_APP = "server.server3:app"
+
+
+def worker_count():
+    workers = int(os.environ.get("SERVER_WORKERS", "0"))
+    return workers if workers > 0 else multiprocessing.cpu_count() * 2 + 1
+
+
+def gunicorn_options(workers):
+    return {
+        "bind": os.environ.get("SERVER_BIND", "0.0.0.0:5002"),
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": int(os.environ.get("SERVER_THREADS", "8")),  # 每个 worker 处理请求的线程数
+        "keepalive": int(os.environ.get("SERVER_KEEPALIVE", "5")),  # keep-alive 连接的空闲秒数
+        "timeout": int(os.environ.get("SERVER_TIMEOUT", "120")),  # worker 无响应多少秒后被重启
+        "graceful_timeout": int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30")),  # 重启时等待进行中请求的秒数
+        "max_requests": int(os.environ.get("SERVER_MAX_REQUESTS", "0")),  # 处理多少请求后自动替换 worker, 0 表示不替换
+        "max_requests_jitter": int(os.environ.get("SERVER_MAX_REQUESTS_JITTER", "0")),
+        "preload_app": os.environ.get("SERVER_PRELOAD", "0") == "1",
+        "post_fork": post_fork,
+    }
+
+
+def post_fork(server, worker):
+    # pymongo 客户端不能跨 fork 使用; preload 时 master 中创建的客户端在 worker 中丢弃, 由 worker 重新建立连接池
+    from server import mongo_pool
+    mongo_pool.discard_all()
+
+
+def load_app(target):
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "app")
+
+
+def main(argv):
+    target = argv[1] if len(argv) > 1 else DEFAULT_APP
+    workers = worker_count()
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:  # gunicorn 为可选依赖, 未安装时退回单进程多线程 (不开 debug / reloader)
+        print("gunicorn is not installed, falling back to a single process server")
+        host, _, port = os.environ.get("SERVER_BIND", "0.0.0.0:5002").rpartition(":")
+        load_app(target).run(host=host or "0.0.0.0", port=int(port), threaded=True, debug=False, use_reloader=False)
+        return
+
+    if workers > 1 and os.environ.get("TABLE_SAVE_MODE", "swap") != "swap":
+        sys.exit("TABLE_SAVE_MODE=swap is required when running more than one worker (set SERVER_WORKERS=1 otherwise)")
+
+    # 各 worker 的响应缓存看不到其他 worker 的写入, 需要按表版本号校验 (见 server3.cache_generation)
+    os.environ["SERVER_WORKERS"] = str(workers)
+
+    class Application(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app(target)
+
+    Application(gunicorn_options(workers)).run()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
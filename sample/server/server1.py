@@ -1,90 +1,112 @@
 from flask import Flask, request, jsonify
-from pymongo import MongoClient
 import json
-import time
 from concurrent.futures import ThreadPoolExecutor
-from readerwriterlock import rwlock
+import threading
+from server import config
+from server.lock_registry import LockRegistry
+from server.compression import install_compression
+from server.mongo_pool import get_client
+from server.patch import apply_patch
+from server.batch import run_batch
+from server.rows import ROW_PROJECTION, PartialAppendError, drop_stale_staging, ensure_indexes
+from server.tiled import append_table_rows, build_table_documents, find_table_rows
+from server.changes import ensure_change_indexes, versioned_write
+from server.group_commit import GroupCommit
+from server.metrics import install_metrics, read_lock, timed, write_lock
+from server.tracing import copy_context, install_tracing
+from server.lock_profiler import install_lock_report
+from server.admission import AdmissionController, install_admission_control
 
 app = Flask(__name__)
+install_compression(app)  # 解压请求体, 按 Accept-Encoding 压缩响应
 executor = ThreadPoolExecutor(max_workers=40)  # 根据需求调整线程池大小
+install_metrics(app, executor)  # 请求/步骤延迟直方图, 见 /metrics
+install_tracing(app, "server1")  # 带 X-Trace-Id 的请求记录 span, 见 config.TRACE_FILE
+install_lock_report(app)  # 锁等待/持有统计, 见 /debug/locks
+admission = AdmissionController(executor)
+install_admission_control(app, admission)  # 过载时快速返回 429/503 和 Retry-After
 
 # 全局变量来存储 MongoDBHandler 实例
 db_handlers = {}
-lock = rwlock.RWLockFairD()
+db_handlers_lock = threading.Lock()
+# 每张表一把锁, 锁策略见 config.LOCK_STRATEGY
+lock_registry = LockRegistry()
+# 合并同一张表的小批量追加写入
+append_commit = GroupCommit(config.APPEND_GROUP_COMMIT_MS, config.APPEND_GROUP_COMMIT_MAX_ROWS)
 
 class MongoDBHandler:
     def __init__(self, uri, db_name, collection_name):
-        self.client = MongoClient(uri)
+        self.client = get_client(uri)  # 同一 uri 的所有表共用一个连接池
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
-
+        self.key = (uri, db_name, collection_name)
+        self.lock = lock_registry.get_lock(uri, db_name, collection_name)
+        ensure_indexes(self.collection)
+        ensure_change_indexes(self.collection)
+        drop_stale_staging(self.collection)
+
+    # 与 server3 / batch.py 使用相同的存储格式 (行号、分块存储) 并记录版本号和变更日志, server3 的 /changes 能看到这里的写入.
+    # 但 server3 的响应缓存只在 SERVER_WORKERS > 1 时按数据库中的版本号区分 (见 server3.cache_generation),
+    # 单进程的 server3 不会因这里的写入使缓存失效, 与本服务器共用表时 server3 需按多 worker 配置 SERVER_WORKERS
     def save_table(self, data):
-        start_time = time.time()
-        with lock.gen_wlock():
-            step_start_time = time.time()
-            self.collection.delete_many({})
-            step_end_time = time.time()
-            print(f"Delete many took {step_end_time - step_start_time:.4f} seconds")
-
-            step_start_time = time.time()
-            self.collection.insert_many(data)
-            step_end_time = time.time()
-            print(f"Insert many took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"save_table execution time: {end_time - start_time:.4f} seconds")
+        with write_lock(self.lock, "save_table"), versioned_write(self.collection):
+            with timed("save_table", "mongo_delete"):
+                self.collection.delete_many({})
+            with timed("save_table", "mongo_insert"):
+                if data:
+                    self.collection.insert_many(build_table_documents(self.collection.name, data))
 
     def get_table(self):
-        start_time = time.time()
-        with lock.gen_rlock():
-            step_start_time = time.time()
-            result = list(self.collection.find({}, {"_id": 0}))
-            step_end_time = time.time()
-            print(f"Find took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"get_table execution time: {end_time - start_time:.4f} seconds")
-        return result
+        # 按行号排序, 合并单元格文档放在最后
+        with read_lock(self.lock, "get_table"):
+            with timed("get_table", "mongo_find"):
+                return (list(find_table_rows(self.collection, {"_id": 0, **ROW_PROJECTION}))
+                        + list(self.collection.find({"type": "merged_cells"}, {"_id": 0})))
 
     def save_merged_cells(self, merged_cells):
-        start_time = time.time()
-        with lock.gen_wlock():
-            step_start_time = time.time()
-            self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
-            step_end_time = time.time()
-            print(f"Update one took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"save_merged_cells execution time: {end_time - start_time:.4f} seconds")
+        with write_lock(self.lock, "save_merged_cells"), versioned_write(self.collection) as write:
+            write.describe("save_merged_cells", merged_cells=merged_cells)
+            with timed("save_merged_cells", "mongo_update"):
+                self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
 
     def get_merged_cells(self):
-        start_time = time.time()
-        with lock.gen_rlock():
-            step_start_time = time.time()
-            result = self.collection.find_one({"type": "merged_cells"})
-            step_end_time = time.time()
-            print(f"Find one took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"get_merged_cells execution time: {end_time - start_time:.4f} seconds")
+        with read_lock(self.lock, "get_merged_cells"):
+            with timed("get_merged_cells", "mongo_find"):
+                result = self.collection.find_one({"type": "merged_cells"})
         return result["merged_cells"] if result else []
 
     def append_table(self, data):
-        start_time = time.time()
-        with lock.gen_wlock():
-            step_start_time = time.time()
-            self.collection.insert_many(data)
-            step_end_time = time.time()
-            print(f"Insert many took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"append_table execution time: {end_time - start_time:.4f} seconds")
+        if data:
+            with timed("append_table", "group_commit"):
+                append_commit.submit(self.key, data, self.flush_appends)
+
+    def flush_appends(self, data):
+        # 由 GroupCommit 调用, 一批合并后的行只加一次写锁, 版本号也只加一
+        with write_lock(self.lock, "append_table"), versioned_write(self.collection) as write:
+            write.describe("append_table", data=data)  # 在 insert_many 写入 _id 之前记录
+            with timed("append_table", "mongo_insert"):
+                append_table_rows(self.collection, data)
+
+    def patch_cells(self, patch):
+        with write_lock(self.lock, "patch_cells"), versioned_write(self.collection) as write:
+            write.describe("patch_cells", patch=patch)
+            with timed("patch_cells", "mongo_bulk_write"):
+                return apply_patch(self.collection, patch)
 
 def run_async(func, *args):
-    future = executor.submit(func, *args)
+    future = executor.submit(copy_context().run, admission.guard_queue_time(func), *args)  # 线程池中的步骤记入当前请求的 trace
     return future.result()
 
 def get_db_handler(uri, db_name, collection_name):
     key = (uri, db_name, collection_name)
-    with lock.gen_wlock():
-        if key not in db_handlers:
-            db_handlers[key] = MongoDBHandler(uri, db_name, collection_name)
-        return db_handlers[key]
+    db_handler = db_handlers.get(key)
+    if db_handler is None:
+        with db_handlers_lock:
+            db_handler = db_handlers.get(key)
+            if db_handler is None:
+                db_handler = MongoDBHandler(uri, db_name, collection_name)
+                db_handlers[key] = db_handler
+    return db_handler
 
 @app.route('/save_table', methods=['POST'])
 def save_table_route():
@@ -103,7 +125,9 @@ def get_table_route():
     collection_name = request.json.get('collection_name')
     db_handler = get_db_handler(uri, db_name, collection_name)
     result = run_async(db_handler.get_table)
-    return jsonify({"status": "success", "data": result}), 200
+    with timed("get_table", "serialize"):
+        response = jsonify({"status": "success", "data": result})
+    return response, 200
 
 @app.route('/save_merged_cells', methods=['POST'])
 def save_merged_cells_route():
@@ -131,8 +155,32 @@ def append_table_route():
     db_name = request.json.get('db_name')
     collection_name = request.json.get('collection_name')
     db_handler = get_db_handler(uri, db_name, collection_name)
-    run_async(db_handler.append_table, data)
+    try:
+        run_async(db_handler.append_table, data)
+    except PartialAppendError as e:
+        # 本次请求的前 inserted 行已写入, 重试时只提交剩余的行
+        return jsonify({"status": "error", "message": str(e), "inserted": e.inserted}), 500
     return jsonify({"status": "success"}), 200
 
+@app.route('/patch_cells', methods=['POST'])
+def patch_cells_route():
+    patch = request.json.get('patch')
+    uri = request.json.get('uri')
+    db_name = request.json.get('db_name')
+    collection_name = request.json.get('collection_name')
+    db_handler = get_db_handler(uri, db_name, collection_name)
+    modified = run_async(db_handler.patch_cells, patch)
+    return jsonify({"status": "success", "modified": modified}), 200
+
+@app.route('/batch', methods=['POST'])
+def batch_route():
+    # 一次请求按顺序执行多个操作, 每张表只加一次锁
+    try:
+        results = run_async(run_batch, request.json, get_db_handler)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    status = "success" if all(result["status"] == "success" for result in results) else "error"
+    return jsonify({"status": status, "results": results}), 200
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
@@ -1,45 +1,75 @@
 from flask import Flask, request, jsonify
-from pymongo import MongoClient
 import json
 from concurrent.futures import ThreadPoolExecutor
 import threading
+from server.lock_registry import LockRegistry
+from server.compression import install_compression
+from server.lock_profiler import install_lock_report
+from server.admission import AdmissionController, install_admission_control
+from server.mongo_pool import get_client
+from server.rows import ROW_PROJECTION, drop_stale_staging, ensure_indexes
+from server.tiled import append_table_rows, build_table_documents, find_table_rows
+from server.changes import ensure_change_indexes, versioned_write
 
 app = Flask(__name__)
+install_compression(app)  # 解压请求体, 按 Accept-Encoding 压缩响应
+install_lock_report(app)  # 锁等待/持有统计, 见 /debug/locks
 executor = ThreadPoolExecutor(max_workers=4)  # 你可以根据需求调整线程池大小
-lock = threading.Lock()
+admission = AdmissionController(executor)
+install_admission_control(app, admission)  # 过载时快速返回 429/503 和 Retry-After
 
 # 全局变量来存储 MongoDBHandler 实例
 db_handlers = {}
+db_handlers_lock = threading.Lock()
+# 每张表一把锁, 锁策略见 config.LOCK_STRATEGY
+lock_registry = LockRegistry()
 
 class MongoDBHandler:
     def __init__(self, uri, db_name, collection_name):
-        self.client = MongoClient(uri)
+        self.client = get_client(uri)  # 同一 uri 的所有表共用一个连接池
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.lock = lock_registry.get_lock(uri, db_name, collection_name)
+        ensure_indexes(self.collection)
+        ensure_change_indexes(self.collection)
+        drop_stale_staging(self.collection)
 
+    # 与 server3 / batch.py 使用相同的存储格式 (行号、分块存储) 并记录版本号和变更日志, server3 的 /changes 能看到这里的写入.
+    # 但 server3 的响应缓存只在 SERVER_WORKERS > 1 时按数据库中的版本号区分 (见 server3.cache_generation),
+    # 单进程的 server3 不会因这里的写入使缓存失效, 与本服务器共用表时 server3 需按多 worker 配置 SERVER_WORKERS
     def save_table(self, data):
-        with lock:
+        with self.lock.gen_wlock(), versioned_write(self.collection):
             self.collection.delete_many({})
-            self.collection.insert_many(data)
+            if data:
+                self.collection.insert_many(build_table_documents(self.collection.name, data))
 
     def get_table(self):
-        with lock:
-            return list(self.collection.find({}, {"_id": 0}))
+        # 按行号排序, 合并单元格文档放在最后
+        with self.lock.gen_rlock():
+            return (list(find_table_rows(self.collection, {"_id": 0, **ROW_PROJECTION}))
+                    + list(self.collection.find({"type": "merged_cells"}, {"_id": 0})))
 
     def append_table(self, data):
-        with lock:
-            self.collection.insert_many(data)
+        if not data:
+            return
+        with self.lock.gen_wlock(), versioned_write(self.collection) as write:
+            write.describe("append_table", data=data)  # 在 insert_many 写入 _id 之前记录
+            append_table_rows(self.collection, data)
 
 def run_async(func, *args):
-    future = executor.submit(func, *args)
+    future = executor.submit(admission.guard_queue_time(func), *args)
     return future.result()
 
 def get_db_handler(uri, db_name, collection_name):
     key = (uri, db_name, collection_name)
-    with lock:
-        if key not in db_handlers:
-            db_handlers[key] = MongoDBHandler(uri, db_name, collection_name)
-        return db_handlers[key]
+    db_handler = db_handlers.get(key)
+    if db_handler is None:
+        with db_handlers_lock:
+            db_handler = db_handlers.get(key)
+            if db_handler is None:
+                db_handler = MongoDBHandler(uri, db_name, collection_name)
+                db_handlers[key] = db_handler
+    return db_handler
 
 @app.route('/save_table', methods=['POST'])
 def save_table():
@@ -1,111 +1,412 @@
-from flask import Flask, request, jsonify
-from pymongo import MongoClient as PymongoClient
-import time
+from flask import Flask, request, jsonify, Response, stream_with_context
 from concurrent.futures import ThreadPoolExecutor
-from readerwriterlock import rwlock
+import itertools
+import tempfile
+import threading
+from urllib.parse import quote
+from server import config
+from server.lock_registry import LockRegistry
+from server.compression import install_compression
+from server.mongo_pool import get_client
+from server.patch import apply_patch
+from server.batch import run_batch
+from server.rows import (RESPONSE_PROJECTION, ROW_FIELD, ROW_PROJECTION, UNNUMBERED_FILTER, PartialAppendError, column_projection,
+                         drop_stale_staging, ensure_indexes, ensure_row_numbers, find_row_range, find_rows, project_row,
+                         staging_collection, swap_in)
+from server.serializer import dumps, install_serializer
+from server.tiled import (append_table_rows, batch_rows, build_batch_documents, build_table_documents, find_table_rows,
+                          get_layout, iter_rows)
+from server.workbooks import get_workbook, save_workbook
+from server.spreadsheet import batched, detect_format, iter_csv_export, iter_import_rows, write_xlsx
+from server.response_cache import ResponseCache
+from server.group_commit import GroupCommit
+from server.metrics import install_metrics, read_lock, timed, write_lock
+from server.tracing import copy_context, install_tracing
+from server.lock_profiler import install_lock_report
+from server.admission import AdmissionController, Overloaded, install_admission_control
+from server.compact import COMPACT_MIMETYPE, encode_table, decode_table
+from server.versions import VersionConflict, check_version, get_version, read_versioned
+from server.changes import ensure_change_indexes, versioned_write, wait_for_changes
 
 app = Flask(__name__)
+install_compression(app)  # 解压请求体, 按 Accept-Encoding 压缩响应
+install_serializer(app)  # jsonify / request.json 使用 server.serializer (有 orjson 时用 orjson)
 executor = ThreadPoolExecutor(max_workers=40)  # 根据需求调整线程池大小
+install_metrics(app, executor)  # 请求/步骤延迟直方图, 见 /metrics
+install_tracing(app, "server3")  # 带 X-Trace-Id 的请求记录 span, 见 config.TRACE_FILE
+install_lock_report(app)  # 锁等待/持有统计, 见 /debug/locks
+admission = AdmissionController(executor)
+install_admission_control(app, admission)  # 过载时快速返回 429/503 和 Retry-After
+
+# /capabilities 返回的扩展功能 (基础的整表读写、追加和 patch_cells 所有服务器都支持), client3 据此判断能否调用
+FEATURES = ("batch", "rows", "columns", "changes", "import", "export", "workbooks", "ndjson", "compact",
+            "versions", "tiled", "metrics")
 
 # 全局变量来存储 MongoDBHandler 实例
 db_handlers = {}
-lock = rwlock.RWLockFairD()
+db_handlers_lock = threading.Lock()
+# 每张表一把锁, 锁策略见 config.LOCK_STRATEGY
+lock_registry = LockRegistry()
+# 已编码的 get_all / get_table 响应, 写操作时失效
+response_cache = ResponseCache(enabled=config.RESPONSE_CACHE_ENABLED, max_bytes=config.RESPONSE_CACHE_BYTES)
+# 合并同一张表的小批量追加写入
+append_commit = GroupCommit(config.APPEND_GROUP_COMMIT_MS, config.APPEND_GROUP_COMMIT_MAX_ROWS)
+
+class TableChanged(Exception):
+    # 流式读取过程中表被修改, 已发送的部分与之后的页不属于同一版本
+    pass
 
 class MongoDBHandler:
     def __init__(self, uri, db_name, collection_name):
-        self.client = PymongoClient(uri)
+        self.client = get_client(uri)  # 同一 uri 的所有表共用一个连接池
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.key = (uri, db_name, collection_name)
+        self.lock = lock_registry.get_lock(uri, db_name, collection_name)
+        ensure_indexes(self.collection)
+        ensure_change_indexes(self.collection)
+        drop_stale_staging(self.collection)
 
-    def save_table(self, data):
-        start_time = time.time()
-        with lock.gen_wlock():
-            step_start_time = time.time()
-            self.collection.delete_many({})
-            step_end_time = time.time()
-            print(f"Delete many took {step_end_time - step_start_time:.4f} seconds")
-
-            step_start_time = time.time()
-            self.collection.insert_many(data)
-            step_end_time = time.time()
-            print(f"Insert many took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"save_table execution time: {end_time - start_time:.4f} seconds")
-
-    def save_merged_cells(self, merged_cells):
-        start_time = time.time()
-        with lock.gen_wlock():
-            step_start_time = time.time()
-            self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
-            step_end_time = time.time()
-            print(f"Update one took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"save_merged_cells execution time: {end_time - start_time:.4f} seconds")
-
-    def save_all(self, data, merged_cells):
-        start_time = time.time()
-        with lock.gen_wlock():
-            # Save table data
-            step_start_time = time.time()
-            self.collection.delete_many({})
-            step_end_time = time.time()
-            print(f"Delete many took {step_end_time - step_start_time:.4f} seconds")
+    def swap_snapshot(self, data, merged_cells=None, operation="save_table", expected_version=None):
+        # 先写入临时集合, 期间不持有锁, 读请求不受影响;
+        # 写完后在写锁内用 renameCollection(dropTarget=True) 原子替换正式集合.
+        # 中途失败只会留下临时集合, 正式集合保持原样.
+        # 版本号在替换集合时才真正递增, 冲突时临时集合被丢弃, 正式集合保持原样.
+        # 按 config.STORAGE_LAYOUT / TILED_COLLECTIONS 选择每行一个文档或分块存储
+        check_version(self.collection, expected_version)
+        documents = build_table_documents(self.collection.name, data)
+        if merged_cells is not None:
+            documents.append({"type": "merged_cells", "merged_cells": merged_cells})
+        if not documents:
+            with write_lock(self.lock, operation), versioned_write(self.collection, expected_version) as write:
+                with timed(operation, "mongo_delete"):
+                    self.collection.delete_many({})
+                response_cache.invalidate(self.key)
+            return write.version
+
+        staging = staging_collection(self.collection)
+        try:
+            ensure_indexes(staging)  # 重命名后替换正式集合, 索引需要提前建好
+            with timed(operation, "mongo_insert_staging"):
+                staging.insert_many(documents)
+            with write_lock(self.lock, operation), versioned_write(self.collection, expected_version) as write:
+                with timed(operation, "mongo_rename"):
+                    swap_in(staging, self.collection)
+                response_cache.invalidate(self.key)
+        except Exception:
+            staging.drop()
+            raise
+        return write.version
 
-            step_start_time = time.time()
-            self.collection.insert_many(data)
-            step_end_time = time.time()
-            print(f"Insert many took {step_end_time - step_start_time:.4f} seconds")
+    def import_rows(self, rows, expected_version=None):
+        # 导入文件替换整张表: 与 swap_snapshot 相同先写临时集合, 但 rows 为迭代器, 按批写入, 内存中只保留一批.
+        # 返回 (导入的行数, 写入后的版本号)
+        check_version(self.collection, expected_version)
+        staging = staging_collection(self.collection)
+        count = 0
+        try:
+            ensure_indexes(staging)
+            for batch in batched(rows, batch_rows(self.collection.name, config.IMPORT_BATCH_ROWS)):
+                with timed("import", "mongo_insert_staging"):
+                    staging.insert_many(build_batch_documents(self.collection.name, batch, count))
+                count += len(batch)
+            with write_lock(self.lock, "import"), versioned_write(self.collection, expected_version) as write:
+                with timed("import", "mongo_rename"):
+                    swap_in(staging, self.collection)
+                response_cache.invalidate(self.key)
+        except Exception:
+            staging.drop()
+            raise
+        return count, write.version
+
+    def save_table(self, data, expected_version=None):
+        # 写操作都返回写入后的版本号, expected_version 与当前版本不一致时抛出 VersionConflict
+        if config.SAVE_MODE == "swap":
+            return self.swap_snapshot(data, expected_version=expected_version)
+        # 整表替换在变更日志中记为 reset, 客户端刷新时重新加载整表
+        with write_lock(self.lock, "save_table"), versioned_write(self.collection, expected_version) as write:
+            with timed("save_table", "mongo_delete"):
+                self.collection.delete_many({})
+            with timed("save_table", "mongo_insert"):
+                if data:
+                    self.collection.insert_many(build_table_documents(self.collection.name, data))
+            response_cache.invalidate(self.key)
+        return write.version
+
+    def save_merged_cells(self, merged_cells, expected_version=None):
+        with write_lock(self.lock, "save_merged_cells"), versioned_write(self.collection, expected_version) as write:
+            write.describe("save_merged_cells", merged_cells=merged_cells)
+            with timed("save_merged_cells", "mongo_update"):
+                self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
+            response_cache.invalidate(self.key)
+        return write.version
+
+    def save_all(self, data, merged_cells, expected_version=None):
+        if config.SAVE_MODE == "swap":
+            return self.swap_snapshot(data, merged_cells, "save_all", expected_version)
+        with write_lock(self.lock, "save_all"), versioned_write(self.collection, expected_version) as write:
+            # Save table data
+            with timed("save_all", "mongo_delete"):
+                self.collection.delete_many({})
+            with timed("save_all", "mongo_insert"):
+                if data:
+                    self.collection.insert_many(build_table_documents(self.collection.name, data))
 
             # Save merged cells
-            step_start_time = time.time()
-            self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
-            step_end_time = time.time()
-            print(f"Update one took {step_end_time - step_start_time:.4f} seconds")
-        end_time = time.time()
-        print(f"save_all execution time: {end_time - start_time:.4f} seconds")
+            with timed("save_all", "mongo_update"):
+                self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
+            response_cache.invalidate(self.key)
+        return write.version
+
+    def versioned(self, func, *args):
+        # 返回 (版本号, 数据); 版本号只在写入提交后才变化, 读取与其他进程的写入重叠时重读, 见 versions.read_versioned
+        return read_versioned(self.collection, func, *args)
+
+    def get_table(self):
+        # 按行号排序, 合并单元格文档放在最后
+        with read_lock(self.lock, "get_table"):
+            with timed("get_table", "mongo_find"):
+                return (list(find_table_rows(self.collection, {"_id": 0, **ROW_PROJECTION}))
+                        + list(self.collection.find({"type": "merged_cells"}, {"_id": 0})))
+
+    def get_rows(self, start, end):
+        # 读取 [start, end) 范围内的行, 返回的每行带有 row 字段
+        with read_lock(self.lock, "get_rows"):
+            with timed("get_rows", "mongo_find"):
+                layout = get_layout(self.collection)
+                if layout is not None:
+                    # 分块存储只解压范围内涉及的块
+                    return list(iter_rows(self.collection, layout, start, end, with_row=True))
+                return list(find_row_range(self.collection, start, end, {"_id": 0}))
+
+    def get_columns(self, columns, fields="text", start=0, end=None):
+        # 只读取指定列, 每行带有 row 字段; 行存储在数据库中投影, 其余列不会离开数据库
+        with read_lock(self.lock, "get_columns"):
+            with timed("get_columns", "mongo_find"):
+                layout = get_layout(self.collection)
+                if layout is not None:
+                    # 分块存储的整块压缩保存, 只能解压后投影
+                    return [project_row(row, columns, fields)
+                            for row in iter_rows(self.collection, layout, start, end, with_row=True)]
+                projection = column_projection(columns, fields)
+                if start or end is not None:
+                    return list(find_row_range(self.collection, start, end, projection))
+                return list(find_rows(self.collection, projection))
+
+    def get_merged_cells(self):
+        with read_lock(self.lock, "get_merged_cells"):
+            with timed("get_merged_cells", "mongo_find"):
+                result = self.collection.find_one({"type": "merged_cells"})
+            return result["merged_cells"] if result else []
+
+    def stream_header(self, operation):
+        # 流式读取开始时的 (版本号, 合并单元格文档). 旧数据的行没有行号, 不能按行号分页,
+        # 先按当前的显示顺序编号 (与第一次追加/修改时相同, 表格内容不变)
+        if get_layout(self.collection) is None and self.collection.find_one(UNNUMBERED_FILTER, {"_id": 1}) is not None:
+            with write_lock(self.lock, operation):
+                ensure_row_numbers(self.collection)
+        with read_lock(self.lock, operation):
+            return read_versioned(self.collection, self.collection.find_one, {"type": "merged_cells"}, {"_id": 0})
+
+    def read_page(self, start, projection):
+        # 读取行号从 start 开始的一页 (最多 STREAM_BATCH_SIZE 行), 返回 (行, 下一页的起始行号); 调用方持有读锁
+        layout = get_layout(self.collection)
+        if layout is not None:
+            end = start + config.STREAM_BATCH_SIZE
+            return list(iter_rows(self.collection, layout, start, end)), end
+        projection = {key: value for key, value in projection.items() if key != ROW_FIELD} or None
+        rows = list(find_row_range(self.collection, start, None, projection).limit(config.STREAM_BATCH_SIZE))
+        end = rows[-1][ROW_FIELD] + 1 if rows else start
+        for row in rows:
+            del row[ROW_FIELD]
+        return rows, end
+
+    def iter_pages(self, operation, version, projection):
+        # 按行号一次读一页, 每页单独加读锁, 向客户端发送期间不占锁, 也不需要先把整表读完.
+        # 每页都读取已提交的版本号, 与 header 的 version 不同说明发送过程中表被修改, 抛出 TableChanged
+        start = 0
+        while True:
+            with read_lock(self.lock, operation):
+                with timed(operation, "mongo_find"):
+                    page_version, (rows, start) = read_versioned(self.collection, self.read_page, start, projection)
+            if page_version != version:
+                raise TableChanged(f"Table changed from version {version} to {page_version} while streaming, read it again")
+            yield from rows
+            if len(rows) < config.STREAM_BATCH_SIZE:
+                return
+
+    def iter_table(self):
+        # get_table 的流式版本, 合并单元格文档放在最后
+        version, merged_cells_data = self.stream_header("iter_table")
+        yield dumps({"type": "header", "version": version}) + b"\n"
+        rows = self.iter_pages("iter_table", version, {"_id": 0, **ROW_PROJECTION})
+        yield from iter_ndjson_rows(itertools.chain(rows, [merged_cells_data] if merged_cells_data else []))
+
+    def iter_all(self):
+        # get_all 的流式版本: 第一行为包含合并单元格的 header, 之后每行一条表格数据
+        version, merged_cells_data = self.stream_header("iter_all")
+        merged_cells = merged_cells_data.get("merged_cells", []) if merged_cells_data else []
+        yield dumps({"type": "header", "merged_cells": merged_cells, "version": version}) + b"\n"
+        yield from iter_ndjson_rows(self.iter_pages("iter_all", version, RESPONSE_PROJECTION))
+
+    def iter_csv(self):
+        # 分页导出 CSV; 导出过程中表被修改时中断响应, 客户端收到的文件不完整
+        version, _ = self.stream_header("export")
+        yield from iter_csv_export(self.iter_pages("export", version, {"_id": 0, **ROW_PROJECTION}),
+                                   batch_size=config.STREAM_BATCH_SIZE)
+
+    def export_xlsx(self, title=None):
+        # 在读锁内从游标写出 xlsx 到临时文件 (较小时留在内存), 返回定位到开头的文件对象, 由调用方关闭
+        out = tempfile.SpooledTemporaryFile(max_size=config.EXPORT_SPOOL_BYTES)
+        try:
+            with read_lock(self.lock, "export"):
+                merged_cells_data = self.collection.find_one({"type": "merged_cells"})
+                merged_cells = merged_cells_data.get("merged_cells", []) if merged_cells_data else []
+                with timed("export", "write_xlsx"):
+                    cursor = find_table_rows(self.collection, {"_id": 0, **ROW_PROJECTION}, batch_size=config.STREAM_BATCH_SIZE)
+                    write_xlsx(cursor, merged_cells, out, title or self.collection.name)
+        except Exception:
+            out.close()
+            raise
+        out.seek(0)
+        return out
 
     def get_all(self):
-        start_time = time.time()
-        with lock.gen_rlock():
-            table_data = list(self.collection.find({"type": {"$ne": "merged_cells"}}))
-            # Convert ObjectId to string
-            for row in table_data:
-                row['_id'] = str(row['_id'])
-            merged_cells_data = self.collection.find_one({"type": "merged_cells"})
-            merged_cells = merged_cells_data.get("merged_cells", []) if merged_cells_data else []
-        end_time = time.time()
-        print(f"get_all execution time: {end_time - start_time:.4f} seconds")
+        with read_lock(self.lock, "get_all"):
+            with timed("get_all", "mongo_find"):
+                # 默认不取 _id; RESPONSE_ROW_IDS=1 时由 server.serializer 在编码时把 ObjectId 转成字符串
+                table_data = list(find_table_rows(self.collection, RESPONSE_PROJECTION))
+                merged_cells_data = self.collection.find_one({"type": "merged_cells"})
+        merged_cells = merged_cells_data.get("merged_cells", []) if merged_cells_data else []
         return {"table_data": table_data, "merged_cells": merged_cells}
 
-    def append_table(self, data):
-        start_time = time.time()
-        with lock.gen_wlock():
-            self.collection.insert_many(data)
-        end_time = time.time()
-        print(f"append_table execution time: {end_time - start_time:.4f} seconds")
+    def append_table(self, data, expected_version=None):
+        if expected_version is not None:
+            # 带版本号的追加需要单独判断冲突, 不参与合并写入
+            return self.flush_appends(data, expected_version)
+        if data:
+            with timed("append_table", "group_commit"):
+                return append_commit.submit(self.key, data, self.flush_appends)
+        return get_version(self.collection)
+
+    def flush_appends(self, data, expected_version=None):
+        # 由 GroupCommit 调用, 一批合并后的行只加一次写锁, 版本号也只加一
+        with write_lock(self.lock, "append_table"), versioned_write(self.collection, expected_version) as write:
+            write.describe("append_table", data=data)  # 在 insert_many 写入 _id 之前记录
+            with timed("append_table", "mongo_insert"):
+                append_table_rows(self.collection, data)
+            response_cache.invalidate(self.key)
+        return write.version
+
+    def patch_cells(self, patch, expected_version=None):
+        with write_lock(self.lock, "patch_cells"), versioned_write(self.collection, expected_version) as write:
+            write.describe("patch_cells", patch=patch)
+            with timed("patch_cells", "mongo_bulk_write"):
+                modified = apply_patch(self.collection, patch)
+            response_cache.invalidate(self.key)
+        return modified, write.version
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
 def run_async(func, *args):
-    future = executor.submit(func, *args)
+    future = executor.submit(copy_context().run, admission.guard_queue_time(func), *args)  # 线程池中的步骤记入当前请求的 trace
     return future.result()
 
+def iter_ndjson_rows(cursor):
+    # 按批拼接 NDJSON 行, 最后一行为 {"type": "end", "rows": 行数}, 客户端据此判断是否完整;
+    # 读取过程中表被修改时以 {"type": "error"} 行结束, 没有 end 行
+    lines = []
+    count = 0
+    try:
+        for row in cursor:
+            lines.append(dumps(row))
+            count += 1
+            if len(lines) >= config.STREAM_BATCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+    except TableChanged as e:
+        yield dumps({"type": "error", "message": str(e)}) + b"\n"
+        return
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+    yield dumps({"type": "end", "rows": count}) + b"\n"
+
+def wants_ndjson():
+    return NDJSON_MIMETYPE in request.headers.get("Accept", "")
+
+def encode_success(data, operation="get_all", version=None):
+    with timed(operation, "serialize"):
+        return dumps({"status": "success", "data": data, "version": version})
+
+def encode_versioned(versioned_result, operation):
+    version, data = versioned_result
+    return encode_success(data, operation, version)
+
+def encode_compact_all(versioned_result):
+    version, result = versioned_result
+    with timed("get_all_compact", "encode_compact"):
+        compact = encode_table(result["table_data"])
+    return encode_success({"table_data": compact, "merged_cells": result["merged_cells"]}, "get_all_compact", version)
+
+def request_expected_version():
+    # 写请求可带 expected_version, 与当前版本不一致时返回 409
+    expected_version = request.json.get('expected_version')
+    return None if expected_version is None else int(expected_version)
+
+def conflict_response(e):
+    return jsonify({"status": "error", "message": str(e), "current_version": e.current}), 409
+
+def wants_compact():
+    return COMPACT_MIMETYPE in request.headers.get("Accept", "")
+
+def request_table_data():
+    # 请求体为紧凑格式时先还原成单元格字典, 数据库中的格式保持不变
+    data = request.json.get('data')
+    if request.mimetype == COMPACT_MIMETYPE:
+        data = decode_table(data)
+    return data
+
+def cache_generation(db_handler):
+    # 多个 worker 进程时, 其他进程的写入不会使本进程的缓存失效, 用数据库中已提交的表版本号区分缓存.
+    # 版本号在加载数据之前读取, 缓存的数据不会比它旧; 其他进程的写入提交后版本号变化, 缓存随之失效
+    return get_version(db_handler.collection) if config.SERVER_WORKERS > 1 else None
+
+def cached_response(body, etag, mimetype="application/json"):
+    # 客户端已持有相同版本时返回 304, 不再重复发送表格数据
+    if request.if_none_match.contains_weak(etag):  # 压缩后的响应使用弱 ETag
+        response = Response(status=304)
+    else:
+        response = Response(body, status=200, mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
 def get_db_handler(uri, db_name, collection_name):
     key = (uri, db_name, collection_name)
-    with lock.gen_wlock():
-        if key not in db_handlers:
-            db_handlers[key] = MongoDBHandler(uri, db_name, collection_name)
-        return db_handlers[key]
+    db_handler = db_handlers.get(key)
+    if db_handler is None:
+        with db_handlers_lock:
+            db_handler = db_handlers.get(key)
+            if db_handler is None:
+                db_handler = MongoDBHandler(uri, db_name, collection_name)
+                db_handlers[key] = db_handler
+    return db_handler
 
 @app.route('/save_all', methods=['POST'])
 def save_all_route():
     try:
-        data = request.json.get('data')
+        data = request_table_data()
         merged_cells = request.json.get('merged_cells')
         uri = request.json.get('uri')
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        run_async(db_handler.save_all, data, merged_cells)
-        return jsonify({"status": "success"}), 200
+        version = run_async(db_handler.save_all, data, merged_cells, request_expected_version())
+        return jsonify({"status": "success", "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -116,8 +417,19 @@ def get_all_route():
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        result = run_async(db_handler.get_all)
-        return jsonify({"status": "success", "data": result}), 200
+        if wants_ndjson():
+            return Response(stream_with_context(db_handler.iter_all()), mimetype=NDJSON_MIMETYPE)
+        if wants_compact():
+            body, etag = response_cache.get_or_load(
+                db_handler.key, "get_all_compact", lambda: encode_compact_all(run_async(db_handler.versioned, db_handler.get_all)),
+                cache_generation(db_handler))
+            return cached_response(body, etag, COMPACT_MIMETYPE)
+        body, etag = response_cache.get_or_load(
+            db_handler.key, "get_all", lambda: encode_versioned(run_async(db_handler.versioned, db_handler.get_all), "get_all"),
+            cache_generation(db_handler))
+        return cached_response(body, etag)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error in get_all_route: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -125,13 +437,17 @@ def get_all_route():
 @app.route('/save_table', methods=['POST'])
 def save_table_route():
     try:
-        data = request.json.get('data')
+        data = request_table_data()
         uri = request.json.get('uri')
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        run_async(db_handler.save_table, data)
-        return jsonify({"status": "success"}), 200
+        version = run_async(db_handler.save_table, data, request_expected_version())
+        return jsonify({"status": "success", "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -142,8 +458,14 @@ def get_table_route():
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        result = run_async(db_handler.get_table)
-        return jsonify({"status": "success", "data": result}), 200
+        if wants_ndjson():
+            return Response(stream_with_context(db_handler.iter_table()), mimetype=NDJSON_MIMETYPE)
+        body, etag = response_cache.get_or_load(
+            db_handler.key, "get_table", lambda: encode_versioned(run_async(db_handler.versioned, db_handler.get_table), "get_table"),
+            cache_generation(db_handler))
+        return cached_response(body, etag)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -155,8 +477,12 @@ def save_merged_cells_route():
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        run_async(db_handler.save_merged_cells, merged_cells)
-        return jsonify({"status": "success"}), 200
+        version = run_async(db_handler.save_merged_cells, merged_cells, request_expected_version())
+        return jsonify({"status": "success", "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -167,8 +493,10 @@ def get_merged_cells_route():
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        result = run_async(db_handler.get_merged_cells)
-        return jsonify({"status": "success", "data": result}), 200
+        version, result = run_async(db_handler.versioned, db_handler.get_merged_cells)
+        return jsonify({"status": "success", "data": result, "version": version}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -180,10 +508,193 @@ def append_table_route():
         db_name = request.json.get('db_name')
         collection_name = request.json.get('collection_name')
         db_handler = get_db_handler(uri, db_name, collection_name)
-        run_async(db_handler.append_table, data)
-        return jsonify({"status": "success"}), 200
+        version = run_async(db_handler.append_table, data, request_expected_version())
+        return jsonify({"status": "success", "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except PartialAppendError as e:
+        # 本次请求的前 inserted 行已写入, 重试时只提交剩余的行
+        return jsonify({"status": "error", "message": str(e), "inserted": e.inserted}), 500
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/patch_cells', methods=['POST'])
+def patch_cells_route():
+    try:
+        patch = request.json.get('patch')
+        uri = request.json.get('uri')
+        db_name = request.json.get('db_name')
+        collection_name = request.json.get('collection_name')
+        db_handler = get_db_handler(uri, db_name, collection_name)
+        modified, version = run_async(db_handler.patch_cells, patch, request_expected_version())
+        return jsonify({"status": "success", "modified": modified, "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/batch', methods=['POST'])
+def batch_route():
+    # 一次请求按顺序执行多个操作, 每张表只加一次锁
+    try:
+        results = run_async(run_batch, request.json, get_db_handler,
+                            lambda db_handler: response_cache.invalidate(db_handler.key))
+        status = "success" if all(result["status"] == "success" for result in results) else "error"
+        return jsonify({"status": status, "results": results}), 200
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/get_rows', methods=['POST'])
+def get_rows_route():
+    # 行号范围可以放在查询参数 (?start=&end=) 或请求体中, 范围为 [start, end)
+    try:
+        uri = request.json.get('uri')
+        db_name = request.json.get('db_name')
+        collection_name = request.json.get('collection_name')
+        start = int(request.args.get('start', request.json.get('start', 0)))
+        end = int(request.args.get('end', request.json.get('end', start + 100)))
+        db_handler = get_db_handler(uri, db_name, collection_name)
+        version, result = run_async(db_handler.versioned, db_handler.get_rows, start, end)
+        return jsonify({"status": "success", "data": result, "version": version}), 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/import', methods=['POST'])
+def import_route():
+    # 上传 CSV / XLSX 文件替换整张表, 边解析边分批写入.
+    # 文件可以是 multipart 表单的 file 字段, 也可以直接作为请求体 (client3.import_file, 不需要整个文件进内存).
+    # 参数放在查询参数或表单中: uri, db_name, collection_name, format (csv / xlsx, 默认按文件名判断),
+    # sheet (XLSX 工作表名, 默认活动工作表), styles=1 (XLSX 同时导入样式), encoding (CSV, 默认 utf-8-sig), expected_version
+    try:
+        params = request.values
+        upload = request.files.get('file')
+        stream, filename = (upload.stream, upload.filename or "") if upload is not None else (request.stream, "")
+        fmt = detect_format(filename, params.get('format'))
+        rows = iter_import_rows(stream, fmt, params.get('sheet'), params.get('styles') == '1',
+                                params.get('encoding', 'utf-8-sig'))
+        expected_version = params.get('expected_version')
+        db_handler = get_db_handler(params.get('uri'), params.get('db_name'), params.get('collection_name'))
+        count, version = run_async(db_handler.import_rows, rows, None if expected_version is None else int(expected_version))
+        return jsonify({"status": "success", "rows": count, "version": version}), 200
+    except VersionConflict as e:
+        return conflict_response(e)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def attachment(filename):
+    # 集合名可能含中文, 同时给出 ASCII 的 filename 和 RFC 5987 编码的 filename*
+    return {"Content-Disposition": f"attachment; filename=\"{filename.encode('ascii', 'replace').decode()}\"; "
+                                   f"filename*=UTF-8''{quote(filename)}"}
+
+def iter_file(f, chunk_size=64 * 1024):
+    with f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+@app.route('/get_workbook', methods=['POST'])
+def get_workbook_route():
+    # 返回工作簿的工作表索引, 不包含任何工作表的数据
+    try:
+        db = get_client(request.json.get('uri'))[request.json.get('db_name')]
+        result = run_async(get_workbook, db, request.json.get('workbook'))
+        return jsonify({"status": "success", "data": result}), 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/save_workbook', methods=['POST'])
+def save_workbook_route():
+    # sheets 为完整的工作表列表 (工作表名或 {"name", "collection"}), 顺序即标签顺序
+    try:
+        db = get_client(request.json.get('uri'))[request.json.get('db_name')]
+        result = run_async(save_workbook, db, request.json.get('workbook'), request.json.get('sheets'))
+        return jsonify({"status": "success", "data": result}), 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/export', methods=['POST'])
+def export_route():
+    # 导出整张表为 xlsx (默认, 保留合并单元格、颜色、字体和对齐方式) 或 csv (只有文本).
+    # format 可以放在查询参数 (?format=csv) 或请求体中; xlsx 的 sheet 为工作表名, 默认为集合名
+    try:
+        uri = request.json.get('uri')
+        db_name = request.json.get('db_name')
+        collection_name = request.json.get('collection_name')
+        fmt = request.args.get('format', request.json.get('format', 'xlsx'))
+        db_handler = get_db_handler(uri, db_name, collection_name)
+        if fmt == "csv":
+            # CSV 边分页读取边发送, 不经过线程池
+            return Response(stream_with_context(db_handler.iter_csv()), mimetype="text/csv",
+                            headers=attachment(f"{collection_name}.csv"))
+        if fmt != "xlsx":
+            raise ValueError(f"Unsupported export format {fmt!r}, expected csv or xlsx")
+        out = run_async(db_handler.export_xlsx, request.json.get('sheet'))
+        return Response(iter_file(out), mimetype=XLSX_MIMETYPE,
+                        headers=attachment(f"{collection_name}.xlsx"))
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/get_columns', methods=['POST'])
+def get_columns_route():
+    # columns 为列号列表; fields 为 text (只取文本, 默认) 或 style (文本和样式); 可选行号范围 [start, end)
+    try:
+        uri = request.json.get('uri')
+        db_name = request.json.get('db_name')
+        collection_name = request.json.get('collection_name')
+        columns = request.json.get('columns')
+        if not isinstance(columns, list) or not columns:
+            raise ValueError("columns must be a non-empty list of column indices")
+        fields = request.json.get('fields', 'text')
+        start = int(request.json.get('start', 0))
+        end = request.json.get('end')
+        db_handler = get_db_handler(uri, db_name, collection_name)
+        version, result = run_async(db_handler.versioned, db_handler.get_columns, columns, fields, start,
+                                    None if end is None else int(end))
+        return jsonify({"status": "success", "data": result, "version": version}), 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/changes', methods=['POST'])
+def changes_route():
+    # 长轮询: 返回 since 版本之后的变更 (?since=&wait=秒), 没有变更时最多等待 wait 秒.
+    # reset 为 true 时变更无法增量描述 (整表替换或日志已被清理), 客户端需要重新加载整表.
+    # 等待期间只占用请求线程, 不占用 executor
+    try:
+        uri = request.json.get('uri')
+        db_name = request.json.get('db_name')
+        collection_name = request.json.get('collection_name')
+        since = int(request.args.get('since', request.json.get('since', 0)))
+        wait = min(float(request.args.get('wait', request.json.get('wait', 0))), config.CHANGES_MAX_WAIT)
+        db_handler = get_db_handler(uri, db_name, collection_name)
+        version, changes, reset = wait_for_changes(db_handler.collection, since, wait)
+        return jsonify({"status": "success", "version": version, "changes": changes, "reset": reset}), 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/capabilities', methods=['GET'])
+def capabilities_route():
+    return jsonify({"status": "success", "server": "server3", "features": list(FEATURES)}), 200
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
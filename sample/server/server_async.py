@@ -0,0 +1,252 @@
+# asyncio 版本的基础表格服务, 每个请求只占用一个协程, Mongo 访问走 motor 异步驱动, 不再经过线程池.
+# 只实现 server3 的基础路由 (save_all / get_all / save_table / get_table / save_merged_cells /
+# get_merged_cells / append_table / patch_cells) 和 /metrics, 请求体同样可以压缩, 行同样按 row 字段编号.
+# 不支持 /batch、/get_rows、/get_columns、/changes、/import、/export、工作簿、NDJSON / 紧凑格式响应、
+# 版本号 (expected_version 会被忽略, 不会返回 409) 和分块存储 (TABLE_STORAGE_LAYOUT=tiled 的表),
+# 不能与 server3 共用同一批表. client3 通过 /capabilities 判断服务器支持哪些功能, 见 FEATURES
+# 开发时: python server_async.py
+# 生产环境: hypercorn server.server_async:app --bind 0.0.0.0:5002
+from quart import Quart, Response, request, jsonify
+import asyncio
+from server import config
+from server.compression import decompress
+from server.lock_registry import LockRegistry
+from server.metrics import PROMETHEUS_MIMETYPE, REGISTRY, timed
+from server.mongo_pool import get_async_client
+from server.patch import build_patch_operations, needs_row_ids, patch_row_numbers
+from server.rows import (RESPONSE_PROJECTION, ROW_FIELD, ROW_FILTER, ROW_PROJECTION, UNNUMBERED_FILTER, drop_stale_staging_async,
+                         ensure_indexes_async, number_rows, renumber_operations, staging_collection)
+from server.serializer import install_serializer, loads
+
+app = Quart(__name__)
+install_serializer(app)  # 与 server3 相同的 JSON 编码器, ObjectId 在编码时转换
+# /capabilities 返回的扩展功能, 基础路由不在其中; server3 的完整列表见 server3.FEATURES
+FEATURES = ("metrics",)
+
+# 全局变量来存储 MongoDBHandler 实例, 只在事件循环线程中访问, 不需要加锁
+db_handlers = {}
+# 每张表一把 asyncio 锁, 锁策略见 config.LOCK_STRATEGY
+lock_registry = LockRegistry(use_asyncio=True)
+
+class MongoDBHandler:
+    def __init__(self, uri, db_name, collection_name):
+        self.client = get_async_client(uri)  # 同一 uri 的所有表共用一个连接池
+        self.db = self.client[db_name]
+        self.collection = self.db[collection_name]
+        self.lock = lock_registry.get_lock(uri, db_name, collection_name)
+        # 与 server3 相同建索引并删除遗留的临时集合; __init__ 中不能 await, 在后台进行, 处理第一个请求前等待完成 (见 ready)
+        self.prepared = asyncio.ensure_future(self.prepare())
+
+    async def prepare(self):
+        await ensure_indexes_async(self.collection)
+        await drop_stale_staging_async(self.collection)
+
+    async def ready(self):
+        # prepare 失败时下一个请求重新进行
+        try:
+            await asyncio.shield(self.prepared)
+        except Exception:
+            self.prepared = asyncio.ensure_future(self.prepare())
+            raise
+
+    async def swap_snapshot(self, data, merged_cells=None):
+        # 与 server3 相同: 先写临时集合, 再在写锁内原子重命名
+        documents = number_rows(list(data or []))
+        if merged_cells is not None:
+            documents.append({"type": "merged_cells", "merged_cells": merged_cells})
+        if not documents:
+            async with self.lock.gen_wlock():
+                await self.collection.delete_many({})
+            return
+
+        staging = staging_collection(self.collection)
+        try:
+            await ensure_indexes_async(staging)  # 重命名后替换正式集合, 索引需要提前建好
+            with timed("swap_snapshot", "mongo_insert_staging"):
+                await staging.insert_many(documents)
+            async with self.lock.gen_wlock():
+                with timed("swap_snapshot", "mongo_rename"):
+                    await staging.rename(self.collection.name, dropTarget=True)
+        except Exception:
+            await staging.drop()
+            raise
+
+    async def save_table(self, data):
+        if config.SAVE_MODE == "swap":
+            return await self.swap_snapshot(data)
+        async with self.lock.gen_wlock():
+            with timed("save_table", "mongo_delete"):
+                await self.collection.delete_many({})
+            if data:
+                with timed("save_table", "mongo_insert"):
+                    await self.collection.insert_many(number_rows(data))
+
+    async def get_table(self):
+        # 与 server3 相同: 按行号排序, 合并单元格文档放在最后
+        async with self.lock.gen_rlock():
+            rows = await self.collection.find(ROW_FILTER, {"_id": 0, **ROW_PROJECTION}).sort(ROW_FIELD, 1).to_list(length=None)
+            return rows + await self.collection.find({"type": "merged_cells"}, {"_id": 0}).to_list(length=None)
+
+    async def save_merged_cells(self, merged_cells):
+        async with self.lock.gen_wlock():
+            await self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
+
+    async def get_merged_cells(self):
+        async with self.lock.gen_rlock():
+            result = await self.collection.find_one({"type": "merged_cells"})
+        return result["merged_cells"] if result else []
+
+    async def save_all(self, data, merged_cells):
+        if config.SAVE_MODE == "swap":
+            return await self.swap_snapshot(data, merged_cells)
+        async with self.lock.gen_wlock():
+            with timed("save_all", "mongo_delete"):
+                await self.collection.delete_many({})
+            if data:
+                with timed("save_all", "mongo_insert"):
+                    await self.collection.insert_many(number_rows(data))
+            with timed("save_all", "mongo_update"):
+                await self.collection.update_one({"type": "merged_cells"}, {"$set": {"merged_cells": merged_cells}}, upsert=True)
+
+    async def get_all(self):
+        async with self.lock.gen_rlock():
+            with timed("get_all", "mongo_find"):
+                table_data = await self.collection.find(ROW_FILTER, RESPONSE_PROJECTION).sort(ROW_FIELD, 1).to_list(length=None)
+                merged_cells_data = await self.collection.find_one({"type": "merged_cells"})
+            merged_cells = merged_cells_data.get("merged_cells", []) if merged_cells_data else []
+        return {"table_data": table_data, "merged_cells": merged_cells}
+
+    async def ensure_row_numbers(self):
+        # 与 rows.ensure_row_numbers 相同: 旧数据没有行号时按显示顺序编号. 调用方持有写锁
+        if await self.collection.find_one(UNNUMBERED_FILTER, {"_id": 1}) is None:
+            return
+        row_ids = [doc["_id"] async for doc in self.collection.find(ROW_FILTER, {"_id": 1}).sort(ROW_FIELD, 1)]
+        for operations in renumber_operations(row_ids):
+            if operations:
+                await self.collection.bulk_write(operations, ordered=False)
+
+    async def append_table(self, data):
+        if not data:
+            return
+        async with self.lock.gen_wlock():
+            # 与 server3 相同: 新行的行号接在已有的最大行号之后
+            await self.ensure_row_numbers()
+            last = await self.collection.find_one(ROW_FILTER, {ROW_FIELD: 1}, sort=[(ROW_FIELD, -1)])
+            start = last[ROW_FIELD] + 1 if last and ROW_FIELD in last else 0
+            await self.collection.insert_many(number_rows(data, start))
+
+    async def patch_cells(self, patch):
+        async with self.lock.gen_wlock():
+            if needs_row_ids(patch):
+                await self.ensure_row_numbers()
+                row_numbers = patch_row_numbers(patch)
+                if min(row_numbers) < 0 or await self.collection.find_one({ROW_FIELD: max(row_numbers)}, {"_id": 1}) is None:
+                    raise ValueError(f"Row {max(row_numbers)} out of range")
+            operations = build_patch_operations(patch)
+            if not operations:
+                return 0
+            result = await self.collection.bulk_write(operations, ordered=True)
+        return result.modified_count + result.upserted_count
+
+def get_db_handler(uri, db_name, collection_name):
+    key = (uri, db_name, collection_name)
+    if key not in db_handlers:
+        db_handlers[key] = MongoDBHandler(uri, db_name, collection_name)
+    return db_handlers[key]
+
+async def request_json():
+    # client*.py 发送的较大请求体带 Content-Encoding (见 compression.encode_request), 与 server3 一样先解压
+    body = await request.get_data()
+    encoding = request.headers.get("Content-Encoding", "").strip().lower()
+    if encoding and encoding != "identity":
+        body = decompress(body, encoding)
+    return loads(body)
+
+async def get_request_handler():
+    body = await request_json()
+    db_handler = get_db_handler(body.get('uri'), body.get('db_name'), body.get('collection_name'))
+    await db_handler.ready()
+    return body, db_handler
+
+@app.route('/save_all', methods=['POST'])
+async def save_all_route():
+    try:
+        body, db_handler = await get_request_handler()
+        await db_handler.save_all(body.get('data'), body.get('merged_cells'))
+        return jsonify({"status": "success"}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/get_all', methods=['POST'])
+async def get_all_route():
+    try:
+        body, db_handler = await get_request_handler()
+        result = await db_handler.get_all()
+        return jsonify({"status": "success", "data": result}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/save_table', methods=['POST'])
+async def save_table_route():
+    try:
+        body, db_handler = await get_request_handler()
+        await db_handler.save_table(body.get('data'))
+        return jsonify({"status": "success"}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/get_table', methods=['POST'])
+async def get_table_route():
+    try:
+        body, db_handler = await get_request_handler()
+        result = await db_handler.get_table()
+        return jsonify({"status": "success", "data": result}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/save_merged_cells', methods=['POST'])
+async def save_merged_cells_route():
+    try:
+        body, db_handler = await get_request_handler()
+        await db_handler.save_merged_cells(body.get('merged_cells'))
+        return jsonify({"status": "success"}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/get_merged_cells', methods=['POST'])
+async def get_merged_cells_route():
+    try:
+        body, db_handler = await get_request_handler()
+        result = await db_handler.get_merged_cells()
+        return jsonify({"status": "success", "data": result}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/append_table', methods=['POST'])
+async def append_table_route():
+    try:
+        body, db_handler = await get_request_handler()
+        await db_handler.append_table(body.get('data'))
+        return jsonify({"status": "success"}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/patch_cells', methods=['POST'])
+async def patch_cells_route():
+    try:
+        body, db_handler = await get_request_handler()
+        modified = await db_handler.patch_cells(body.get('patch'))
+        return jsonify({"status": "success", "modified": modified}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/capabilities', methods=['GET'])
+async def capabilities_route():
+    return jsonify({"status": "success", "server": "server_async", "features": list(FEATURES)}), 200
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_route():
+    return Response(REGISTRY.render(), mimetype=PROMETHEUS_MIMETYPE)
+
+if __name__ == '__main__':
+    app.run(port=5002)
@@ -0,0 +1,195 @@
+import csv
+import io
+import shutil
+import tempfile
+
+try:
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+    from openpyxl.utils import get_column_letter
+    from openpyxl.worksheet.cell_range import CellRange
+except ImportError:  # openpyxl 为可选依赖, 未安装时只支持 CSV
+    load_workbook = None
+
+# CSV / XLSX 与表格单元格字典 ({"text", "foreground", "background", "alignment", "font"}) 之间的转换,
+# 用于 /import 和 /export, 逐行读写, 不把整个文件或整张表载入内存.
+FORMATS = ("csv", "xlsx")
+
+# Qt 对齐标志 (Qt.AlignLeft 等) 与 Excel 对齐方式的对应
+ALIGN_LEFT, ALIGN_RIGHT, ALIGN_HCENTER = 0x1, 0x2, 0x4
+ALIGN_TOP, ALIGN_BOTTOM, ALIGN_VCENTER = 0x20, 0x40, 0x80
+HORIZONTAL_FLAGS = {"left": ALIGN_LEFT, "right": ALIGN_RIGHT, "center": ALIGN_HCENTER}
+VERTICAL_FLAGS = {"top": ALIGN_TOP, "bottom": ALIGN_BOTTOM, "center": ALIGN_VCENTER}
+
+
+def detect_format(filename, fmt=None):
+    fmt = (fmt or filename.rpartition(".")[2] or "").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported import format {fmt!r}, expected one of {FORMATS}")
+    return fmt
+
+
+def cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # Excel 中的整数读出来是 1.0
+    return str(value)
+
+
+def _color(color, default):
+    # openpyxl 的 ARGB 颜色 "FF112233" -> "#112233"; 主题色 / 索引色无法直接换算, 使用默认颜色
+    rgb = getattr(color, "rgb", None)
+    if isinstance(rgb, str) and len(rgb) == 8 and rgb != "00000000":
+        return "#" + rgb[2:].lower()
+    return default
+
+
+def styled_cell(cell):
+    if cell.font is None:  # 只读模式下行内空缺的单元格 (EmptyCell) 没有样式
+        return {"text": cell_text(cell.value)}
+    font = cell.font
+    fill = cell.fill
+    alignment = cell.alignment
+    return {
+        "text": cell_text(cell.value),
+        "foreground": _color(font.color, "#000000"),
+        "background": _color(fill.fgColor, "#ffffff") if fill.fill_type == "solid" else "#ffffff",
+        "alignment": HORIZONTAL_FLAGS.get(alignment.horizontal, ALIGN_LEFT) | VERTICAL_FLAGS.get(alignment.vertical, ALIGN_VCENTER),
+        "font": {"bold": bool(font.b), "size": int(font.sz or 10)},
+    }
+
+
+def iter_csv_rows(stream, encoding="utf-8-sig"):
+    # stream 为二进制流 (上传文件或请求体), 边读边解析
+    for values in csv.reader(io.TextIOWrapper(stream, encoding=encoding, newline="")):
+        yield {str(col): {"text": value} for col, value in enumerate(values)}
+
+
+def iter_xlsx_rows(stream, sheet=None, styles=False):
+    # openpyxl 只读模式逐行读取; 只读模式不提供合并单元格和行高列宽, 这些信息不会导入
+    if load_workbook is None:
+        raise ValueError("XLSX import requires openpyxl")
+    if not stream.seekable():
+        # xlsx 是 zip 文件, 需要可随机访问; 先写入临时文件 (较小时留在内存)
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        if styles:
+            for cells in worksheet.iter_rows():
+                yield {str(col): styled_cell(cell) for col, cell in enumerate(cells)}
+        else:
+            for values in worksheet.iter_rows(values_only=True):
+                yield {str(col): {"text": cell_text(value)} for col, value in enumerate(values)}
+    finally:
+        workbook.close()
+
+
+def iter_import_rows(stream, fmt, sheet=None, styles=False, encoding="utf-8-sig"):
+    if fmt == "csv":
+        return iter_csv_rows(stream, encoding)
+    return iter_xlsx_rows(stream, sheet, styles)
+
+
+def row_cells(row):
+    # 行文档 -> 按列号排列的单元格字典列表, 缺少的列为 None; 旧数据中的字符串单元格转为 {"text": ...}
+    cells = {}
+    for key, cell in row.items():
+        if key.isdigit():
+            cells[int(key)] = cell if isinstance(cell, dict) else {"text": cell_text(cell)}
+    return [cells.get(col) for col in range(max(cells) + 1)] if cells else []
+
+
+def iter_csv_export(rows, encoding="utf-8-sig", batch_size=500):
+    # 逐批把行写成 CSV 并产出字节块, 只导出文本; 默认带 BOM, Excel 打开中文不乱码
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    prefix = "\ufeff" if encoding == "utf-8-sig" else ""
+    encoding = "utf-8" if encoding == "utf-8-sig" else encoding
+    count = 0
+    for row in rows:
+        writer.writerow([cell.get("text", "") if cell else "" for cell in row_cells(row)])
+        count += 1
+        if count % batch_size == 0:
+            yield (prefix + buffer.getvalue()).encode(encoding)
+            prefix = ""
+            buffer.seek(0)
+            buffer.truncate()
+    yield (prefix + buffer.getvalue()).encode(encoding)
+
+
+class XlsxStyles:
+    # 相同样式的单元格共用同一组 Font / PatternFill / Alignment 对象, 不为每个单元格重新创建
+    def __init__(self):
+        self.border = Border(left=Side(style="thin"), right=Side(style="thin"),
+                             top=Side(style="thin"), bottom=Side(style="thin"))
+        self._styles = {}
+
+    def get(self, cell):
+        font = cell.get("font") or {}
+        key = (cell.get("foreground", "#000000"), cell.get("background", "#ffffff"),
+               cell.get("alignment", ALIGN_LEFT | ALIGN_VCENTER), font.get("bold", False), font.get("size", 10))
+        style = self._styles.get(key)
+        if style is None:
+            foreground, background, alignment, bold, size = key
+            style = self._styles[key] = (
+                Font(bold=bold, size=size, color=foreground.lstrip("#")),
+                PatternFill(start_color=background.lstrip("#"), end_color=background.lstrip("#"), fill_type="solid"),
+                Alignment(horizontal="left" if alignment & ALIGN_LEFT else
+                          "right" if alignment & ALIGN_RIGHT else
+                          "center" if alignment & ALIGN_HCENTER else "general",
+                          vertical="top" if alignment & ALIGN_TOP else
+                          "bottom" if alignment & ALIGN_BOTTOM else "center"))
+        return style
+
+
+def write_xlsx(rows, merged_cells, out, title="Sheet"):
+    # openpyxl 只写模式: 每行写入后即落到临时文件, 内存占用与行数无关; 最后把整个 xlsx 写入 out.
+    # 样式、行高列宽与 TableHandler.export_to_excel 的换算方式相同
+    if load_workbook is None:
+        raise ValueError("XLSX export requires openpyxl")
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title[:31])  # Excel 工作表名最长 31 个字符
+    styles = XlsxStyles()
+    for row_idx, row in enumerate(rows, start=1):
+        cells = row_cells(row)
+        if row_idx == 1:
+            # 只写模式下列宽需要在写入第一行之前设置
+            for col_idx, cell in enumerate(cells, start=1):
+                if cell and cell.get("column_width"):
+                    worksheet.column_dimensions[get_column_letter(col_idx)].width = cell["column_width"] / 10
+        heights = [cell["row_height"] for cell in cells if cell and cell.get("row_height")]
+        if heights:
+            worksheet.row_dimensions[row_idx].height = heights[0] / 2
+        values = []
+        for cell in cells:
+            if cell is None:
+                values.append(None)
+                continue
+            value = WriteOnlyCell(worksheet, value=cell.get("text", ""))
+            value.font, value.fill, value.alignment = styles.get(cell)
+            value.border = styles.border
+            values.append(value)
+        worksheet.append(values)
+    for cell in merged_cells or []:
+        row, col = int(cell["row"]) + 1, int(cell["col"]) + 1
+        worksheet.merged_cells.add(CellRange(min_row=row, min_col=col,
+                                             max_row=row + int(cell["row_span"]) - 1,
+                                             max_col=col + int(cell["col_span"]) - 1))
+    workbook.save(out)
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,247 @@
+import json
+import zlib
+from bson import Binary
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from server import config
+from server.compression import zstandard
+from server.rows import (ROW_FIELD, PartialAppendError, ensure_row_numbers, find_rows, insert_rows, is_duplicate,
+                         number_rows)
+
+# 分块存储: 每 block_size 行打包成一个 tile 文档, 行数据序列化为 JSON 后可选压缩.
+# 集合中的 layout 文档记录块大小和编码方式, 没有 layout 文档的集合仍按每行一个文档读取.
+#   {"type": "layout", "layout": "tiled", "block_size": 256, "codec": "zlib"}
+#   {"type": "tile", "block": 块号, "rows": 行数, "codec": "zlib", "payload": 压缩后的行列表, "rev": 改写次数}
+# 改写已有的块时按 rev 比较并交换, 多个进程同时改写同一块时后写入的一方重新读取后重试
+LAYOUT_TYPE = "layout"
+TILE_TYPE = "tile"
+TILE_FIELD = "block"
+TILE_REV = "rev"
+
+
+def wants_tiled(collection_name):
+    # 下一次整表保存时使用的存储方式, 已有数据在重新保存前保持原格式, 便于逐张表迁移
+    if collection_name in config.ROW_COLLECTIONS:
+        return False
+    return config.STORAGE_LAYOUT == "tiled" or collection_name in config.TILED_COLLECTIONS
+
+
+def get_layout(collection):
+    return collection.find_one({"type": LAYOUT_TYPE}, {"_id": 0})
+
+
+def encode_block(rows, codec):
+    # 返回 (实际使用的编码, payload); 未安装 zstandard 时退回 zlib
+    if codec == "none":
+        return "none", rows
+    raw = json.dumps(rows, separators=(",", ":")).encode("utf-8")
+    if codec == "zstd" and zstandard:
+        return "zstd", Binary(zstandard.ZstdCompressor(level=config.COMPRESSION_LEVEL).compress(raw))
+    return "zlib", Binary(zlib.compress(raw, config.COMPRESSION_LEVEL))
+
+
+def decode_block(tile):
+    codec = tile.get("codec", "none")
+    payload = tile["payload"]
+    if codec == "none":
+        return payload
+    if codec == "zlib":
+        return json.loads(zlib.decompress(payload))
+    if codec == "zstd":
+        if not zstandard:
+            raise ValueError("Tile is zstd compressed but zstandard is not installed")
+        return json.loads(zstandard.ZstdDecompressor().decompress(payload))
+    raise ValueError(f"Unsupported tile codec: {codec}")
+
+
+def make_tile(block, rows, codec, rev=0):
+    used_codec, payload = encode_block(rows, codec)
+    return {"type": TILE_TYPE, TILE_FIELD: block, "rows": len(rows), "codec": used_codec, "payload": payload,
+            TILE_REV: rev}
+
+
+def tile_filter(tile):
+    # 只匹配读取之后没有被改写过的块; 早期写入的块没有 rev 字段
+    rev = tile.get(TILE_REV)
+    return {"_id": tile["_id"], TILE_REV: rev if rev is not None else {"$exists": False}}
+
+
+def next_rev(tile):
+    return tile.get(TILE_REV, 0) + 1
+
+
+def build_tiles(data, block_size, codec, first_block=0):
+    return [make_tile(first_block + offset // block_size, data[offset:offset + block_size], codec)
+            for offset in range(0, len(data), block_size)]
+
+
+def build_table_documents(collection_name, data):
+    # 整表保存时写入的文档 (不含合并单元格文档), 按 wants_tiled 选择存储方式
+    return build_batch_documents(collection_name, list(data or []), 0)
+
+
+def build_batch_documents(collection_name, data, start):
+    # 分批写入整表时第 start 行开始的一批行对应的文档, 第一批 (start 为 0) 带 layout 文档
+    if not wants_tiled(collection_name):
+        return number_rows(data, start)
+    block_size = config.TILE_BLOCK_SIZE
+    codec = config.TILE_CODEC
+    tiles = build_tiles(data, block_size, codec, start // block_size)
+    if start:
+        return tiles
+    return [{"type": LAYOUT_TYPE, "layout": "tiled", "block_size": block_size, "codec": codec}] + tiles
+
+
+def batch_rows(collection_name, size):
+    # 分批写入时每批的行数; 分块存储取块大小的整数倍, 除最后一批外每个块都是满的
+    if not wants_tiled(collection_name):
+        return size
+    block_size = config.TILE_BLOCK_SIZE
+    return max(block_size, size // block_size * block_size)
+
+
+def iter_rows(collection, layout, start=0, end=None, with_row=False, **kwargs):
+    # 按行号顺序解压并逐行返回 [start, end) 范围内的行, end 为 None 表示读到末尾
+    block_size = layout["block_size"]
+    query = {"type": TILE_TYPE, TILE_FIELD: {"$gte": start // block_size}}
+    if end is not None:
+        if end <= start:
+            return
+        query[TILE_FIELD]["$lte"] = (end - 1) // block_size
+    for tile in collection.find(query, {"_id": 0}, **kwargs).sort(TILE_FIELD, ASCENDING):
+        first_row = tile[TILE_FIELD] * block_size
+        for offset, row in enumerate(decode_block(tile)):
+            row_number = first_row + offset
+            if row_number < start or (end is not None and row_number >= end):
+                continue
+            if with_row:
+                row[ROW_FIELD] = row_number
+            yield row
+
+
+def find_table_rows(collection, projection=None, **kwargs):
+    # 两种存储方式通用的按行号顺序读取; 分块存储的行没有 _id 和 row 字段, 忽略 projection
+    layout = get_layout(collection)
+    if layout is not None:
+        return iter_rows(collection, layout, **kwargs)
+    return find_rows(collection, projection, **kwargs)
+
+
+def append_table_rows(collection, data):
+    layout = get_layout(collection)
+    if layout is not None:
+        append_rows(collection, layout, data)
+    elif data:
+        # 旧数据先补上行号
+        ensure_row_numbers(collection)
+        insert_rows(collection, data)
+
+
+def append_rows(collection, layout, data):
+    # 先补满最后一个未满的块, 剩余的行写入新块; 与其他进程的写入冲突时, 未写入的行重新读取最后一块后继续.
+    # 与 rows.insert_rows 相同, 失败时抛出 PartialAppendError
+    data = list(data or [])
+    total = len(data)
+    for _ in range(config.WRITE_CONFLICT_RETRIES):
+        if not data:
+            return
+        try:
+            data = _append_rows_once(collection, layout, data)
+        except PartialAppendError as e:
+            raise PartialAppendError(str(e), total - len(data) + e.inserted) from e
+    if data:
+        raise PartialAppendError(f"Append to {collection.name} still conflicting after {config.WRITE_CONFLICT_RETRIES} attempts",
+                                 total - len(data))
+
+
+def _append_rows_once(collection, layout, data):
+    # 返回因冲突没有写入的行; 其他写入错误抛出 PartialAppendError, inserted 为本次已写入的行数
+    block_size = layout["block_size"]
+    codec = layout["codec"]
+    last = collection.find_one({"type": TILE_TYPE}, sort=[(TILE_FIELD, DESCENDING)])
+    next_block = 0
+    filled = 0
+    if last is not None:
+        next_block = last[TILE_FIELD] + 1
+        if last["rows"] < block_size:
+            rows = decode_block(last)
+            filled = min(block_size - len(rows), len(data))
+            result = collection.replace_one(tile_filter(last),
+                                            make_tile(last[TILE_FIELD], rows + data[:filled], codec, next_rev(last)))
+            if result.matched_count == 0:
+                return data  # 最后一块已被其他进程改写
+            data = data[filled:]
+    if not data:
+        return data
+    try:
+        collection.insert_many(build_tiles(data, block_size, codec, next_block), ordered=True)
+    except BulkWriteError as e:
+        # 其他进程已写入同一块号, 从冲突的块开始重试
+        if not is_duplicate(e):
+            inserted = filled + min(e.details["nInserted"] * block_size, len(data))
+            raise PartialAppendError(f"Append to {collection.name} failed: {e}", inserted) from e
+        return data[e.details["nInserted"] * block_size:]
+    return []
+
+
+def apply_tiled_patch(collection, layout, patch):
+    # 与 patch.build_patch_operations 的格式相同; 只解压和重写涉及的块, 修改列宽时需要重写所有块.
+    # 块按 rev 比较并交换, 有块被其他进程同时改写时整个 patch 重新执行 (patch 只设置值, 重复执行结果相同)
+    for _ in range(config.WRITE_CONFLICT_RETRIES):
+        modified = _apply_tiled_patch_once(collection, layout, patch)
+        if modified is not None:
+            break
+    else:
+        raise RuntimeError(f"Patch of {collection.name} still conflicting after {config.WRITE_CONFLICT_RETRIES} attempts")
+    if patch.get("merged_cells") is not None:
+        result = collection.update_one({"type": "merged_cells"},
+                                       {"$set": {"merged_cells": patch["merged_cells"]}}, upsert=True)
+        modified += result.modified_count + (1 if result.upserted_id is not None else 0)
+    return modified
+
+
+def _apply_tiled_patch_once(collection, layout, patch):
+    # 返回修改的块数, 有块冲突时返回 None
+    block_size = layout["block_size"]
+    codec = layout["codec"]
+    cells = patch.get("cells") or []
+    rows = patch.get("rows") or []
+    columns = patch.get("columns") or []
+    column_count = int(patch.get("column_count", 0))
+
+    if columns:
+        query = {"type": TILE_TYPE}
+    else:
+        row_numbers = [int(cell["row"]) for cell in cells] + [int(row["row"]) for row in rows]
+        if any(row < 0 for row in row_numbers):
+            raise ValueError(f"Row {min(row_numbers)} out of range")
+        query = {"type": TILE_TYPE, TILE_FIELD: {"$in": sorted({row // block_size for row in row_numbers})}}
+    tiles = {tile[TILE_FIELD]: (tile, decode_block(tile)) for tile in collection.find(query)} \
+        if columns or cells or rows else {}
+
+    def row_dict(row):
+        row = int(row)
+        tile = tiles.get(row // block_size)
+        if tile is None or row % block_size >= len(tile[1]):
+            raise ValueError(f"Row {row} out of range")
+        return tile[1][row % block_size]
+
+    for cell in cells:
+        row_dict(cell["row"])[str(cell["col"])] = cell["data"]
+    for row in rows:
+        target = row_dict(row["row"])
+        for col in range(column_count):
+            target.setdefault(str(col), {})["row_height"] = row["row_height"]
+    for column in columns:
+        for _, block_rows in tiles.values():
+            for target in block_rows:
+                target.setdefault(str(column["col"]), {})["column_width"] = column["column_width"]
+
+    operations = [UpdateOne(tile_filter(tile), {"$set": make_tile(block, block_rows, codec, next_rev(tile))})
+                  for block, (tile, block_rows) in tiles.items()]
+    if not operations:
+        return 0
+    result = collection.bulk_write(operations, ordered=False)
+    if result.matched_count < len(operations):
+        return None
+    return result.modified_count
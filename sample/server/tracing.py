@@ -0,0 +1,166 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from server import config
+
+# 端到端追踪: 客户端为一次用户操作生成 trace id, 通过请求头传给服务器,
+# 两端把各自记录的 span 以 JSON Lines 追加写入 config.TRACE_FILE (为空时不记录).
+# 用 merge_traces 合并多个文件后得到 Chrome trace 格式, 可在 chrome://tracing 或 Perfetto 中按时间线查看.
+TRACE_HEADER = "X-Trace-Id"
+PARENT_SPAN_HEADER = "X-Parent-Span-Id"
+
+# 当前 span: (trace_id, span_id, 是否为本进程内的 span)
+_current = contextvars.ContextVar("trace_span", default=None)
+_pending = {}
+_pending_lock = threading.Lock()
+_file_lock = threading.Lock()
+_service = {"name": os.path.basename(sys.argv[0]) or "python"}
+
+
+def enabled():
+    return bool(config.TRACE_FILE)
+
+
+def set_service(name):
+    # 时间线上用于区分进程的名称, 例如 "client" / "server1"
+    _service["name"] = name
+
+
+def _new_id(length):
+    return uuid.uuid4().hex[:length]
+
+
+def record_span(name, start, duration, **attrs):
+    # 记录一个已结束的 span, start 为 time.time() 时间戳; 用于锁等待等无法包在 with 块中的步骤
+    parent = _current.get()
+    if parent is None or not enabled():
+        return
+    _add_event(parent[0], _new_id(16), parent[1], name, start, duration, attrs)
+
+
+def _add_event(trace_id, span_id, parent_id, name, start, duration, attrs):
+    event = {
+        "name": name,
+        "cat": _service["name"],
+        "ph": "X",
+        "ts": int(start * 1e6),
+        "dur": int(duration * 1e6),
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": {"trace_id": trace_id, "span_id": span_id, "parent_id": parent_id, "service": _service["name"], **attrs},
+    }
+    with _pending_lock:
+        _pending.setdefault(trace_id, []).append(event)
+
+
+@contextmanager
+def span(name, **attrs):
+    if not enabled():
+        yield
+        return
+    parent = _current.get()
+    trace_id = parent[0] if parent else _new_id(32)
+    span_id = _new_id(16)
+    token = _current.set((trace_id, span_id, True))
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        _current.reset(token)
+        _add_event(trace_id, span_id, parent[1] if parent else None, name, start, duration, attrs)
+        if parent is None or not parent[2]:
+            # 本进程内的根 span 结束, 把整条 trace 写入文件
+            _flush(trace_id)
+
+
+@contextmanager
+def continue_trace(headers):
+    # 服务器端: 以请求头中的 trace id / 父 span id 作为上下文, 没有追踪头时不记录
+    trace_id = headers.get(TRACE_HEADER)
+    if not trace_id or not enabled():
+        yield
+        return
+    token = _current.set((trace_id, headers.get(PARENT_SPAN_HEADER), False))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def trace_headers():
+    # 客户端: 当前 span 的追踪头, 不在 span 内时返回空字典
+    current = _current.get()
+    if current is None:
+        return {}
+    return {TRACE_HEADER: current[0], PARENT_SPAN_HEADER: current[1]}
+
+
+def copy_context():
+    # 提交到线程池的任务需要带上当前 span, 用法: executor.submit(copy_context().run, func, *args)
+    return contextvars.copy_context()
+
+
+def _flush(trace_id):
+    with _pending_lock:
+        events = _pending.pop(trace_id, [])
+    if not events:
+        return
+    metadata = {"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": _service["name"]}}
+    lines = [json.dumps(metadata)] + [json.dumps(event) for event in events]
+    with _file_lock:
+        with open(config.TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def install_tracing(app, service):
+    # Flask: 带追踪头的请求在服务器端记录一个根 span, 视图和线程池中的步骤作为其子 span
+    from flask import g, request
+    set_service(service)
+
+    @app.before_request
+    def start_request_span():
+        if not enabled() or TRACE_HEADER not in request.headers:
+            return
+        stack = ExitStack()
+        stack.enter_context(continue_trace(request.headers))
+        stack.enter_context(span(f"{request.method} {request.path}"))
+        g.trace_stack = stack
+
+    @app.teardown_request
+    def finish_request_span(error=None):
+        stack = g.pop("trace_stack", None)
+        if stack is not None:
+            stack.close()
+
+
+def merge_traces(output_path, input_paths, trace_id=None):
+    # 合并客户端和服务器的追踪文件, 可只保留指定 trace id, 输出 Chrome trace JSON
+    events = []
+    for path in input_paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if trace_id and event.get("ph") == "X" and event["args"].get("trace_id") != trace_id:
+                    continue
+                events.append(event)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+if __name__ == '__main__':
+    # python -m server.tracing 输出文件 输入文件... [--trace trace_id]
+    args = sys.argv[1:]
+    selected = None
+    if "--trace" in args:
+        index = args.index("--trace")
+        selected = args[index + 1]
+        del args[index:index + 2]
+    merge_traces(args[0], args[1:], selected)
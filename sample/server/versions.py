@@ -0,0 +1,100 @@
+import time
+import uuid
+from pymongo.errors import DuplicateKeyError
+from server import config
+
+# 每张表的版本号保存在同库的 __table_versions 集合中 ({"_id": 集合名, "version": n, "pending": 写入标记, "claimed_at": 时间}),
+# 不放在表格集合里, swap_snapshot 重命名集合时版本号不受影响.
+# 写入开始时在版本文档上设置 pending (claim_version), 同一张表同时只有一个写入能设置成功, 多个服务器进程共用同一个集合时
+# 靠它串行化写入并发现并发修改; 写入结束后 (commit_version) 才把 version 加一并清除 pending,
+# 读到的版本号对应的数据一定已经可见. 写入进程中途退出时, pending 超过 WRITE_CLAIM_TIMEOUT 秒后可被下一个写入接管.
+VERSION_COLLECTION = "__table_versions"
+
+
+class VersionConflict(Exception):
+    def __init__(self, expected, current):
+        super().__init__(f"Table version conflict: expected {expected}, current {current}")
+        self.expected = expected
+        self.current = current
+
+
+class Claim:
+    def __init__(self, version, token, stolen):
+        self.version = version  # 写入完成后的版本号
+        self.token = token
+        self.stolen = stolen  # 接管了中途退出的写入, 该写入改了什么无法得知
+
+
+def _versions(collection):
+    return collection.database[VERSION_COLLECTION]
+
+
+def _free_filter():
+    # 没有进行中的写入, 或进行中的写入已超时 (写入进程中途退出)
+    return [{"pending": None}, {"claimed_at": {"$lt": time.time() - config.WRITE_CLAIM_TIMEOUT}}]
+
+
+def _state(collection):
+    # (已提交的版本号, 是否有进行中的写入)
+    doc = _versions(collection).find_one({"_id": collection.name})
+    if doc is None:
+        return 0, False
+    pending = doc.get("pending") is not None and doc.get("claimed_at", 0) >= time.time() - config.WRITE_CLAIM_TIMEOUT
+    return doc["version"], pending
+
+
+def get_version(collection):
+    # 已提交的版本号; 从未写入过的表版本号为 0
+    return _state(collection)[0]
+
+
+def read_versioned(collection, func, *args):
+    # 返回 (版本号, func(*args)). 读取前后版本号相同且都没有进行中的写入时, 数据恰好是该版本的数据;
+    # 其他进程的写入与读取重叠时重新读取, 重试 WRITE_CONFLICT_RETRIES 次后返回读取前的版本号,
+    # 此时数据不会比版本号旧, 以此作为 expected_version 最多产生一次多余的冲突
+    for _ in range(config.WRITE_CONFLICT_RETRIES):
+        before = _state(collection)
+        result = func(*args)
+        if not before[1] and _state(collection) == before:
+            return before[0], result
+    return before[0], result
+
+
+def check_version(collection, expected):
+    # 写入前的快速检查, 避免做完整张表的准备工作后才发现冲突; 真正的判断在 claim_version
+    if expected is None:
+        return
+    current = get_version(collection)
+    if current != int(expected):
+        raise VersionConflict(int(expected), current)
+
+
+def claim_version(collection, expected=None):
+    # 为一次写入领取下一个版本号, 返回 Claim; expected 不为 None 时已提交的版本必须等于 expected, 否则抛出 VersionConflict.
+    # 其他写入正在进行时等待其提交. 调用方写完后必须调用 commit_version (写入失败时也要调用)
+    versions = _versions(collection)
+    token = uuid.uuid4().hex
+    while True:
+        query = {"_id": collection.name, "$or": _free_filter()}
+        if expected is not None:
+            query["version"] = int(expected)
+        doc = versions.find_one_and_update(query, {"$set": {"pending": token, "claimed_at": time.time()}})
+        if doc is not None:
+            return Claim(doc["version"] + 1, token, doc.get("pending") is not None)
+        current = versions.find_one({"_id": collection.name})
+        if current is None:
+            try:
+                # 第一次写入的表还没有版本文档
+                versions.insert_one({"_id": collection.name, "version": 0, "pending": None})
+            except DuplicateKeyError:
+                pass
+            continue
+        if expected is not None and current["version"] != int(expected):
+            raise VersionConflict(int(expected), current["version"])
+        time.sleep(config.WRITE_CLAIM_POLL_INTERVAL)
+
+
+def commit_version(collection, claim):
+    # 提交版本号并释放 pending; 写入超时已被其他写入接管时什么也不做, 接管方会把变更记为 reset
+    _versions(collection).update_one({"_id": collection.name, "pending": claim.token},
+                                     {"$set": {"version": claim.version, "pending": None}})
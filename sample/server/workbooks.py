@@ -0,0 +1,44 @@
+# 工作簿: 把同一个库中的多张表 (每张表一个集合) 组织在一个名字下.
+# 工作表索引保存在同库的 __workbooks 集合中:
+#   {"_id": 工作簿名, "sheets": [{"name": 工作表名, "collection": 集合名}, ...]}
+# 工作表的数据仍通过原有接口按集合读写, 客户端打开某个工作表时才加载它的数据.
+WORKBOOK_COLLECTION = "__workbooks"
+
+
+def _workbooks(db):
+    return db[WORKBOOK_COLLECTION]
+
+
+def sheet_collection_name(workbook, sheet):
+    return f"{workbook}__{sheet}"
+
+
+def get_workbook(db, name):
+    # 不存在的工作簿返回没有工作表的索引
+    doc = _workbooks(db).find_one({"_id": name})
+    return {"name": name, "sheets": doc["sheets"] if doc else []}
+
+
+def normalize_sheets(workbook, sheets):
+    # sheets 可以是工作表名或 {"name", "collection"}; 未指定集合时按工作簿名和工作表名生成.
+    # 重命名工作表时带上原来的 collection, 数据不需要迁移
+    normalized = []
+    names = set()
+    for sheet in sheets or []:
+        if isinstance(sheet, str):
+            sheet = {"name": sheet}
+        name = str(sheet.get("name") or "").strip()
+        if not name:
+            raise ValueError("Sheet name must not be empty")
+        if name in names:
+            raise ValueError(f"Duplicate sheet name: {name}")
+        names.add(name)
+        normalized.append({"name": name, "collection": sheet.get("collection") or sheet_collection_name(workbook, name)})
+    return normalized
+
+
+def save_workbook(db, name, sheets):
+    # 整体替换工作表索引 (顺序即标签顺序); 从索引中移除的工作表不会删除其集合
+    sheets = normalize_sheets(name, sheets)
+    _workbooks(db).update_one({"_id": name}, {"$set": {"sheets": sheets}}, upsert=True)
+    return {"name": name, "sheets": sheets}
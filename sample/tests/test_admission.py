@@ -0,0 +1,50 @@
+import gzip
+import json
+
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from server.admission import AdmissionController, install_admission_control
+from server.compression import install_compression
+
+
+class UnreadableBody:
+    # 被拒绝的请求体不允许被读取
+    def read(self, *args):
+        raise AssertionError("request body read before admission")
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+
+    @app.route("/import", methods=["POST"])
+    def import_rows():
+        return flask.jsonify(rows=len(flask.request.get_json()))
+
+    controller = AdmissionController(route_limits={"/import": 1})
+    install_compression(app)
+    install_admission_control(app, controller)
+    return app, controller
+
+
+def test_rejected_request_body_is_not_decompressed(app):
+    app, controller = app
+    controller.admit("/import")  # 另一个导入正在进行
+    response = app.test_client().post("/import", data=b"", headers={"Content-Encoding": "gzip"},
+                                      environ_overrides={"wsgi.input": UnreadableBody(), "CONTENT_LENGTH": "1024"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    controller.release("/import")
+
+
+def test_admitted_request_releases_after_response(app):
+    app, controller = app
+    body = gzip.compress(json.dumps([1, 2, 3]).encode("utf-8"))
+    response = app.test_client().post("/import", data=body, content_type="application/json",
+                                      headers={"Content-Encoding": "gzip"})
+    assert response.json == {"rows": 3}
+    assert controller._pending["/import"] == 1  # 响应发送完毕 (close) 之前仍占用名额
+    response.close()
+    assert controller._pending["/import"] == 0
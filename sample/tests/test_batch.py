@@ -0,0 +1,47 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from server.batch import run_batch
+
+
+def test_batch_rejects_operation_without_target():
+    # 第二个操作缺少 db_name, 在加锁排序前就应报错, 而不是比较 None 时抛出 TypeError
+    def get_db_handler(*key):
+        return mongomock.MongoClient()[key[1]][key[2]]
+
+    body = {"uri": "mongodb://x", "collection_name": "t",
+            "operations": [{"op": "get_table", "db_name": "d"}, {"op": "get_table"}]}
+    with pytest.raises(ValueError, match="db_name"):
+        run_batch(body, get_db_handler)
+
+
+def test_batch_save_all_swaps_in_new_collection(monkeypatch):
+    # SAVE_MODE 为 swap 时 /batch 的整表保存也通过临时集合原子替换, 不在正式集合上 delete_many
+    from server import config
+    from server.lock_registry import LockRegistry
+    from server.rows import ensure_indexes
+
+    monkeypatch.setattr(config, "SAVE_MODE", "swap")
+    db = mongomock.MongoClient()["d"]
+    ensure_indexes(db["t"])
+    db["t"].insert_one({"row": 0, "0": {"text": "old"}})
+
+    locks = LockRegistry()
+
+    class Handler:
+        def __init__(self, *key):
+            self.key = key
+            self.collection = db[key[2]]
+            self.lock = locks.get_lock(*key)
+
+    def delete_many(*args, **kwargs):
+        raise AssertionError("save_all must not delete rows in place")
+
+    monkeypatch.setattr(type(db["t"]), "delete_many", delete_many)
+    body = {"uri": "u", "db_name": "d", "collection_name": "t",
+            "operations": [{"op": "save_all", "args": {"data": [{"0": {"text": "new"}}], "merged_cells": []}}]}
+    assert run_batch(body, Handler)[0]["status"] == "success"
+    assert [row["0"]["text"] for row in db["t"].find({"row": {"$exists": True}})] == ["new"]
+    assert not [name for name in db.list_collection_names() if "__staging_" in name]
+    assert "row_1" in db["t"].index_information()
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from server.changes import CHANGE_COLLECTION, changes_since, ensure_change_indexes, versioned_write
+from server.versions import claim_version, read_versioned
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()["test_db"]["changes"]
+    ensure_change_indexes(collection)
+    with versioned_write(collection) as write:
+        write.describe("save_merged_cells", merged_cells=[])
+    return collection
+
+
+def test_pending_write_is_not_reported(collection):
+    # 另一个进程领取了版本 2 但还没有提交: 版本号和变更都还是版本 1 的
+    claim_version(collection)
+    assert changes_since(collection, 1) == (1, [], False)
+
+
+def test_recorded_entries_are_returned(collection):
+    with versioned_write(collection) as write:
+        write.describe("save_merged_cells", merged_cells=[[0, 0, 1, 1]])
+    version, changes, reset = changes_since(collection, 1)
+    assert (version, reset) == (2, False)
+    assert changes == [{"kind": "merged_cells", "merged_cells": [[0, 0, 1, 1]], "version": 2}]
+
+
+def test_load_during_write_then_refresh_sees_the_write(collection):
+    # 写入进行中加载整表得到的是版本 1, 写入提交后 changes?since=1 能拉到这次写入
+    started, go = threading.Event(), threading.Event()
+
+    def write():
+        with versioned_write(collection) as write:
+            write.describe("save_merged_cells", merged_cells=[[1, 1, 2, 2]])
+            started.set()
+            go.wait(5)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    started.wait(5)
+    version, _ = read_versioned(collection, lambda: None)
+    assert version == 1
+    assert changes_since(collection, version) == (1, [], False)
+    go.set()
+    writer.join()
+    assert changes_since(collection, version) == (2, [{"kind": "merged_cells", "merged_cells": [[1, 1, 2, 2]], "version": 2}],
+                                                  False)
+
+
+def test_missing_committed_entry_resets(collection):
+    # 已提交版本的日志已被清理: 要求整表重新加载
+    with versioned_write(collection) as write:
+        write.describe("save_merged_cells", merged_cells=[])
+    collection.database[CHANGE_COLLECTION].delete_many({"version": 2})
+    assert changes_since(collection, 1) == (2, [], True)
@@ -0,0 +1,38 @@
+from server.compact import decode_table, encode_table
+
+
+def cell(text, row_height=30, column_width=100, bold=False, background="#ffffff"):
+    return {"text": text, "foreground": "#000000", "background": background, "alignment": "left",
+            "font": {"bold": bold, "size": 10}, "row_height": row_height, "column_width": column_width}
+
+
+def test_round_trip_dedups_styles():
+    rows = [{"0": cell("a"), "1": cell("b", bold=True)},
+            {"0": cell("c", row_height=40), "1": cell("d", row_height=40, bold=True)}]
+    compact = encode_table(rows)
+    assert len(compact["styles"]) == 2
+    assert compact["style"] == [[0, 1], [0, 1]]
+    assert decode_table(compact) == rows
+
+
+def test_round_trip_empty_table_and_rows():
+    assert decode_table(encode_table([])) == []
+    assert decode_table(encode_table([{}, {}])) == [{}, {}]
+
+
+def test_round_trip_irregular_rows():
+    # 各行列数不同、中间缺单元格时, 缺少的单元格不会被补出来
+    rows = [{"2": cell("x", column_width=80)},
+            {},
+            {"0": cell("y", row_height=20), "1": cell("z", row_height=20, background="#ff0000")}]
+    compact = encode_table(rows)
+    assert compact["columns"] == 3
+    assert compact["text"] == [[None, None, "x"], [None, None, None], ["y", "z", None]]
+    assert decode_table(compact) == rows
+
+
+def test_non_cell_keys_are_ignored_and_defaults_filled():
+    compact = encode_table([{"_id": "abc", "type": "row", "0": {"text": "t"}}])
+    assert decode_table(compact) == [{"0": {"text": "t", "foreground": None, "background": None, "alignment": None,
+                                            "font": {"bold": False, "size": 10}, "row_height": None,
+                                            "column_width": None}}]
@@ -0,0 +1,29 @@
+import pytest
+
+from server import compression, config
+from server.compression import compress, decompress
+
+BODY = b'{"data": [' + b'{"0": {"text": "cell"}}, ' * 1000 + b'{}]}'
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_round_trip(encoding):
+    assert decompress(compress(BODY, encoding), encoding) == BODY
+
+
+@pytest.mark.parametrize("encoding", compression.supported_encodings())
+def test_body_over_limit_is_rejected(encoding, monkeypatch):
+    monkeypatch.setattr(config, "MAX_DECOMPRESSED_BYTES", len(BODY) - 1)
+    with pytest.raises(ValueError, match="too large"):
+        decompress(compress(BODY, encoding), encoding)
+
+
+def test_body_at_limit_is_accepted(monkeypatch):
+    monkeypatch.setattr(config, "MAX_DECOMPRESSED_BYTES", len(BODY))
+    assert decompress(compress(BODY, "gzip"), "gzip") == BODY
+
+
+@pytest.mark.parametrize("encoding", ["br", "deflate", ""])
+def test_unknown_encoding_is_rejected(encoding):
+    with pytest.raises(ValueError, match="Unsupported content encoding"):
+        decompress(compress(BODY, "gzip"), encoding)
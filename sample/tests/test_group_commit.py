@@ -0,0 +1,36 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from server.group_commit import GroupCommit
+from server.rows import PartialAppendError
+
+
+def test_partial_flush_reports_each_request():
+    # 合并后的 4 行只写入了前 3 行: 第一个请求的 2 行都已写入, 应该成功; 第二个请求只写入了 1 行
+    commit = GroupCommit(window_ms=2000, max_rows=4)
+    flushed = []
+
+    def flush(rows):
+        flushed.append(list(rows))
+        raise PartialAppendError("insert failed", 3)
+
+    results = {}
+
+    def submit(name, rows):
+        try:
+            results[name] = ("ok", commit.submit("table", rows, flush))
+        except PartialAppendError as e:
+            results[name] = ("error", e.inserted)
+
+    first = threading.Thread(target=submit, args=("first", ["a1", "a2"]))
+    first.start()
+    time.sleep(0.1)  # 让第一个请求成为 leader
+    submit("second", ["b1", "b2"])
+    first.join()
+
+    assert flushed == [["a1", "a2", "b1", "b2"]]
+    assert results == {"first": ("ok", None), "second": ("error", 1)}
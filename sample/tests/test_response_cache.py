@@ -0,0 +1,19 @@
+from server.response_cache import ResponseCache
+
+
+def test_evicts_least_recently_used_over_byte_limit():
+    cache = ResponseCache(max_bytes=10)
+    cache.get_or_load("a", "get_all", lambda: b"aaaa")
+    cache.get_or_load("b", "get_all", lambda: b"bbbb")
+    cache.get_or_load("a", "get_all", lambda: b"miss")  # 命中, a 变为最近使用
+    cache.get_or_load("c", "get_all", lambda: b"cccc")  # 超过 10 字节, 淘汰 b
+
+    assert cache.get_or_load("a", "get_all", lambda: b"miss")[0] == b"aaaa"
+    assert cache.get_or_load("b", "get_all", lambda: b"new")[0] == b"new"
+    assert cache._size <= 10
+
+
+def test_oversized_response_is_not_cached():
+    cache = ResponseCache(max_bytes=4)
+    cache.get_or_load("a", "get_all", lambda: b"too large")
+    assert cache.get_or_load("a", "get_all", lambda: b"new")[0] == b"new"
@@ -0,0 +1,74 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from server import rows
+from server.patch import apply_patch
+from server.rows import ROW_PROJECTION, drop_stale_staging, ensure_indexes, find_rows, staging_collection
+from server.tiled import append_table_rows
+
+
+@pytest.fixture
+def collection():
+    rows._numbered.clear()
+    collection = mongomock.MongoClient()["test_db"]["legacy"]
+    ensure_indexes(collection)
+    return collection
+
+
+def texts(collection):
+    return [row["0"]["text"] for row in find_rows(collection, {"_id": 0, **ROW_PROJECTION})]
+
+
+def test_legacy_table_append_then_patch(collection):
+    # 旧数据没有 row 字段; 追加后按 GUI 的行号修改, 应该改到对应的旧行而不是新追加的行
+    collection.insert_many([{"0": {"text": "L0"}}, {"0": {"text": "L1"}}])
+    collection.insert_one({"type": "merged_cells", "merged_cells": []})
+
+    append_table_rows(collection, [{"0": {"text": "A"}}])
+    assert texts(collection) == ["L0", "L1", "A"]
+
+    apply_patch(collection, {"cells": [{"row": 0, "col": 0, "data": {"text": "L0*"}},
+                                       {"row": 2, "col": 0, "data": {"text": "A*"}}]})
+    assert texts(collection) == ["L0*", "L1", "A*"]
+    assert [row["row"] for row in find_rows(collection, {"row": 1})] == [0, 1, 2]
+
+
+def test_legacy_table_patch_numbers_rows(collection):
+    collection.insert_many([{"0": {"text": "L0"}}, {"0": {"text": "L1"}}])
+
+    apply_patch(collection, {"cells": [{"row": 1, "col": 0, "data": {"text": "L1*"}}]})
+    assert texts(collection) == ["L0", "L1*"]
+    with pytest.raises(ValueError):
+        apply_patch(collection, {"cells": [{"row": 2, "col": 0, "data": {"text": "x"}}]})
+
+
+def test_concurrent_append_keeps_rows_contiguous(collection, monkeypatch):
+    # 另一个进程在取行号之后抢先写入了同一行号: 冲突的行重新取行号, 不丢行也不留空号
+    collection.insert_many([{"row": 0, "0": {"text": "A"}}])
+    stale = iter([1])
+    real_next = rows.next_row_number
+
+    def next_row_number(target):
+        start = next(stale, None)
+        if start is not None:
+            collection.insert_one({"row": 1, "0": {"text": "other"}})
+            return start
+        return real_next(target)
+
+    monkeypatch.setattr(rows, "next_row_number", next_row_number)
+    append_table_rows(collection, [{"0": {"text": "B"}}, {"0": {"text": "C"}}])
+    assert texts(collection) == ["A", "other", "B", "C"]
+    assert [row["row"] for row in find_rows(collection, {"row": 1})] == [0, 1, 2, 3]
+
+
+def test_drop_stale_staging_keeps_recent_and_other_tables(collection):
+    # 进程在重命名前退出留下的临时集合在打开表时删除; 刚创建的可能属于进行中的整表替换, 保留
+    database = collection.database
+    recent = staging_collection(collection)
+    recent.insert_one({"row": 0})
+    for name in ("legacy__staging_1000_ab", "legacy__staging_0123456789abcdef", "legacy2__staging_1000_ab"):
+        database[name].insert_one({"row": 0})
+    drop_stale_staging(collection)
+    staging = {name for name in database.list_collection_names() if "__staging_" in name}
+    assert staging == {recent.name, "legacy2__staging_1000_ab"}
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("flask")
+
+from server import config
+from server import server3
+from server.changes import versioned_write
+
+BASE = {"uri": "mongodb://test", "db_name": "test_db", "collection_name": "cached"}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(server3, "get_client", lambda uri: client)
+    monkeypatch.setattr(config, "SERVER_WORKERS", 2)
+    server3.db_handlers.clear()
+    server3.response_cache.invalidate(tuple(BASE.values()))
+    app = server3.app.test_client()
+    app.post("/save_all", json={**BASE, "data": [{"0": {"text": "r0c0"}}], "merged_cells": []})
+    return app, client["test_db"]["cached"]
+
+
+def get_all(app):
+    body = app.post("/get_all", json=BASE).json
+    return body["version"], body["data"]["table_data"][0]["0"]["text"]
+
+
+def test_read_during_other_worker_write_is_not_served_after_commit(app):
+    # 另一个 worker 正在写入时读到的结果不能在写入提交后继续作为最新结果返回
+    app, collection = app
+    started, go = threading.Event(), threading.Event()
+
+    def other_worker_write():
+        with versioned_write(collection):
+            collection.update_one({"row": 0}, {"$set": {"0.text": "new"}})
+            started.set()
+            go.wait(5)
+
+    writer = threading.Thread(target=other_worker_write)
+    writer.start()
+    started.wait(5)
+    assert get_all(app)[0] == 1
+    go.set()
+    writer.join()
+    assert get_all(app) == (2, "new")
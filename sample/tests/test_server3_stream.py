@@ -0,0 +1,50 @@
+import json
+import threading
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+pytest.importorskip("flask")
+
+from server import config
+from server import server3
+
+BASE = {"uri": "mongodb://test", "db_name": "test_db", "collection_name": "streamed"}
+NDJSON = {"Accept": server3.NDJSON_MIMETYPE}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(server3, "get_client", lambda uri: client)
+    monkeypatch.setattr(config, "STREAM_BATCH_SIZE", 2)
+    server3.db_handlers.clear()
+    app = server3.app.test_client()
+    data = [{"0": {"text": f"r{row}"}} for row in range(5)]
+    app.post("/save_all", json={**BASE, "data": data, "merged_cells": [[0, 0, 1, 1]]})
+    return app
+
+
+def lines(chunks):
+    return [json.loads(line) for chunk in chunks for line in chunk.splitlines() if line]
+
+
+def test_streams_all_pages_in_row_order(app):
+    rows = lines(app.post("/get_all", json=BASE, headers=NDJSON).response)
+    assert rows[0]["merged_cells"] == [[0, 0, 1, 1]]
+    assert [row["0"]["text"] for row in rows[1:-1]] == ["r0", "r1", "r2", "r3", "r4"]
+    assert rows[-1] == {"type": "end", "rows": 5}
+
+
+def test_write_between_pages_is_not_blocked_and_ends_stream(app):
+    # 发送过程中不占读锁: 写入不会等到流结束; 之后的页版本号不同, 以 error 行结束
+    chunks = iter(app.post("/get_table", json=BASE, headers=NDJSON, buffered=False).response)
+    received = [next(chunks), next(chunks)]  # header 和第一页
+    writer = threading.Thread(target=app.post, args=("/patch_cells",),
+                              kwargs={"json": {**BASE, "patch": {"cells": [{"row": 4, "col": 0, "data": {"text": "new"}}]}}})
+    writer.start()
+    writer.join(5)
+    assert not writer.is_alive()
+    rows = lines(received + list(chunks))
+    assert [row["0"]["text"] for row in rows[1:3]] == ["r0", "r1"]
+    assert rows[-1]["type"] == "error"
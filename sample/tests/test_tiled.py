@@ -0,0 +1,53 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from server import tiled
+from server.rows import ensure_indexes
+from server.tiled import append_table_rows, apply_tiled_patch, build_tiles, find_table_rows, get_layout
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()["test_db"]["tiled"]
+    ensure_indexes(collection)
+    collection.insert_one({"type": "layout", "layout": "tiled", "block_size": 2, "codec": "none"})
+    collection.insert_many(build_tiles([{"0": {"text": "r0"}}, {"0": {"text": "r1"}}, {"0": {"text": "r2"}}], 2, "none"))
+    return collection
+
+
+def texts(collection):
+    return [row["0"]["text"] for row in find_table_rows(collection)]
+
+
+def test_append_retries_when_last_tile_changed(collection, monkeypatch):
+    # 读取最后一块之后另一个进程改写了它: 比较并交换失败, 重新读取后继续, 两边的行都保留
+    real_decode = tiled.decode_block
+    raced = []
+
+    def decode_block(tile):
+        if not raced:
+            raced.append(True)
+            collection.update_one({"block": 1}, {"$set": tiled.make_tile(1, [{"0": {"text": "r2"}}, {"0": {"text": "other"}}],
+                                                                          "none", 1)})
+        return real_decode(tile)
+
+    monkeypatch.setattr(tiled, "decode_block", decode_block)
+    append_table_rows(collection, [{"0": {"text": "new"}}])
+    assert texts(collection) == ["r0", "r1", "r2", "other", "new"]
+
+
+def test_patch_retries_on_conflict(collection, monkeypatch):
+    real_decode = tiled.decode_block
+    raced = []
+
+    def decode_block(tile):
+        if not raced and tile["block"] == 0:
+            raced.append(True)
+            collection.update_one({"block": 0}, {"$set": tiled.make_tile(0, [{"0": {"text": "x0"}}, {"0": {"text": "x1"}}],
+                                                                          "none", 1)})
+        return real_decode(tile)
+
+    monkeypatch.setattr(tiled, "decode_block", decode_block)
+    apply_tiled_patch(collection, get_layout(collection), {"cells": [{"row": 0, "col": 0, "data": {"text": "p0"}}]})
+    assert texts(collection) == ["p0", "x1", "r2"]
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from server import config
+from server.changes import versioned_write
+from server.versions import VersionConflict, claim_version, get_version, read_versioned
+
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()["test_db"]["versions"]
+    with versioned_write(collection):
+        collection.insert_one({"row": 0, "0": {"text": "r0c0"}})
+    return collection
+
+
+def cell_text(collection):
+    return collection.find_one({"row": 0})["0"]["text"]
+
+
+def test_read_during_write_sees_old_version_and_old_data(collection):
+    # 写入进行中读到的版本号仍是旧版本, 数据也是旧数据; 写入提交后才读到新版本
+    started, go = threading.Event(), threading.Event()
+
+    def write():
+        with versioned_write(collection):
+            started.set()
+            go.wait(5)
+            collection.update_one({"row": 0}, {"$set": {"0.text": "new"}})
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    started.wait(5)
+    assert read_versioned(collection, cell_text, collection) == (1, "r0c0")
+    go.set()
+    writer.join()
+    assert read_versioned(collection, cell_text, collection) == (2, "new")
+
+
+def test_expected_version_waits_for_pending_write(collection):
+    # 带旧版本号的写入在进行中的写入提交后才判断, 不会覆盖它
+    started, go = threading.Event(), threading.Event()
+
+    def write():
+        with versioned_write(collection):
+            started.set()
+            go.wait(5)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    started.wait(5)
+    threading.Timer(0.1, go.set).start()
+    with pytest.raises(VersionConflict):
+        claim_version(collection, expected=1)
+    writer.join()
+    assert get_version(collection) == 2
+
+
+def test_abandoned_claim_is_taken_over(collection, monkeypatch):
+    claim_version(collection)  # 写入进程在提交前退出
+    monkeypatch.setattr(config, "WRITE_CLAIM_TIMEOUT", 0)
+    claim = claim_version(collection)
+    assert (claim.version, claim.stolen) == (2, True)